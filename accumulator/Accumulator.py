@@ -0,0 +1,129 @@
+import numpy as np
+import threading
+
+# Running per-channel, per-sample statistics over many captures.
+#
+# Everything's kept in preallocated arrays and updated in place
+# with whole-frame numpy operations, so adding a frame doesn't
+# allocate anything: the mean and variance use Welford's update
+# (numerically fine over millions of frames, unlike sum/sum of
+# squares), min/max are np.minimum/np.maximum into the running
+# arrays, and the histogram of ADC codes for each channel is one
+# np.add.at.
+class Accumulator:
+    """ Running statistics of captures.
+
+    Attributes
+    ----------
+
+    enabled : bool
+       Whether the DAQ adds each capture.
+    count : int
+       Number of frames added since the last reset().
+    mean : numpy.ndarray
+       (numChannels, numSamples) float64 running mean.
+    min : numpy.ndarray
+       (numChannels, numSamples) running minimum.
+    max : numpy.ndarray
+       (numChannels, numSamples) running maximum.
+    hist : numpy.ndarray
+       (numChannels, bins) int64 histogram of ADC codes, or None
+       if there's no histogram.
+    codes : numpy.ndarray
+       Lowest ADC code in each histogram bin.
+    shift : int
+       Histogram bins are 2**shift codes wide.
+
+    """
+    def __init__(self,
+                 numChannels,
+                 numSamples,
+                 dtype = np.int16,
+                 histogram = True,
+                 shift = 0):
+        self.numChannels = numChannels
+        self.numSamples = numSamples
+        self.enabled = False
+        self.shift = shift
+        shape = (numChannels, numSamples)
+        info = np.iinfo(dtype)
+        self.mean = np.zeros(shape, np.float64)
+        self._m2 = np.zeros(shape, np.float64)
+        self.min = np.zeros(shape, dtype)
+        self.max = np.zeros(shape, dtype)
+        self._delta = np.zeros(shape, np.float64)
+        self._delta2 = np.zeros(shape, np.float64)
+        if histogram:
+            bins = (int(info.max) - int(info.min) + 1) >> shift
+            self.hist = np.zeros( (numChannels, bins), np.int64 )
+            self.codes = (np.arange(bins) << shift) + int(info.min)
+            # flat histogram index of each sample = (code >> shift) + this
+            self._offset = (np.arange(numChannels)*bins - (int(info.min) >> shift))[:, None]
+            self._index = np.zeros(shape, np.intp)
+        else:
+            self.hist = None
+            self.codes = None
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Start over."""
+        with self._lock:
+            self.count = 0
+            self.mean[...] = 0
+            self._m2[...] = 0
+            self.min[...] = np.iinfo(self.min.dtype).max
+            self.max[...] = np.iinfo(self.max.dtype).min
+            if self.hist is not None:
+                self.hist[...] = 0
+
+    def add(self, frame):
+        """Add a (numChannels, numSamples) frame."""
+        with self._lock:
+            self.count += 1
+            # Welford: mean += (x - mean)/n, m2 += (x - old mean)*(x - new mean)
+            np.subtract(frame, self.mean, out=self._delta)
+            np.divide(self._delta, self.count, out=self._delta2)
+            self.mean += self._delta2
+            np.subtract(frame, self.mean, out=self._delta2)
+            self._delta *= self._delta2
+            self._m2 += self._delta
+            np.minimum(self.min, frame, out=self.min)
+            np.maximum(self.max, frame, out=self.max)
+            if self.hist is not None:
+                np.right_shift(frame, self.shift, out=self._index, casting='unsafe')
+                self._index += self._offset
+                np.add.at(self.hist.reshape(-1), self._index.reshape(-1), 1)
+
+    def variance(self):
+        """Sample variance of each sample (a new array)."""
+        with self._lock:
+            return self._m2/max(self.count - 1, 1)
+
+    def std(self):
+        """Sample standard deviation of each sample (a new array)."""
+        return np.sqrt(self.variance())
+
+    def result(self):
+        """Copy of everything, consistent with each other, as a dict."""
+        with self._lock:
+            return { 'count' : self.count,
+                     'mean' : self.mean.copy(),
+                     'variance' : self._m2/max(self.count - 1, 1),
+                     'min' : self.min.copy(),
+                     'max' : self.max.copy(),
+                     'hist' : None if self.hist is None else self.hist.copy(),
+                     'codes' : self.codes }
+
+    def __repr__(self):
+        if self.count == 0:
+            return "Accumulator(%s, no frames)" % ("enabled" if self.enabled else "disabled")
+        std = self.std()
+        s = "Accumulator(%s, %d frames)\n" % ("enabled" if self.enabled else "disabled", self.count)
+        s += "%4s %10s %10s %8s %8s\n" % ("ch", "mean", "rms noise", "min", "max")
+        for ch in range(self.numChannels):
+            s += "%4d %10.3f %10.3f %8d %8d\n" % (ch, np.mean(self.mean[ch]),
+                                                   np.sqrt(np.mean(std[ch]**2)),
+                                                   np.min(self.min[ch]),
+                                                   np.max(self.max[ch]))
+        return s.rstrip('\n')
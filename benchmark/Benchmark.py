@@ -0,0 +1,294 @@
+import numpy as np
+import json
+import logging
+import os
+import platform
+import sys
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Benchmarks for the acquisition-to-display pipeline.
+#
+# Each benchmark returns a dict of named results, each one
+#
+#   { 'value' : number, 'unit' : 'ms', 'better' : 'lower' }
+#
+# ('better' is 'lower' for times and 'higher' for rates), so a
+# run is just a dict of those that gets dumped to JSON along with
+# where and how it ran (see run_info), and compare() can flag
+# anything that got worse against a stored baseline. Nothing in
+# here needs a display: the Waveframe is built on plain Agg
+# canvases (see agg_waveframe), and the ScrolledLog benchmark is
+# skipped if Tk can't open a window.
+
+def result(value, unit, better = 'lower'):
+    return { 'value' : float(value), 'unit' : unit, 'better' : better }
+
+def time_per_call(fn, repeat = 5, target = 0.1):
+    """Median time (s) per call of fn() over repeat runs of about target seconds."""
+    # figure out how many calls make a run
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for i in range(number):
+            fn()
+        dt = time.perf_counter() - start
+        if dt >= target/10 or number >= 1000000:
+            break
+        number *= 10
+    number = max(1, int(number*target/max(dt, 1.E-9)))
+    times = []
+    for r in range(repeat):
+        start = time.perf_counter()
+        for i in range(number):
+            fn()
+        times.append((time.perf_counter() - start)/number)
+    return float(np.median(times))
+
+def fake_device(seed = 0):
+    """A FakeRFSoC with a tone plus noise, unthrottled."""
+    from fakeRFSoC import FakeRFSoC
+    dev = FakeRFSoC(seed)
+    dev.noise = 10.
+    return dev
+
+def bench_capture(dev, numChannels, numSamples, **kw):
+    """Time to fill one capture buffer."""
+    buf = np.zeros( (numChannels, numSamples), np.int16 )
+    dt = time_per_call(lambda: dev.internal_capture(buf, numChannels), **kw)
+    return { 'capture' : result(1.E3*dt, 'ms'),
+             'capture_MBps' : result(buf.nbytes/dt/1.E6, 'MB/s', 'higher') }
+
+def bench_fft(numChannels, numSamples, **kw):
+    """Spectrum of one frame (all channels)."""
+    from spectrum.Spectrum import Spectrum
+    spectrum = Spectrum()
+    frame = fake_frame(numChannels, numSamples)
+    dt = time_per_call(lambda: spectrum.compute(frame), **kw)
+    return { 'fft' : result(1.E3*dt, 'ms'),
+             'fft_Msps' : result(frame.size/dt/1.E6, 'Msamples/s', 'higher') }
+
+def bench_pack(numChannels, numSamples, bits = 12, chunkFrames = 16, **kw):
+    """Encoding a chunk of frames for a packed recording (see recorder.Packed)."""
+    from recorder.Packed import encode_chunk, decode_chunk
+    from recorder.Recorder import record_dtype
+    records = np.zeros(chunkFrames, record_dtype(numChannels, numSamples))
+    records['data'] = fake_frame(numChannels, numSamples)
+    # lossless whatever the codec settings (16 bits with a shift
+    # has to fall back to raw samples when the low bits aren't zero)
+    for b, shift, delta, compression in ( (bits, 0, False, 'none'), (bits, 0, True, 'zlib'),
+                                          (16, 4, False, 'none'), (16, 4, True, 'zlib') ):
+        decoded = decode_chunk(encode_chunk(records, b, shift, delta, compression),
+                               records.dtype, delta, compression)
+        if not (decoded == records).all():
+            raise ValueError("packing %d bits shift %d delta %s %s doesn't round-trip" %
+                             (b, shift, delta, compression))
+    r = {}
+    for compression in ( 'none', 'zlib' ):
+        encoded = encode_chunk(records, bits, 0, False, compression)
+        dt = time_per_call(lambda: encode_chunk(records, bits, 0, False, compression), **kw)
+        r['pack_%s' % compression] = result(records['data'].nbytes/dt/1.E6, 'MB/s', 'higher')
+        r['pack_%s_ratio' % compression] = result(len(encoded)/records['data'].nbytes, '')
+    return r
+
+def bench_correlate(numChannels, numSamples, **kw):
+    """Cross-correlating one frame (every pair of channels, see spectrum.Correlator)."""
+    from spectrum.Correlator import Correlator
+    correlator = Correlator()
+    frame = fake_frame(numChannels, numSamples)
+    dt = time_per_call(lambda: correlator.add(frame), **kw)
+    def compute():
+        correlator._stale = True
+        correlator.compute()
+    dtc = time_per_call(compute, **kw)
+    return { 'correlate' : result(1.E3*dt, 'ms'),
+             'correlate_delays' : result(1.E3*dtc, 'ms') }
+
+def fake_frame(numChannels, numSamples):
+    frame = np.zeros( (numChannels, numSamples), np.int16 )
+    fake_device().internal_capture(frame, numChannels)
+    return frame
+
+@contextmanager
+def agg_waveframe():
+    """Context in which waveframe.Waveframe builds on Agg canvases, no Tk.
+
+    Only the Tk parts are swapped out (the canvases' Tk widgets, the
+    toolbars and the notebook itself), so plot() runs the same code
+    as it does on screen, minus copying the pixels to the window.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    import waveframe.Waveframe as module
+
+    class Widget:
+        master = None
+        def pack(self, **kw):
+            pass
+
+    class Canvas(FigureCanvasAgg):
+        def __init__(self, figure, master = None):
+            super().__init__(figure)
+        def blit(self, bbox = None):
+            pass
+        def get_tk_widget(self):
+            return Widget()
+
+    class Toolbar:
+        def __init__(self, *args, **kw):
+            pass
+        def pack(self, **kw):
+            pass
+        def update(self):
+            pass
+
+    class Notebook:
+        def __init__(self, parent):
+            self._selected = 0
+        def add(self, *args, **kw):
+            pass
+        def bind(self, *args, **kw):
+            pass
+        def select(self, tab = None):
+            if tab is not None:
+                self._selected = tab
+            return self._selected
+        def index(self, tab):
+            return tab
+
+    saved = (module.FigureCanvasTkAgg, module.NavigationToolbar2Tk,
+             module.ttk, module.Waveframe.__bases__)
+    module.FigureCanvasTkAgg = Canvas
+    module.NavigationToolbar2Tk = Toolbar
+    module.ttk = type('ttk', (), { 'Frame' : staticmethod(lambda *args, **kw: Widget()),
+                                   'Notebook' : Notebook })
+    module.Waveframe.__bases__ = (Notebook,)
+    try:
+        yield module.Waveframe
+    finally:
+        (module.FigureCanvasTkAgg, module.NavigationToolbar2Tk,
+         module.ttk, module.Waveframe.__bases__) = saved
+
+def bench_plot(numSamples, **kw):
+    """Waveframe.plot of one channel, on each tab (Agg, no display)."""
+    from spectrum.Spectrum import Spectrum
+    from spectrum.Waterfall import Waterfall
+    frames = [ fake_frame(1, numSamples) for i in range(8) ]
+    spectrum = Spectrum()
+    waterfall = Waterfall()
+    spectra = []
+    for frame in frames:
+        db = spectrum.compute(frame)
+        waterfall.add(db)
+        spectra.append(db[0])
+    freqs = spectrum.result[1]
+    r = {}
+    with agg_waveframe() as Waveframe:
+        wf = Waveframe(None)
+        for tab in ( 'time', 'freq', 'waterfall' ):
+            wf.select(wf.tabs.index(tab))
+            n = [0]
+            def plot():
+                i = n[0] % len(frames)
+                n[0] += 1
+                wf.plot(frames[i][0], freqs, spectra[i], waterfall.view(0))
+            plot()
+            r['plot_' + tab] = result(1.E3*time_per_call(plot, **kw), 'ms')
+    return r
+
+def bench_log(messages = 1000, **kw):
+    """ScrolledLog: putting a batch of messages in the widget."""
+    import tkinter as tk
+    from scrolledlog.ScrolledLog import ScrolledLog
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        logger.info("Skipping the log benchmark: %s" % str(e))
+        return {}
+    try:
+        root.withdraw()
+        log = ScrolledLog(root, logging.getLogger('benchmark.log'))
+        log.pack()
+        records = [ logging.LogRecord('benchmark', logging.DEBUG, __file__, 0,
+                                      "message %d", (i,), None)
+                    for i in range(messages) ]
+        dt = time_per_call(lambda: log.display_batch(records), **kw)
+        log.logger.removeHandler(log.queue_handler)
+        return { 'log_batch' : result(1.E3*dt, 'ms'),
+                 'log_rate' : result(messages/dt, 'messages/s', 'higher') }
+    finally:
+        root.destroy()
+
+def bench_pipeline(device, numChannels, numSamples, seconds = 1., spectrum = True):
+    """End to end: a DaqCore running flat out for a while."""
+    from daqcore.DaqCore import DaqCore
+    daq = DaqCore(numChannels, numSamples, getattr(device, 'sampleRate', 3.E9))
+    daq.dev = device
+    daq.spectrum.enabled = spectrum
+    consumed = [0]
+    def consumer(seq):
+        consumed[0] += 1
+    daq.add_consumer(consumer)
+    daq.start()
+    start = time.perf_counter()
+    time.sleep(seconds)
+    daq.stop()
+    dt = time.perf_counter() - start
+    frames = daq.framesAcquired
+    r = { 'pipeline_fps' : result(frames/dt, 'frames/s', 'higher'),
+          'pipeline_MBps' : result(frames*numChannels*numSamples*2/dt/1.E6, 'MB/s', 'higher') }
+    for name, stage in daq.instrument.report()['stages'].items():
+        r['pipeline_%s_p50' % name] = result(stage['p50'], 'ms')
+    return r
+
+def run_info():
+    """Where and how this ran."""
+    info = { 'time' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+             'host' : platform.node(),
+             'machine' : platform.machine(),
+             'platform' : platform.platform(),
+             'python' : platform.python_version(),
+             'numpy' : np.__version__,
+             'cpus' : os.cpu_count() }
+    try:
+        import matplotlib
+        info['matplotlib'] = matplotlib.__version__
+    except ImportError:
+        pass
+    return info
+
+def save(path, results, info = None):
+    with open(path, 'w') as f:
+        json.dump({ 'info' : run_info() if info is None else info,
+                    'results' : results }, f, indent=1, sort_keys=True)
+
+def load(path):
+    """Returns (info, results) from a saved run."""
+    with open(path) as f:
+        run = json.load(f)
+    return (run['info'], run['results'])
+
+def compare(results, baseline, tolerance = 0.2):
+    """Results that got worse than baseline by more than tolerance (fractional).
+
+    Returns a list of (name, baseline value, value, change), where
+    change is the fractional change in the bad direction.
+    """
+    regressions = []
+    for name, r in sorted(results.items()):
+        if name not in baseline:
+            continue
+        old = baseline[name]['value']
+        new = r['value']
+        if old <= 0:
+            continue
+        if r['better'] == 'lower':
+            change = new/old - 1.
+        else:
+            change = 1. - new/old
+        if change > tolerance:
+            regressions.append((name, old, new, change))
+    return regressions
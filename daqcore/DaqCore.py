@@ -0,0 +1,593 @@
+import numpy as np
+
+import logging
+import os, configparser, threading, time
+
+from ringbuffer.RingBuffer import RingBuffer
+from spectrum.Spectrum import Spectrum
+from spectrum.Waterfall import Waterfall
+from spectrum.Correlator import Correlator
+from recorder.Recorder import Recorder
+from recorder.Packed import PackedRecorder
+from recorder.Summary import Summary, summary_path
+from trigger.TriggerEngine import TriggerEngine
+from instrument.Instrumentation import Instrumentation
+from netstream.StreamServer import StreamServer, DEFAULT_PORT
+from framebus.FrameBus import FrameBus, DEFAULT_NAME
+from accumulator.Accumulator import Accumulator
+from pipeline.Pipeline import Pipeline
+# OverlayError and load_overlay used to live here
+from daqcore.OverlayManager import OverlayManager, OverlayError, load_overlay
+from daqcore.OverlayManager import default_maxRecentOverlays
+
+logger = logging.getLogger(__name__)
+
+# these values are *default* if no ini is present!
+default_numChannels = 4
+default_numSamples = 2048
+default_sampleRate = 3.E9
+# number of frames kept in the capture ring
+default_ringDepth = 8
+# ADC resolution, for dBFS (16 = full int16 range)
+default_adcBits = 16
+# spectrum window and averaging ('none', 'exp', 'peak' or 'mean')
+default_window = 'hann'
+default_spectrumAverage = 'none'
+default_spectrumAlpha = 0.1
+# waterfall history (spectra), frequency columns and decimation
+default_waterfallDepth = 256
+default_waterfallBins = 512
+default_waterfallEvery = 1
+# cross-correlation/delays between channels: window, averaging
+# ('none', 'exp' or 'mean'), weighting ('none' or 'phat') and the
+# largest lag (samples) searched (0 = all)
+default_correlate = False
+default_correlateWindow = 'rect'
+default_correlateAverage = 'mean'
+default_correlateAlpha = 0.1
+default_correlateWeighting = 'none'
+default_correlateMaxLag = 0
+# pipeline timing
+default_instrument = True
+# order of the processing stages (comma separated names, stages not
+# listed run after these) and the ones that start switched off
+default_pipeline = 'spectrum, correlate, accumulate'
+default_pipelineOff = ''
+# threads running independent stages side by side (0 = all on the
+# acquisition thread, -1 = one fewer than the CPUs, at most 2)
+default_pipelineWorkers = -1
+# recording file rotation (0 = never)
+default_recordMaxBytes = 0
+default_recordMaxSeconds = 0
+# recorder's own buffer (MB) for frames waiting to be written
+default_recordBuffer = 64
+# packed recording (see recorder.Packed): bits per sample, zero low
+# bits, delta encoding, compression ('none', 'zlib' or 'lzma'),
+# frames per chunk and encoding threads. 16 bits, no delta and no
+# compression records plain .daq files.
+default_recordBits = 16
+default_recordShift = 0
+default_recordDelta = False
+default_recordCompression = 'none'
+default_recordChunkFrames = 16
+default_recordWorkers = 2
+# per-frame summary index next to recordings (see recorder.Summary),
+# with the power in these bands: 'low:high' in MHz, comma separated
+default_recordSummary = True
+default_summaryBands = ''
+# network streaming port (0 = don't stream)
+default_streamPort = 0
+# shared memory frame bus name ('' = don't publish) and depth (frames)
+default_busName = ''
+default_busDepth = 32
+
+def read_config(path = "rfsoc-pydaq.ini"):
+    """Returns the rfsoc_pydaq section of the ini file (empty if there isn't one)."""
+    config = configparser.ConfigParser()
+    config.read(path)
+    # just create a blank guy, fallbacks handle it
+    if 'rfsoc_pydaq' not in config:
+        config['rfsoc_pydaq'] = {}
+    return config['rfsoc_pydaq']
+
+# The GUI-free part of the DAQ: the overlay, the acquisition
+# thread, the ring, the trigger, the processing pipeline (spectrum
+# etc.) and the consumers (recorder etc.). Nothing in here imports Tk or matplotlib, so
+# it can run headless (see rfsoc-pydaq-headless.py) and the Tk
+# front end (RFSoC_Daq in rfsoc-pydaq.py) is just something that
+# looks at the ring every so often.
+class DaqCore:
+    """ GUI-free core of the DAQ.
+
+    Attributes
+    ----------
+
+    numChannels : int
+       Number of channels accessible (usually 4).
+    numSamples : int
+       Number of samples in an acquisition.
+    sampleRate : float
+       Sample rate in Hz.
+    ring : ringbuffer.RingBuffer
+       Ring of the last ringDepth acquired (triggered) frames.
+    adcBuffer : numpy.ndarray
+       View of the last acquired frame in the ring (read-only property)
+    dev : pynq.Overlay
+       Class representing the current programmed RFSoC
+    overlays : daqcore.OverlayManager
+       Recent overlays and the overlay discovery cache
+       (see load() and reload()).
+    spectrum : spectrum.Spectrum
+       Spectrum engine. It's computed for every capture on the
+       acquisition thread unless spectrum.enabled is False.
+    waterfall : spectrum.Waterfall
+       Rolling history of the spectra (unless waterfall.enabled
+       is False).
+    correlator : spectrum.Correlator
+       Cross-correlation/delay engine for every pair of channels.
+       It's fed every accepted capture on the acquisition thread
+       when correlator.enabled is True; the delays are only worked
+       out when asked for (correlator.delays).
+    trigger : trigger.TriggerEngine
+       Software trigger: frames it rejects never get to the
+       spectrum, the display or the consumers.
+    accumulator : accumulator.Accumulator
+       Running mean/variance/min/max/histogram of every accepted
+       frame, when it's enabled (see average()).
+    pipeline : pipeline.Pipeline
+       Processing stages every accepted capture goes through on
+       the acquisition thread, before the consumers: 'spectrum',
+       'correlate' and 'accumulate' to start with. Add stages
+       (filtering, calibration...) with pipeline.add().
+    lastAccepted : int
+       Sequence number of the newest frame the trigger passed.
+    instrument : instrument.Instrumentation
+       Per-stage timing and throughput counters. Type
+       daq.instrument in the console for a table.
+    recorder : recorder.Recorder
+       Recorder streaming captures to disk (None if not recording).
+    recordBuffer : float
+       MB of frames a new recorder buffers while the disk catches up.
+    recordCodec : dict
+       bits, shift, delta, compression, chunkFrames and workers for
+       packed (.daqz) recordings (see recorder.Packed).
+    recordSummary : bool
+       Write a summary index (.sum) next to recordings.
+    summaryBands : list
+       (low, high) edges in Hz of the bands in the summary index.
+    server : netstream.StreamServer
+       Server streaming captures over the network (None if not
+       serving).
+    bus : framebus.FrameBus
+       Shared memory ring every capture is published to, for other
+       processes (None if not publishing, see publish()).
+    consumers : list
+       Functions called with the sequence number of each new
+       frame, on the acquisition thread. Use add_consumer() and
+       remove_consumer() to change it.
+    framesAcquired : int
+       Number of frames captured since the last start(),
+       triggered or not.
+
+    """
+    def __init__(self,
+                 numChannels = 4,
+                 numSamples = 2048,
+                 sampleRate = 3.E9,
+                 ringDepth = 8
+                 ):
+        self.numChannels = numChannels
+        self.numSamples = numSamples
+        self.sampleRate = sampleRate
+        # Every capture goes straight into the next slot of the ring,
+        # so nothing gets allocated or copied per frame, and the
+        # acquisition thread never waits on the display: whatever
+        # the display didn't get to just gets dropped.
+        self.ring = RingBuffer(ringDepth, numChannels, numSamples)
+        self.dev = None
+        self.overlays = OverlayManager()
+        self.spectrum = Spectrum(sampleRate)
+        self.waterfall = Waterfall()
+        self.correlator = Correlator(sampleRate)
+        self.trigger = TriggerEngine()
+        self.accumulator = Accumulator(numChannels, numSamples)
+        self._spectrumAverage = None
+        self.instrument = Instrumentation()
+        self.pipeline = Pipeline(self.instrument)
+        self.pipeline.add('spectrum', self._spectrum_stage,
+                          owner=lambda: self.spectrum)
+        self.pipeline.add('correlate', self._correlate_stage,
+                          owner=lambda: self.correlator)
+        self._accumulate = self.pipeline.add('accumulate', self._accumulate_stage,
+                                             owner=lambda: self.accumulator)
+        self.lastAccepted = -1
+        self.recorder = None
+        self.recordMaxBytes = 0
+        self.recordMaxSeconds = 0
+        self.recordBuffer = default_recordBuffer
+        self.recordCodec = { 'bits' : default_recordBits,
+                             'shift' : default_recordShift,
+                             'delta' : default_recordDelta,
+                             'compression' : default_recordCompression,
+                             'chunkFrames' : default_recordChunkFrames,
+                             'workers' : default_recordWorkers }
+        self.recordSummary = default_recordSummary
+        self.summaryBands = []
+        self.server = None
+        self.streamPort = 0
+        self.bus = None
+        self.busName = default_busName
+        self.busDepth = default_busDepth
+        self.consumers = []
+        self._thread = None
+        self._stop = threading.Event()
+        self._maxFrames = 0
+
+    def configure(self, cfg):
+        """Apply the (non-structural) settings from a config section."""
+        average = cfg.get('spectrumAverage', fallback=default_spectrumAverage)
+        enabled = self.spectrum.enabled
+        self.spectrum = Spectrum(self.sampleRate,
+                                 cfg.get('window', fallback=default_window),
+                                 2**(cfg.getint('adcBits', fallback=default_adcBits)-1),
+                                 None if average == 'none' else average,
+                                 cfg.getfloat('spectrumAlpha', fallback=default_spectrumAlpha))
+        self.spectrum.enabled = enabled
+        self.waterfall.configure(cfg.getint('waterfallDepth',
+                                            fallback=default_waterfallDepth),
+                                 cfg.getint('waterfallBins',
+                                            fallback=default_waterfallBins),
+                                 cfg.getint('waterfallEvery',
+                                            fallback=default_waterfallEvery))
+        average = cfg.get('correlateAverage', fallback=default_correlateAverage)
+        weighting = cfg.get('correlateWeighting', fallback=default_correlateWeighting)
+        self.correlator = Correlator(self.sampleRate,
+                                     cfg.get('correlateWindow', fallback=default_correlateWindow),
+                                     None if average == 'none' else average,
+                                     cfg.getfloat('correlateAlpha', fallback=default_correlateAlpha),
+                                     None if weighting == 'none' else weighting,
+                                     cfg.getint('correlateMaxLag', fallback=default_correlateMaxLag) or None)
+        self.correlator.enabled = cfg.getboolean('correlate',
+                                                 fallback=default_correlate)
+        self.instrument.enabled = cfg.getboolean('instrument',
+                                                 fallback=default_instrument)
+        self.pipeline.order = [name.strip() for name in
+                               cfg.get('pipeline', fallback=default_pipeline).split(',')
+                               if name.strip()]
+        for name in cfg.get('pipelineOff', fallback=default_pipelineOff).split(','):
+            if name.strip() in self.pipeline:
+                self.pipeline[name.strip()].enabled = False
+        workers = cfg.getint('pipelineWorkers', fallback=default_pipelineWorkers)
+        if workers < 0:
+            workers = min(2, (os.cpu_count() or 1) - 1)
+        self.pipeline.workers = workers
+        self.recordMaxBytes = cfg.getint('recordMaxBytes',
+                                         fallback=default_recordMaxBytes)
+        self.recordMaxSeconds = cfg.getfloat('recordMaxSeconds',
+                                             fallback=default_recordMaxSeconds)
+        self.recordBuffer = cfg.getfloat('recordBuffer',
+                                         fallback=default_recordBuffer)
+        self.recordCodec = { 'bits' : cfg.getint('recordBits',
+                                                 fallback=default_recordBits),
+                             'shift' : cfg.getint('recordShift',
+                                                  fallback=default_recordShift),
+                             'delta' : cfg.getboolean('recordDelta',
+                                                      fallback=default_recordDelta),
+                             'compression' : cfg.get('recordCompression',
+                                                     fallback=default_recordCompression),
+                             'chunkFrames' : cfg.getint('recordChunkFrames',
+                                                        fallback=default_recordChunkFrames),
+                             'workers' : cfg.getint('recordWorkers',
+                                                    fallback=default_recordWorkers) }
+        self.recordSummary = cfg.getboolean('recordSummary',
+                                            fallback=default_recordSummary)
+        self.summaryBands = []
+        for band in cfg.get('summaryBands', fallback=default_summaryBands).split(','):
+            if band.strip():
+                low, high = band.split(':')
+                self.summaryBands.append((float(low)*1.E6, float(high)*1.E6))
+        self.streamPort = cfg.getint('streamPort',
+                                     fallback=default_streamPort)
+        self.busName = cfg.get('busName', fallback=default_busName)
+        self.busDepth = cfg.getint('busDepth', fallback=default_busDepth)
+
+    def load(self, file_path = None):
+        """Load an overlay (see load_overlay). Returns True if it worked.
+
+        With no file_path, loads the most recent one (overlays.recent).
+        """
+        if file_path is None:
+            if not self.overlays.recent:
+                logger.error("No recent overlay to load")
+                return False
+            file_path = self.overlays.recent[0]
+        return self._load(self.overlays.load, file_path)
+
+    def reload(self):
+        """Reload the current overlay's Python without reprogramming the
+        device, if its bitstream hasn't changed. Returns True if it worked."""
+        if self.overlays.current is None:
+            logger.error("No overlay loaded to reload")
+            return False
+        return self._load(lambda path: self.overlays.reload(self.dev, path),
+                          self.overlays.current)
+
+    def _load(self, loader, file_path):
+        self.stop()
+        base, extension = os.path.splitext(os.path.basename(file_path))
+        try:
+            self.dev = loader(file_path)
+            if self.server is not None:
+                self.server.overlay = type(self.dev).__name__
+            if self.bus is not None:
+                self.bus.set_overlay(type(self.dev).__name__)
+        except OverlayError as e:
+            logger.error(str(e))
+            return False
+        except Exception as e:
+            logger.error("Unable to load module %s" % base)
+            logger.error(str(e))
+            return False
+        logger.info("Loaded %s in %.2f s (import %.2f s, overlay %.2f s)" %
+                    (base, sum(self.overlays.timing.values()),
+                     self.overlays.timing['import'], self.overlays.timing['overlay']))
+        return True
+
+    @property
+    def adcBuffer(self):
+        frame, seq, timestamp = self.ring.latest()
+        if frame is None:
+            return self.ring.frames[0]
+        return frame
+
+    @property
+    def framesAcquired(self):
+        return self.trigger.frames
+
+    @property
+    def running(self):
+        """True if the acquisition thread is running."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def capture(self):
+        """Capture one frame into the ring and return its sequence number.
+
+        Returns -1 if the frame didn't trigger.
+        """
+        inst = self.instrument
+        t = inst.start()
+        buf = self.trigger.begin_write(self.ring)
+        self.dev.internal_capture(buf, self.numChannels)
+        t = inst.lap('capture', t)
+        inst.count(buf.nbytes)
+        first, seq = self.trigger.commit(self.ring, buf)
+        t = inst.lap('trigger', t)
+        if first < 0:
+            return -1
+        start = time.perf_counter()
+        self.pipeline.run(buf, first, seq)
+        t = inst.start()
+        for s in range(first, seq+1):
+            for consumer in self.consumers:
+                consumer(s)
+        t = inst.lap('consumers', t)
+        self.lastAccepted = seq
+        self.trigger.deadTime += time.perf_counter() - start
+        return seq
+
+    # the built in pipeline stages
+    def _spectrum_stage(self, data, out, seq):
+        db = self.spectrum.compute(data, seq)
+        if self.waterfall.enabled:
+            self.waterfall.add(db)
+        return db
+
+    def _correlate_stage(self, data, out, seq):
+        self.correlator.add(data, seq)
+
+    def _accumulate_stage(self, data, out, seq):
+        if self._accumulate.input is not None:
+            self.accumulator.add(data)
+            return
+        # pre-trigger frames too
+        for s in range(self.pipeline.first, seq+1):
+            frame = self.ring.get(s)
+            if frame is not None:
+                self.accumulator.add(frame)
+
+    def average(self, on = True):
+        """Start (over) averaging captures, or stop.
+
+        Resets and enables the accumulator and switches the spectrum
+        to the mean of every capture; average(False) stops the
+        accumulator and puts the spectrum averaging back.
+        """
+        if on:
+            if not self.accumulator.enabled:
+                self._spectrumAverage = self.spectrum.average
+            self.accumulator.reset()
+            self.accumulator.enabled = True
+            self.spectrum.average = 'mean'
+            self.spectrum.reset()
+        elif self.accumulator.enabled:
+            self.accumulator.enabled = False
+            self.spectrum.average = self._spectrumAverage
+            self.spectrum.reset()
+
+    # consumers gets replaced rather than modified, so the
+    # acquisition thread never sees it change under it
+    def add_consumer(self, fn):
+        """Call fn(seq) for every new frame, on the acquisition thread."""
+        self.consumers = self.consumers + [fn]
+
+    def remove_consumer(self, fn):
+        self.consumers = [c for c in self.consumers if c != fn]
+
+    def record(self, path, maxBytes = None, maxSeconds = None, **codec):
+        """Start streaming every capture to path (see recorder.Recorder).
+
+        Records a packed file (see recorder.Packed) if path ends in
+        .daqz or recordCodec (updated by any codec keywords: bits,
+        shift, delta, compression, chunkFrames, workers) asks for
+        fewer than 16 bits, delta encoding or compression. If
+        recordSummary is set, there's a summary index (.sum) next to
+        it (see recorder.Summary).
+        """
+        if self.recorder is not None:
+            logger.error("Already recording to %s!" % self.recorder.path)
+            return
+        overlay = '' if self.dev is None else type(self.dev).__name__
+        codec = dict(self.recordCodec, **codec)
+        args = (self.ring, path,
+                self.sampleRate,
+                overlay,
+                self.recordMaxBytes if maxBytes is None else maxBytes,
+                self.recordMaxSeconds if maxSeconds is None else maxSeconds)
+        if (path.endswith('.daqz') or codec['bits'] < 16 or codec['delta'] or
+            codec['compression'] != 'none'):
+            self.recorder = PackedRecorder(*args, bufferBytes=int(self.recordBuffer*(1<<20)),
+                                           **codec)
+        else:
+            self.recorder = Recorder(*args, bufferBytes=int(self.recordBuffer*(1<<20)))
+        if self.recordSummary:
+            self.recorder.summary = Summary(summary_path(self.recorder.path),
+                                            self.recorder.path,
+                                            self.numChannels, self.numSamples,
+                                            self.sampleRate,
+                                            self.spectrum.fullScale,
+                                            self.summaryBands,
+                                            self.spectrum.window,
+                                            self.recorder.maxBytes > 0 or
+                                            self.recorder.maxSeconds > 0)
+        self.recorder.start()
+        self.add_consumer(self.recorder.push)
+        logger.info("Recording to %s" % self.recorder.path)
+
+    def stop_recording(self):
+        if self.recorder is None:
+            return
+        self.remove_consumer(self.recorder.push)
+        self.recorder.stop()
+        self.recorder = None
+
+    def serve(self, port = None, host = ''):
+        """Start streaming every capture over TCP (see netstream.StreamServer)."""
+        if self.server is not None:
+            logger.error("Already streaming on port %d!" % self.server.port)
+            return
+        if port is None:
+            port = self.streamPort if self.streamPort else DEFAULT_PORT
+        overlay = '' if self.dev is None else type(self.dev).__name__
+        self.server = StreamServer(self.ring, port, host,
+                                   self.sampleRate, overlay)
+        try:
+            self.server.start()
+        except OSError as e:
+            logger.error("Can't stream on port %d: %s" % (port, str(e)))
+            self.server = None
+            return
+        self.add_consumer(self.server.push)
+        logger.info("Streaming on port %d" % self.server.port)
+
+    def stop_serving(self):
+        if self.server is None:
+            return
+        self.remove_consumer(self.server.push)
+        self.server.stop()
+        self.server = None
+
+    def publish(self, name = None, depth = None):
+        """Start publishing every capture on a shared memory frame bus.
+
+        Other processes read it with framebus.FrameBusReader(name).
+        """
+        if self.bus is not None:
+            logger.error("Already publishing on frame bus %s!" % self.bus.name)
+            return
+        if name is None:
+            name = self.busName if self.busName else DEFAULT_NAME
+        overlay = '' if self.dev is None else type(self.dev).__name__
+        try:
+            self.bus = FrameBus(self.ring, name,
+                                depth if depth is not None else self.busDepth,
+                                self.sampleRate, overlay)
+        except FileExistsError:
+            logger.error("Can't publish frame bus %s: something else is using that name" % name)
+            return
+        except OSError as e:
+            logger.error("Can't publish frame bus %s: %s" % (name, str(e)))
+            return
+        self.add_consumer(self.bus.push)
+        logger.info("Publishing on frame bus %s" % name)
+
+    def stop_publishing(self):
+        if self.bus is None:
+            return
+        self.remove_consumer(self.bus.push)
+        self.bus.close()
+        self.bus = None
+
+    def acquire(self):
+        """Single capture into the ring. Returns its seq, -1 if nothing came of it."""
+        if self.dev is None:
+            logger.error("No RFSoC device is loaded!")
+            return -1
+        if self.running:
+            logger.error("Can't do a single acquire in continuous mode!")
+            return -1
+        seq = self.capture()
+        if seq < 0:
+            logger.info("No trigger")
+        return seq
+
+    def start(self, frames = 0):
+        """Start continuous acquisition, stopping after frames triggered frames (0 = never)."""
+        if self.dev is None:
+            logger.error("No RFSoC device is loaded!")
+            return
+        if self.running:
+            return
+        self.trigger.reset()
+        self.instrument.reset()
+        self._maxFrames = frames
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._acquire_loop,
+                                        name="rfsoc-acquire",
+                                        daemon=True)
+        logger.debug("Starting continuous acquisition")
+        self._thread.start()
+
+    def stop(self):
+        """Stop continuous acquisition, waiting for the last capture."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        logger.debug("Stopped: %d frames acquired, %d triggered" %
+                     (self.framesAcquired, self.trigger.triggers))
+
+    def _acquire_loop(self):
+        while not self._stop.is_set():
+            try:
+                self.capture()
+            except Exception as e:
+                logger.error("internal_capture failed, stopping: %s" % str(e))
+                break
+            if self._maxFrames and self.trigger.accepted >= self._maxFrames:
+                break
+
+    def status(self):
+        """One-line status: rates, per-stage p50/p99, trigger and recorder."""
+        s = self.instrument.summary()
+        if self.trigger.active:
+            s += " | trig %.1f Hz %.0f%% rej" % (self.trigger.rate,
+                                                 100*self.trigger.rejectedFraction)
+        if self.recorder is not None:
+            s += " | rec %d (%d dropped)" % (self.recorder.framesWritten,
+                                             self.recorder.framesDropped)
+        if self.server is not None and self.server.clients:
+            s += " | net %d" % len(self.server.clients)
+        if self.bus is not None:
+            s += " | bus %d" % self.bus.framesPublished
+        return s
@@ -0,0 +1,301 @@
+import logging
+import os, sys, importlib, inspect, hashlib, re, configparser, time
+
+logger = logging.getLogger(__name__)
+
+# how many recent overlays to remember
+default_maxRecentOverlays = 8
+
+class OverlayError(Exception):
+    pass
+
+def find_overlay(module):
+    """Find the overlay class in a module.
+
+    That's the subclass of either pynq's Overlay or a FakeOverlay
+    defined in the module itself, and it has to have a callable
+    internal_capture. Raises OverlayError if there isn't one.
+    """
+    # sorted by name, so the same module always gives the same class
+    classes = [ obj for name, obj in inspect.getmembers(module, inspect.isclass) ]
+    # First try to find an Overlay or module.FakeOverlay module.
+    # FakeOverlays need to be defined in the same file.
+    overlayClass = None
+    for obj in classes:
+        if obj.__name__ == 'Overlay' and obj.__module__ == 'pynq.overlay':
+            overlayClass = obj
+        if obj.__name__ == 'FakeOverlay' and obj.__module__ == module.__name__:
+            overlayClass = obj
+    if overlayClass is None:
+        raise OverlayError("Unable to find Overlay class in module %s" % module.__name__)
+    logger.debug("Found Overlay class %s from module %s" % (overlayClass.__name__ , overlayClass.__module__ ))
+    # Now find the module to call
+    theClass = None
+    for obj in classes:
+        if issubclass(obj, overlayClass) and obj != overlayClass:
+            theClass = obj
+    if theClass is None:
+        raise OverlayError("Unable to find a subclassed Overlay in module %s" % module.__name__)
+    captureFn = getattr(theClass, "internal_capture", None)
+    if not callable(captureFn):
+        raise OverlayError("The Overlay %s in module %s has no callable internal_capture method" % (theClass.__name__ , module.__name__ ))
+    logger.debug("Found RFSoC overlay %s" % theClass.__name__)
+    return theClass
+
+class OverlayDir:
+    """Context with an overlay's directory as the current directory
+    and first on the module search path (overlays find their bitstream
+    and helpers relative to it)."""
+    def __init__(self, file_path):
+        self.path = os.path.dirname(os.path.abspath(file_path))
+
+    def __enter__(self):
+        self._syspath = sys.path
+        logger.debug("Adding directory %s to module search path" % self.path)
+        sys.path = sys.path[:1] + [ self.path ] + sys.path[1:]
+        self._curdir = os.path.abspath(os.curdir)
+        logger.debug("Changing directory to %s" % self.path)
+        os.chdir(self.path)
+        return self
+
+    def __exit__(self, *exc):
+        logger.debug("Restoring original module search path")
+        sys.path = self._syspath
+        logger.debug("Going back to original directory %s" % self._curdir)
+        os.chdir(self._curdir)
+        return False
+
+def load_overlay(file_path):
+    """Load an overlay file describing an RFSoC instance.
+    The overlay needs to support being created bare (just "overlayName()")
+    and must support the "internal_capture( buffer, numChannels )"
+    function. Returns the created overlay.
+    """
+    return OverlayManager().load(file_path)
+
+# Keeps track of overlays: which ones were loaded recently (saved
+# in the ini, so they can be loaded again without a dialog), which
+# class in each file is the overlay (found once per version of the
+# file, not on every load), and a hash of the bitstream that's on
+# the device now.
+#
+# The last one is what makes reload() fast: if the overlay's
+# bitstream hasn't changed since it was downloaded, reloading
+# just re-imports the Python and creates the overlay with
+# download=False, so pynq attaches to the already-programmed
+# device instead of programming it again.
+class OverlayManager:
+    """ Overlay discovery cache and recent overlay list.
+
+    Attributes
+    ----------
+
+    path : str
+       ini file the recent overlays are saved in (None = not saved).
+    recent : list
+       Absolute paths of recently loaded overlays, newest first.
+    maxRecent : int
+       Number of recent overlays kept.
+    current : str
+       Absolute path of the last overlay loaded (None if none).
+    programmed : tuple
+       (bitstream path, sha256) downloaded to the device by the
+       last full load, or None if unknown.
+    timing : dict
+       Seconds the last load() took to import the overlay's Python
+       ('import') and to create the overlay, including programming
+       the bitstream ('overlay').
+
+    """
+    def __init__(self, path = None, maxRecent = default_maxRecentOverlays):
+        self.path = None if path is None else os.path.abspath(path)
+        self.recent = []
+        self.maxRecent = maxRecent
+        self.current = None
+        self.programmed = None
+        self.timing = { 'import' : 0., 'overlay' : 0. }
+        # absolute path -> (mtime, overlay class)
+        self._classes = {}
+        # absolute path -> names of the helper modules its import brought in
+        self._helpers = {}
+        # bitstream path -> (mtime, size, sha256)
+        self._hashes = {}
+        if self.path is not None:
+            self.read(self.path)
+
+    def read(self, path):
+        """Pick up the recent overlays from an ini file (and save them there)."""
+        self.path = os.path.abspath(path)
+        config = configparser.ConfigParser()
+        config.read(self.path)
+        if 'rfsoc_pydaq' not in config:
+            return
+        cfg = config['rfsoc_pydaq']
+        self.maxRecent = cfg.getint('maxRecentOverlays',
+                                    fallback=self.maxRecent)
+        recent = cfg.get('recentOverlays', fallback='')
+        self.recent = [ p for p in recent.split(os.pathsep) if p ][:self.maxRecent]
+
+    def remember(self, file_path):
+        """Put an overlay at the top of the recent list."""
+        file_path = os.path.abspath(file_path)
+        self.recent = ([ file_path ] +
+                       [ p for p in self.recent if p != file_path ])[:self.maxRecent]
+        if self.path is not None:
+            try:
+                self._save()
+            except OSError as e:
+                logger.warning("Unable to save recent overlays to %s: %s" % (self.path, e))
+
+    def _save(self):
+        # Just rewrite the recentOverlays line: writing the whole
+        # thing back out with configparser would lose the comments.
+        line = "recentOverlays = %s\n" % os.pathsep.join(self.recent)
+        try:
+            with open(self.path) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            lines = []
+        key = re.compile(r'\s*recentOverlays\s*[=:]', re.IGNORECASE)
+        for i, l in enumerate(lines):
+            if key.match(l):
+                lines[i] = line
+                break
+        else:
+            if lines and not lines[-1].endswith('\n'):
+                lines[-1] += '\n'
+            # it has to go in our section, after its last setting
+            # (not at the end of the file, which may be another section)
+            start = None
+            for i, l in enumerate(lines):
+                if l.strip() == '[rfsoc_pydaq]':
+                    start = i
+                    break
+            if start is None:
+                lines += [ "[rfsoc_pydaq]\n", line ]
+            else:
+                end = start + 1
+                for i in range(start + 1, len(lines)):
+                    l = lines[i].strip()
+                    if l.startswith('['):
+                        break
+                    if l and not l.startswith(('#', ';')):
+                        end = i + 1
+                lines.insert(end, line)
+        with open(self.path, 'w') as f:
+            f.writelines(lines)
+
+    def discover(self, file_path):
+        """Import an overlay file and return its overlay class.
+
+        The class is cached until the file's modification time
+        changes, and then the module's reloaded.
+        """
+        file_path = os.path.abspath(file_path)
+        mtime = os.stat(file_path).st_mtime_ns
+        cached = self._classes.get(file_path)
+        if cached is not None and cached[0] == mtime:
+            logger.debug("Using cached overlay class %s" % cached[1].__name__)
+            return cached[1]
+        base, extension = os.path.splitext(os.path.basename(file_path))
+        with OverlayDir(file_path) as overlayDir:
+            logger.debug("Going to try to import %s", base)
+            before = set(sys.modules)
+            module = sys.modules.get(base)
+            if module is not None and getattr(module, '__file__', None) == file_path:
+                module = importlib.reload(module)
+            else:
+                sys.modules.pop(base, None)
+                module = importlib.import_module(base, package=None)
+            try:
+                theClass = find_overlay(module)
+            except OverlayError:
+                del sys.modules[module.__name__]
+                raise
+        helpers = self._helpers.setdefault(file_path, set())
+        for name in set(sys.modules) - before:
+            moduleFile = getattr(sys.modules[name], '__file__', None)
+            if (name != base and moduleFile is not None and
+                os.path.abspath(moduleFile).startswith(overlayDir.path + os.sep)):
+                helpers.add(name)
+        self._classes[file_path] = (mtime, theClass)
+        return theClass
+
+    def bitstream_hash(self, bitfile):
+        """sha256 of a bitstream (cached until it changes)."""
+        st = os.stat(bitfile)
+        cached = self._hashes.get(bitfile)
+        if cached is not None and cached[:2] == (st.st_mtime_ns, st.st_size):
+            return cached[2]
+        h = hashlib.sha256()
+        with open(bitfile, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        digest = h.hexdigest()
+        self._hashes[bitfile] = (st.st_mtime_ns, st.st_size, digest)
+        return digest
+
+    def load(self, file_path, download = True):
+        """Create the overlay in file_path and return it.
+
+        With download=False the overlay is asked not to program the
+        bitstream (pynq's Overlay download argument): only do that if
+        the device already has it (see reload()).
+        """
+        file_path = os.path.abspath(file_path)
+        logger.debug("Asked to load overlay at %s" % file_path)
+        start = time.perf_counter()
+        theClass = self.discover(file_path)
+        imported = time.perf_counter()
+        with OverlayDir(file_path):
+            if download:
+                dev = theClass()
+            else:
+                dev = theClass(download=False)
+            logger.debug("Created RFSoC device")
+            bitfile = getattr(dev, 'bitfile_name', None)
+            if download:
+                self.programmed = None
+                if bitfile is not None and os.path.exists(bitfile):
+                    self.programmed = (os.path.abspath(bitfile),
+                                       self.bitstream_hash(bitfile))
+        self.timing = { 'import' : imported - start,
+                        'overlay' : time.perf_counter() - imported }
+        self.current = file_path
+        self.remember(file_path)
+        return dev
+
+    def can_reload(self, dev):
+        """True if dev's bitstream is what's on the device, unchanged."""
+        bitfile = getattr(dev, 'bitfile_name', None)
+        if bitfile is None or self.programmed is None:
+            return False
+        bitfile = os.path.abspath(bitfile)
+        if bitfile != self.programmed[0] or not os.path.exists(bitfile):
+            return False
+        return self.bitstream_hash(bitfile) == self.programmed[1]
+
+    def reload(self, dev, file_path = None):
+        """Reload an overlay's Python, keeping the programmed device if we can.
+
+        The helper modules the overlay imported from its directory are
+        reloaded too. If the bitstream changed (or there's no bitstream
+        to compare), this is just a full load.
+        """
+        file_path = file_path or self.current
+        if file_path is None:
+            raise OverlayError("No overlay to reload")
+        file_path = os.path.abspath(file_path)
+        with OverlayDir(file_path):
+            for name in sorted(self._helpers.get(file_path, ())):
+                module = sys.modules.get(name)
+                if module is not None:
+                    logger.debug("Reloading %s" % name)
+                    importlib.reload(module)
+        # make discover() re-import it even if it hasn't changed
+        self._classes.pop(file_path, None)
+        if dev is not None and self.can_reload(dev):
+            logger.info("Bitstream unchanged: reloading %s without downloading" % os.path.basename(file_path))
+            return self.load(file_path, download=False)
+        logger.info("Reloading %s" % os.path.basename(file_path))
+        return self.load(file_path)
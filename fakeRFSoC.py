@@ -1,24 +1,125 @@
 import numpy as np
+import time
 
 class FakeOverlay:
     def __init__(self):
         return
 
 
+# Fake RFSoC for testing without the board. Everything's
+# done on whole (numChannels, numSamples) arrays in scratch
+# buffers that are only reallocated if the capture size changes,
+# so repeated captures don't allocate anything big and it's fast
+# enough to stand in for the hardware when looking at throughput.
+#
+# The signal model parameters (frequency, amplitude, noise,
+# pulseAmplitude) can be either a single value for all channels
+# or a list with one value per channel.
 class FakeRFSoC(FakeOverlay):
-    def __init__(self):
+    """ Simulated RFSoC overlay.
+
+    Attributes
+    ----------
+
+    sampleRate : float
+       Sample rate in Hz.
+    frequency : float or list
+       Tone frequency in Hz.
+    amplitude : float or list
+       Tone amplitude in ADC counts.
+    randomPhase : bool
+       Pick a new random tone phase every capture (untriggered).
+    noise : float or list
+       RMS of the white noise in ADC counts.
+    bits : int
+       ADC resolution: samples are rounded and clipped to this many
+       signed bits.
+    pulseRate : float
+       Probability per channel per capture of an injected pulse.
+    pulseAmplitude : float or list
+       Peak amplitude of injected pulses in ADC counts.
+    pulseWidth : int
+       Length of injected pulses in samples.
+    captureRate : float
+       If nonzero, internal_capture sleeps to limit captures to
+       this many per second, like real hardware would.
+    pulses : int
+       Number of pulses injected so far.
+
+    """
+    def __init__(self, seed=None):
         self.sampleRate = 3.E9
         self.frequency = 24.E6
         self.amplitude = 100
+        self.randomPhase = True
+        self.noise = 0.
+        self.bits = 12
+        self.pulseRate = 0.
+        self.pulseAmplitude = 1000
+        self.pulseWidth = 16
+        self.captureRate = 0.
+        self.pulses = 0
+        self._rng = np.random.default_rng(seed)
+        self._shape = None
+        self._nextCapture = 0.
         return
 
-    def internal_capture(self, buf, numChan):
-        period = self.sampleRate/self.frequency
-        numSamples = len(buf[0])
-        for i in range(numChan):
-            phase = np.random.ranf()*2*np.pi
-            # We want sin(2pi t/period)
-            for j in range(numSamples):
-                val = np.int16(self.amplitude*np.sin(2*np.pi*j/period + phase))
-                buf[i][j] = val
+    def _prepare(self, numChan, numSamples):
+        if self._shape == (numChan, numSamples):
+            return
+        self._shape = (numChan, numSamples)
+        self._t = np.arange(numSamples, dtype=np.float64)
+        self._work = np.empty( (numChan, numSamples), np.float64 )
+        self._noise = np.empty( (numChan, numSamples), np.float64 )
+        self._phase = np.zeros( numChan, np.float64 )
+        self._draw = np.empty( numChan, np.float64 )
+
+    def _perChannel(self, value, numChan):
+        return np.broadcast_to(np.asarray(value, dtype=np.float64), (numChan,))
 
+    def _pulseShape(self, width):
+        # single cycle of a Gaussian-windowed sine, looks enough like a pulse
+        x = np.linspace(-3., 3., width)
+        return np.exp(-x*x/2)*np.sin(np.pi*x/1.5)
+
+    def internal_capture(self, buf, numChan):
+        numSamples = buf.shape[-1]
+        self._prepare(numChan, numSamples)
+        work = self._work
+        # tones: amplitude*sin(2pi f t + phase)
+        omega = 2*np.pi*self._perChannel(self.frequency, numChan)/self.sampleRate
+        if self.randomPhase:
+            self._rng.random(out=self._phase)
+            self._phase *= 2*np.pi
+        np.multiply(omega[:, None], self._t, out=work)
+        work += self._phase[:, None]
+        np.sin(work, out=work)
+        work *= self._perChannel(self.amplitude, numChan)[:, None]
+        # white noise
+        if np.any(np.asarray(self.noise) != 0):
+            self._rng.standard_normal(out=self._noise)
+            self._noise *= self._perChannel(self.noise, numChan)[:, None]
+            work += self._noise
+        # pulses: at most one per channel per capture
+        if self.pulseRate > 0:
+            self._rng.random(out=self._draw)
+            hits = np.flatnonzero(self._draw < self.pulseRate)
+            if len(hits):
+                width = min(self.pulseWidth, numSamples)
+                shape = self._pulseShape(width)
+                amps = self._perChannel(self.pulseAmplitude, numChan)
+                for ch in hits:
+                    pos = self._rng.integers(0, numSamples - width + 1)
+                    work[ch, pos:pos+width] += amps[ch]*shape
+                self.pulses += len(hits)
+        # ADC quantization and clipping
+        top = 2**(self.bits-1)
+        np.rint(work, out=work)
+        np.clip(work, -top, top-1, out=work)
+        np.copyto(buf[:numChan], work, casting='unsafe')
+        # throttle
+        if self.captureRate > 0:
+            now = time.perf_counter()
+            self._nextCapture = max(self._nextCapture + 1./self.captureRate, now)
+            if self._nextCapture > now:
+                time.sleep(self._nextCapture - now)
@@ -0,0 +1,172 @@
+import numpy as np
+import logging
+import struct
+import threading
+from multiprocessing import shared_memory
+
+logger = logging.getLogger(__name__)
+
+# Frame bus layout
+#
+# The bus is a ring of frames in one named block of shared memory
+# (multiprocessing.shared_memory: /dev/shm/<name> on Linux), so any
+# Python process on the same machine can attach to it by name and
+# read the frames in place. Everything is little endian. The block
+# starts with a header:
+#
+#   magic        8s   b'RFSBUS\0\0'
+#   version      I
+#   headerSize   I    offset of the slot table
+#   depth        I    number of frames in the ring
+#   numChannels  I
+#   numSamples   I
+#   framesOffset I    offset of the first frame
+#   sampleRate   d
+#   dtype        8s   numpy dtype string of the samples ('<i2')
+#   overlay      256s name of the overlay (utf-8, zero padded)
+#
+# and at STATE_OFFSET the part that changes, three q's:
+#
+#   seq          newest frame published (-1 = none yet)
+#   writeIndex   slot being written now (or next)
+#   closed       1 once the writer's gone
+#
+# Then the slot table, seqs q[depth] and timestamps d[depth], and
+# the frames, (depth, numChannels, numSamples) samples starting at
+# framesOffset. Frame seq is in slot seq % depth.
+#
+# There's one writer and no locks. Same as ringbuffer.RingBuffer,
+# the writer marks a slot's seq -1 before it touches the frame and
+# puts the new seq in once it's done, so a reader checks the slot's
+# seq after reading a frame: if it's not the one it started with,
+# the frame got overwritten under it. A reader that falls behind by
+# more than depth frames sees the seqs it wanted are gone, and
+# just skips ahead; the writer never knows readers are there.
+MAGIC = b'RFSBUS\0\0'
+VERSION = 1
+DEFAULT_NAME = 'rfsoc-pydaq'
+HEADER_SIZE = 1024
+STATE_OFFSET = 512
+_headerFormat = '<8sIIIIIId8s256s'
+
+def bus_size(depth, numChannels, numSamples, dtype = np.int16):
+    """(framesOffset, total size) of a bus's shared memory block."""
+    framesOffset = HEADER_SIZE + 16*depth
+    # frames start on a page
+    framesOffset = (framesOffset + 4095) & ~4095
+    return (framesOffset,
+            framesOffset + depth*numChannels*numSamples*np.dtype(dtype).itemsize)
+
+# Publishes the DAQ's frames on the bus. It's a DAQ consumer, like
+# the Recorder and the StreamServer: push(seq) is called on the
+# acquisition thread for every new frame, and copies it from the
+# DAQ's ring into the next slot of the bus. That's the only cost,
+# one memcpy per frame, and it never waits on anybody.
+class FrameBus:
+    """ Shared memory ring frames are published to.
+
+    Attributes
+    ----------
+
+    ring : ringbuffer.RingBuffer
+       Ring the frames come from.
+    name : str
+       Name of the shared memory block (what readers attach to).
+    depth : int
+       Number of frames in the bus's ring. Readers can fall this
+       far behind before they start missing frames.
+    seq : int
+       Bus sequence number of the newest frame published (it
+       counts frames published, not the DAQ's seqs).
+    frames : numpy.ndarray
+       (depth, numChannels, numSamples) frames, in shared memory.
+    seqs : numpy.ndarray
+       Bus sequence number of the frame in each slot (-1 if invalid).
+    timestamps : numpy.ndarray
+       Capture time of each slot's frame.
+    framesPublished : int
+       Frames published since it was created.
+
+    """
+    def __init__(self,
+                 ring,
+                 name = DEFAULT_NAME,
+                 depth = 32,
+                 sampleRate = 3.E9,
+                 overlay = ''):
+        self.ring = ring
+        self.name = name
+        self.depth = depth
+        self.seq = -1
+        self.framesPublished = 0
+        # only so close() can't unmap the block in the middle of a push()
+        self._lock = threading.Lock()
+        dtype = ring.frames.dtype
+        framesOffset, size = bus_size(depth, ring.numChannels, ring.numSamples, dtype)
+        self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        buf = self._shm.buf
+        struct.pack_into(_headerFormat, buf, 0,
+                         MAGIC, VERSION, HEADER_SIZE, depth,
+                         ring.numChannels, ring.numSamples, framesOffset,
+                         sampleRate, dtype.str.encode(),
+                         overlay.encode()[:256])
+        self._state = np.ndarray(3, '<i8', buf, STATE_OFFSET)
+        self.seqs = np.ndarray(depth, '<i8', buf, HEADER_SIZE)
+        self.timestamps = np.ndarray(depth, '<f8', buf, HEADER_SIZE + 8*depth)
+        self.frames = np.ndarray((depth, ring.numChannels, ring.numSamples),
+                                 dtype, buf, framesOffset)
+        self.seqs[:] = -1
+        self._state[:] = (-1, 0, 0)
+        logger.debug("Frame bus %s: %d frames, %d bytes" % (name, depth, size))
+
+    def push(self, seq):
+        """Publish DAQ frame seq. Called from the acquisition thread."""
+        frame = self.ring.get(seq)
+        if frame is None:
+            return
+        with self._lock:
+            if self._shm is None:
+                return
+            n = self.seq + 1
+            slot = n % self.depth
+            self._state[1] = slot
+            self.seqs[slot] = -1
+            np.copyto(self.frames[slot], frame)
+            self.timestamps[slot] = self.ring.timestamp(seq)
+            self.seqs[slot] = n
+            self._state[0] = n
+            self.seq = n
+            self.framesPublished += 1
+
+    def set_overlay(self, overlay):
+        """Change the overlay name in the header (for readers attaching from now on)."""
+        if self._shm is None:
+            return
+        struct.pack_into('256s', self._shm.buf, struct.calcsize(_headerFormat) - 256,
+                         overlay.encode()[:256])
+
+    def close(self):
+        """Tell readers we're done and remove the bus.
+
+        Readers that are attached keep their mapping until they close.
+        """
+        with self._lock:
+            if self._shm is None:
+                return
+            self._state[2] = 1
+            # the views into the block have to go before it can be closed
+            del self._state, self.seqs, self.timestamps, self.frames
+            try:
+                self._shm.close()
+            except BufferError:
+                # somebody still has a view of a frame: it goes when they do
+                logger.debug("Frame bus %s still has views, leaving it mapped" % self.name)
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+            self._shm = None
+
+    def __repr__(self):
+        return "FrameBus(%s): %d frames deep, %d published" % (self.name, self.depth,
+                                                               self.framesPublished)
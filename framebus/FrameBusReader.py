@@ -0,0 +1,221 @@
+import numpy as np
+import logging
+import os
+import struct
+import time
+from multiprocessing import shared_memory
+
+from framebus.FrameBus import MAGIC, VERSION, DEFAULT_NAME, STATE_OFFSET, _headerFormat
+
+logger = logging.getLogger(__name__)
+
+def attach(name):
+    """Attach to an existing shared memory block without owning it."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching registers the block with this
+        # process's resource tracker, which would remove it when this
+        # process exits, out from under the writer.
+        shm = shared_memory.SharedMemory(name=name)
+        if os.name == 'posix':
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+# Reads frames off a FrameBus from any process (see the layout in
+# framebus/FrameBus.py). It only ever reads the block, so readers
+# can't hold up the writer or each other. Frames are views into the
+# shared memory: get() and latest() work like RingBuffer's (check
+# valid(seq) once you're done with the view), and read() steps
+# through the frames in order, copying each one out and checking it
+# wasn't overwritten while it was being copied.
+#
+#   bus = FrameBusReader('rfsoc-pydaq')
+#   for frame, seq, timestamp in bus:
+#       ...
+class FrameBusReader:
+    """ Reader attached to a FrameBus.
+
+    Attributes
+    ----------
+
+    name : str
+       Name of the bus.
+    depth : int
+       Number of frames in the bus's ring.
+    numChannels : int
+       Number of channels.
+    numSamples : int
+       Samples per channel in each frame.
+    sampleRate : float
+       Sample rate (Hz).
+    overlay : str
+       Overlay the DAQ is running.
+    frames : numpy.ndarray
+       (depth, numChannels, numSamples) view of the bus's frames.
+    seqs : numpy.ndarray
+       Sequence number of the frame in each slot (-1 if invalid).
+    timestamps : numpy.ndarray
+       Capture time of each slot's frame.
+    next : int
+       Sequence number read() returns next. It starts at the next
+       frame to be published; set it to oldest to start with what's
+       already on the bus.
+    interval : float
+       How often (s) read() checks for a new frame while it waits.
+    framesRead : int
+       Frames read() returned.
+    framesMissed : int
+       Frames read() skipped because they were overwritten before
+       it got to them (it fell behind by more than depth frames).
+
+    """
+    def __init__(self, name = DEFAULT_NAME, interval = 0.0005):
+        self.name = name
+        self.interval = interval
+        self._shm = attach(name)
+        buf = self._shm.buf
+        (magic, version, headerSize, depth, numChannels, numSamples,
+         framesOffset, sampleRate, dtype, overlay) = struct.unpack_from(_headerFormat, buf, 0)
+        if magic != MAGIC:
+            self._shm.close()
+            raise ValueError("%s is not a frame bus" % name)
+        if version != VERSION:
+            self._shm.close()
+            raise ValueError("%s is frame bus version %d, not %d" % (name, version, VERSION))
+        self.depth = depth
+        self.numChannels = numChannels
+        self.numSamples = numSamples
+        self.sampleRate = sampleRate
+        self.overlay = overlay.rstrip(b'\0').decode()
+        dtype = np.dtype(dtype.rstrip(b'\0').decode())
+        self._state = np.ndarray(3, '<i8', buf, STATE_OFFSET)
+        self.seqs = np.ndarray(depth, '<i8', buf, headerSize)
+        self.timestamps = np.ndarray(depth, '<f8', buf, headerSize + 8*depth)
+        self.frames = np.ndarray((depth, numChannels, numSamples), dtype,
+                                 buf, framesOffset)
+        self.frames.flags.writeable = False
+        self.next = self.seq + 1
+        self.framesRead = 0
+        self.framesMissed = 0
+        self._out = None
+
+    @property
+    def seq(self):
+        """Sequence number of the newest frame on the bus (-1 if none)."""
+        return int(self._state[0])
+
+    @property
+    def closed(self):
+        """True once the writer has gone away."""
+        return self._state[2] != 0
+
+    @property
+    def oldest(self):
+        """Oldest sequence number that can still be on the bus."""
+        # the slot after the newest may be being overwritten already
+        return max(self.seq - self.depth + 2, 0)
+
+    def valid(self, seq):
+        """True if seq is still on the bus, un-overwritten."""
+        return seq >= 0 and self.seqs[seq % self.depth] == seq
+
+    def get(self, seq):
+        """View of frame seq, or None if it's not (or no longer) there."""
+        if not self.valid(seq):
+            return None
+        return self.frames[seq % self.depth]
+
+    def timestamp(self, seq):
+        """Timestamp of frame seq, or None if it's not there."""
+        t = self.timestamps[seq % self.depth]
+        if not self.valid(seq):
+            return None
+        return float(t)
+
+    def latest(self):
+        """Returns (frame, seq, timestamp) for the newest frame, frame a view."""
+        seq = self.seq
+        if seq < 0:
+            return (None, -1, 0.)
+        slot = seq % self.depth
+        return (self.frames[slot], seq, float(self.timestamps[slot]))
+
+    def copy(self, seq, out = None):
+        """Copy of frame seq (into out if given), or None if it's gone."""
+        if not self.valid(seq):
+            return None
+        slot = seq % self.depth
+        if out is None:
+            out = np.empty_like(self.frames[slot])
+        np.copyto(out, self.frames[slot])
+        if not self.valid(seq):
+            return None
+        return out
+
+    def read(self, timeout = None, out = None):
+        """Wait for frame next and return (frame, seq, timestamp).
+
+        The frame is copied (into out, if given, else into a buffer
+        that's reused by the next read()). Frames that were overwritten
+        before we got to them are skipped (see framesMissed). Returns
+        (None, -1, 0.) on timeout or if the writer's gone.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self.seq >= self.next:
+                oldest = self.oldest
+                if self.next < oldest:
+                    self.framesMissed += oldest - self.next
+                    self.next = oldest
+                seq = self.next
+                self.next += 1
+                timestamp = self.timestamp(seq)
+                if out is None:
+                    if self._out is None:
+                        self._out = np.empty(self.frames.shape[1:], self.frames.dtype)
+                    buf = self._out
+                else:
+                    buf = out
+                frame = self.copy(seq, buf)
+                if frame is not None and timestamp is not None:
+                    self.framesRead += 1
+                    return (frame, seq, timestamp)
+                self.framesMissed += 1
+                continue
+            if self.closed or (deadline is not None and time.monotonic() >= deadline):
+                return (None, -1, 0.)
+            time.sleep(self.interval)
+
+    def __iter__(self):
+        """read() until the writer goes away."""
+        while True:
+            frame, seq, timestamp = self.read()
+            if frame is None:
+                return
+            yield (frame, seq, timestamp)
+
+    def close(self):
+        if self._shm is None:
+            return
+        del self._state, self.seqs, self.timestamps, self.frames
+        self._out = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # somebody still has a view of a frame: it goes when they do
+            logger.debug("Frame bus %s still has views, leaving it mapped" % self.name)
+        self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def __repr__(self):
+        return ("FrameBusReader(%s): %d channels x %d samples, newest %d, "
+                "%d read, %d missed" % (self.name, self.numChannels, self.numSamples,
+                                         self.seq, self.framesRead, self.framesMissed))
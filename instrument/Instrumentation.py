@@ -0,0 +1,149 @@
+import numpy as np
+import time
+
+# Low-overhead pipeline timing.
+#
+# Usage is
+#
+#   t = inst.start()
+#   ... capture ...
+#   t = inst.lap('capture', t)
+#   ... process ...
+#   t = inst.lap('process', t)
+#
+# When it's disabled start() returns 0 and lap() just returns,
+# so leaving the hooks in costs a couple of attribute lookups.
+# Each stage keeps a rolling window of its durations: the
+# percentiles are only worked out when somebody asks.
+class StageTimer:
+    """ Rolling window of durations for one stage."""
+    def __init__(self, size = 1024):
+        self.samples = np.zeros(size)
+        self.count = 0
+        self.total = 0.
+
+    def add(self, dt):
+        self.samples[self.count % len(self.samples)] = dt
+        self.count += 1
+        self.total += dt
+
+    def window(self):
+        return self.samples[:min(self.count, len(self.samples))]
+
+    def percentile(self, p):
+        """p-th percentile (s) of the durations in the window."""
+        if self.count == 0:
+            return 0.
+        return float(np.percentile(self.window(), p))
+
+    def mean(self):
+        if self.count == 0:
+            return 0.
+        return float(np.mean(self.window()))
+
+
+class Instrumentation:
+    """ Timing and throughput counters for the acquisition pipeline.
+
+    Attributes
+    ----------
+
+    enabled : bool
+       Whether anything gets measured.
+    stages : dict
+       StageTimer for each stage name, in the order first seen.
+    frames : int
+       Frames counted since reset().
+    bytes : int
+       Bytes of frames counted since reset().
+
+    """
+    def __init__(self, enabled = True, size = 1024):
+        self.enabled = enabled
+        self.size = size
+        self.reset()
+
+    def reset(self):
+        self.stages = {}
+        self.frames = 0
+        self.bytes = 0
+        self._times = np.zeros(self.size)
+        self._bytes = np.zeros(self.size)
+
+    def start(self):
+        """Start timing: returns the start time (0 if disabled)."""
+        if not self.enabled:
+            return 0.
+        return time.perf_counter()
+
+    def lap(self, name, start):
+        """Add the time since start to stage name, returning now (for the next stage)."""
+        if not start:
+            return 0.
+        now = time.perf_counter()
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = StageTimer(self.size)
+            self.stages[name] = stage
+        stage.add(now - start)
+        return now
+
+    def count(self, nbytes):
+        """Count one frame of nbytes."""
+        if not self.enabled:
+            return
+        i = self.frames % self.size
+        self._times[i] = time.perf_counter()
+        self._bytes[i] = nbytes
+        self.frames += 1
+        self.bytes += nbytes
+
+    def rates(self):
+        """(frames/s, MB/s) over the rolling window."""
+        n = min(self.frames, self.size)
+        if n < 2:
+            return (0., 0.)
+        last = (self.frames - 1) % self.size
+        first = (self.frames - n) % self.size
+        dt = self._times[last] - self._times[first]
+        if dt <= 0:
+            return (0., 0.)
+        # the first frame's bytes were before the window started
+        nbytes = np.sum(self._bytes[:n]) - self._bytes[first]
+        return ((n-1)/dt, nbytes/dt/1.E6)
+
+    def report(self):
+        """Everything as a dict, times in ms."""
+        fps, mbps = self.rates()
+        r = { 'frames' : self.frames,
+              'bytes' : self.bytes,
+              'fps' : fps,
+              'MBps' : mbps,
+              'stages' : {} }
+        for name, stage in list(self.stages.items()):
+            r['stages'][name] = { 'count' : stage.count,
+                                  'mean' : 1.E3*stage.mean(),
+                                  'p50' : 1.E3*stage.percentile(50),
+                                  'p99' : 1.E3*stage.percentile(99) }
+        return r
+
+    def summary(self):
+        """One-line summary for a status bar."""
+        if not self.enabled:
+            return "instrumentation off"
+        fps, mbps = self.rates()
+        s = "%.1f fps %.2f MB/s" % (fps, mbps)
+        for name, stage in list(self.stages.items()):
+            s += " | %s %.2f/%.2f ms" % (name,
+                                         1.E3*stage.percentile(50),
+                                         1.E3*stage.percentile(99))
+        return s
+
+    def __repr__(self):
+        r = self.report()
+        s = "%d frames, %.1f frames/s, %.2f MB/s\n" % (r['frames'], r['fps'], r['MBps'])
+        s += "%-12s %10s %10s %10s %10s\n" % ("stage", "count", "mean ms", "p50 ms", "p99 ms")
+        for name, st in r['stages'].items():
+            s += "%-12s %10d %10.3f %10.3f %10.3f\n" % (name, st['count'],
+                                                       st['mean'], st['p50'], st['p99'])
+        return s
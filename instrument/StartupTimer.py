@@ -0,0 +1,59 @@
+import time
+
+# Where the time goes when the program starts.
+#
+#   startup = StartupTimer()
+#   ... imports ...
+#   startup.mark('imports')
+#   ... build the window ...
+#   startup.mark('widgets')
+#   logger.info(startup.report())
+#
+# Each step is the wall clock time since the mark before it (or
+# since the timer was made), i.e. what somebody starting it up
+# waits for. It's cheap enough to always be on, so the report
+# lands in the log every time and a slower startup is obvious.
+class StartupTimer:
+    """ Wall clock time of each step of starting up.
+
+    Attributes
+    ----------
+
+    steps : list
+       (name, seconds) for each step, in order.
+
+    """
+    def __init__(self):
+        self.steps = []
+        self._start = time.perf_counter()
+        self._last = self._start
+
+    def mark(self, name):
+        """End step name, which started at the last mark. Returns its time (s)."""
+        now = time.perf_counter()
+        dt = now - self._last
+        self.steps.append((name, dt))
+        self._last = now
+        return dt
+
+    def add(self, name, dt):
+        """Add a step that was timed somewhere else, e.g. part of the
+        last one (indent its name to show that). It isn't in total."""
+        self.steps.append((name, dt))
+
+    @property
+    def total(self):
+        """Time (s) from the timer being made to the last mark."""
+        return self._last - self._start
+
+    def report(self):
+        """Table of the steps, for the log."""
+        total = self.total
+        s = "Startup took %.3f s:" % total
+        for name, dt in self.steps:
+            s += "\n  %-24s %9.1f ms %5.1f%%" % (name, 1.E3*dt,
+                                                 100.*dt/total if total > 0 else 0.)
+        return s
+
+    def __repr__(self):
+        return self.report()
@@ -0,0 +1,31 @@
+import os
+
+from netstream.StreamClient import StreamClient
+from netstream.StreamServer import DEFAULT_PORT
+
+# Load this like any other overlay to get frames from an
+# rfsoc-pydaq streaming on another machine (see daq.serve(), or
+# streamPort in rfsoc-pydaq.ini) instead of a local board. The
+# server comes from the RFSOC_PYDAQ_SERVER environment variable
+# (host or host:port) if it's set, otherwise you get asked for it.
+# Change what you get from the console: daq.dev.subscribe(channels,
+# every).
+class FakeOverlay:
+    def __init__(self):
+        return
+
+
+class NetRFSoC(FakeOverlay, StreamClient):
+    def __init__(self, server=None):
+        if server is None:
+            server = os.environ.get('RFSOC_PYDAQ_SERVER')
+        if server is None:
+            from tkinter import simpledialog
+            server = simpledialog.askstring("Connect to server",
+                                            "rfsoc-pydaq server (host or host:port):")
+        if not server:
+            raise ValueError("No server to connect to")
+        host, sep, port = server.rpartition(':')
+        if not sep:
+            host, port = port, DEFAULT_PORT
+        StreamClient.__init__(self, host, int(port))
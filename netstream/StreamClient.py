@@ -0,0 +1,137 @@
+import numpy as np
+import logging
+import socket
+import struct
+
+from netstream.StreamServer import MAGIC, FRAME, SUBSCRIBE, VERSION, DEFAULT_PORT
+from netstream.StreamServer import _helloFormat, _subscribeFormat, _frameFormat, _trailerFormat
+from netstream.StreamServer import channel_mask, mask_channels, recv_all, recv_into_all
+
+logger = logging.getLogger(__name__)
+
+# Receives frames from a StreamServer through the same
+# internal_capture( buffer, numChannels ) interface an overlay
+# has, so a workstation can run the whole DAQ (display, spectrum,
+# recording...) on frames coming from the board. The samples are
+# received straight into the capture buffer.
+class StreamClient:
+    """ Client for a StreamServer.
+
+    Attributes
+    ----------
+
+    host : str
+       Server address.
+    port : int
+       Server port.
+    numChannels : int
+       Number of channels the server has.
+    numSamples : int
+       Samples per channel in each frame.
+    sampleRate : float
+       Sample rate from the server.
+    dtype : numpy.dtype
+       Sample type.
+    overlay : str
+       Overlay the server is running.
+    channels : list
+       Channels subscribed to. The other channels of a received
+       frame are zeroed.
+    every : int
+       Only every Nth frame is sent.
+    seq : int
+       Server sequence number of the last frame received.
+    timestamp : float
+       Capture time of the last frame received.
+    framesReceived : int
+       Good frames received.
+    framesTorn : int
+       Frames thrown away because they were overwritten on the
+       server while being sent.
+    framesDropped : int
+       Frames the server dropped because we weren't keeping up.
+
+    """
+    def __init__(self, host, port = DEFAULT_PORT, channels = None, every = 1, timeout = 10.):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.seq = -1
+        self.timestamp = 0.
+        self.framesReceived = 0
+        self.framesTorn = 0
+        self.framesDropped = 0
+        self._sock = None
+        self.connect()
+        self.subscribe(channels, every)
+
+    def connect(self):
+        self.close()
+        self._sock = socket.create_connection((self.host, self.port), self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        (magic, version, numChannels, numSamples, sampleRate,
+         dtype, overlay) = struct.unpack(_helloFormat,
+                                         recv_all(self._sock, struct.calcsize(_helloFormat)))
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("%s:%d is not an rfsoc-pydaq stream server" % (self.host, self.port))
+        if version != VERSION:
+            self.close()
+            raise ValueError("%s:%d is stream version %d, not %d" % (self.host, self.port, version, VERSION))
+        self.numChannels = numChannels
+        self.numSamples = numSamples
+        self.sampleRate = sampleRate
+        self.dtype = np.dtype(dtype.rstrip(b'\0').decode())
+        self.overlay = overlay.rstrip(b'\0').decode()
+        # somewhere to put channels that don't fit in the caller's buffer
+        self._scratch = np.empty(numSamples, self.dtype)
+        logger.debug("Connected to %s:%d (%s, %d channels x %d samples)" %
+                     (self.host, self.port, self.overlay, numChannels, numSamples))
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def subscribe(self, channels = None, every = 1):
+        """Ask for only some channels (None = all) and/or every Nth frame."""
+        self.channels = list(range(self.numChannels)) if channels is None else list(channels)
+        self.every = every
+        self._sock.sendall(struct.pack(_subscribeFormat, SUBSCRIBE,
+                                       channel_mask(self.channels, self.numChannels),
+                                       every))
+
+    def receive(self, buf):
+        """Receive the next good frame into buf (numChannels, numSamples).
+
+        Returns (seq, timestamp).
+        """
+        header = bytearray(struct.calcsize(_frameFormat))
+        trailer = bytearray(struct.calcsize(_trailerFormat))
+        while True:
+            recv_into_all(self._sock, header)
+            magic, seq, timestamp, channels, dropped = struct.unpack(_frameFormat, header)
+            if magic != FRAME:
+                raise ValueError("lost sync with %s:%d" % (self.host, self.port))
+            selected = mask_channels(channels, self.numChannels)
+            for ch in selected:
+                recv_into_all(self._sock, buf[ch] if ch < len(buf) else self._scratch)
+            recv_into_all(self._sock, trailer)
+            self.framesDropped = dropped
+            if struct.unpack(_trailerFormat, trailer)[0] != seq:
+                self.framesTorn += 1
+                continue
+            if len(selected) < len(buf):
+                for ch in range(len(buf)):
+                    if ch not in selected:
+                        buf[ch] = 0
+            self.seq = seq
+            self.timestamp = timestamp
+            self.framesReceived += 1
+            return (seq, timestamp)
+
+    def internal_capture(self, buf, numChan):
+        if buf.shape[-1] != self.numSamples or buf.dtype != self.dtype:
+            raise ValueError("server sends %d samples of %s, the DAQ is set up for %d of %s" %
+                             (self.numSamples, self.dtype, buf.shape[-1], buf.dtype))
+        self.receive(buf[:min(numChan, self.numChannels)])
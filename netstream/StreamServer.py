@@ -0,0 +1,322 @@
+import numpy as np
+import logging
+import socket
+import struct
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Network stream protocol
+#
+# Everything is little endian, over TCP. When a client connects
+# the server sends a hello:
+#
+#   magic        8s   b'RFSNET\0\0'
+#   version      I
+#   numChannels  I
+#   numSamples   I
+#   sampleRate   d
+#   dtype        8s   numpy dtype string of the samples ('<i2')
+#   overlay      256s name of the overlay (utf-8, zero padded)
+#
+# The client can then send a subscription at any time:
+#
+#   magic        8s   b'RFSSUB\0\0'
+#   channels     I    bit mask of the channels to send
+#   every        I    only send every Nth frame
+#
+# (the default is every channel, every frame). Each frame is sent as
+#
+#   magic        4s   b'RFSF'
+#   seq          q    sequence number in the server's ring
+#   timestamp    d    time.time() when the frame was captured
+#   channels     I    bit mask of the channels that follow
+#   dropped      q    frames dropped for this client so far
+#   data         the selected channels' samples, in order
+#   trailer      q    seq again, or -1 if the frame got overwritten
+#                     in the ring while it was being sent
+#
+# The data goes straight from the ring to the socket without
+# being copied, which is why it needs the trailer: a client
+# has to throw away a frame whose trailer doesn't match.
+MAGIC = b'RFSNET\0\0'
+SUBSCRIBE = b'RFSSUB\0\0'
+FRAME = b'RFSF'
+VERSION = 1
+DEFAULT_PORT = 9410
+_helloFormat = '<8sIIId8s256s'
+_subscribeFormat = '<8sII'
+_frameFormat = '<4sqdIq'
+_trailerFormat = '<q'
+
+def channel_mask(channels, numChannels):
+    """Bit mask for a list of channels (None = all of them)."""
+    if channels is None:
+        return (1 << numChannels) - 1
+    mask = 0
+    for ch in channels:
+        mask |= 1 << ch
+    return mask
+
+def mask_channels(mask, numChannels):
+    """List of the channels in a bit mask."""
+    return [ ch for ch in range(numChannels) if mask & (1 << ch) ]
+
+def recv_into_all(sock, buf):
+    """Fill buf (anything writable) from sock."""
+    view = memoryview(buf).cast('B')
+    while len(view):
+        n = sock.recv_into(view)
+        if n == 0:
+            raise ConnectionError("connection closed")
+        view = view[n:]
+
+def recv_all(sock, size):
+    buf = bytearray(size)
+    recv_into_all(sock, buf)
+    return bytes(buf)
+
+def send_all(sock, buffers):
+    """sendall for a list of buffers, in one sendmsg when possible."""
+    views = [ memoryview(b).cast('B') for b in buffers ]
+    while views:
+        n = sock.sendmsg(views)
+        while views and n >= len(views[0]):
+            n -= len(views[0])
+            views.pop(0)
+        if views:
+            views[0] = views[0][n:]
+
+# One connected client. The acquisition thread just drops the
+# newest sequence number in _pending (push()), so a slow client
+# never holds anything up: its sender thread picks up whatever's
+# newest when it's done with the last one, and anything it
+# skipped over is counted as dropped.
+class StreamClientHandler:
+    """ Server side of one stream client.
+
+    Attributes
+    ----------
+
+    address : tuple
+       Address of the client.
+    channels : int
+       Bit mask of the channels the client wants.
+    every : int
+       Only every Nth frame is offered to the client.
+    framesSent : int
+       Frames sent to this client.
+    framesDropped : int
+       Frames skipped because the client wasn't keeping up.
+    framesTorn : int
+       Frames overwritten in the ring while being sent.
+
+    """
+    def __init__(self, server, sock, address):
+        self.server = server
+        self.address = address
+        self.channels = channel_mask(None, server.ring.numChannels)
+        self.every = 1
+        self.framesSent = 0
+        self.framesDropped = 0
+        self.framesTorn = 0
+        self._sock = sock
+        self._count = 0
+        self._pending = -1
+        self._closed = False
+        self._cond = threading.Condition()
+        self._sender = threading.Thread(target=self._send_loop,
+                                        name="rfsoc-stream-send",
+                                        daemon=True)
+        self._receiver = threading.Thread(target=self._receive_loop,
+                                          name="rfsoc-stream-receive",
+                                          daemon=True)
+
+    def start(self):
+        self._sender.start()
+        self._receiver.start()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def join(self):
+        self._sender.join()
+        self._receiver.join()
+
+    def push(self, seq):
+        """Offer frame seq. Called from the acquisition thread."""
+        self._count += 1
+        if self._count % self.every:
+            return
+        with self._cond:
+            if self._pending >= 0:
+                self.framesDropped += 1
+            self._pending = seq
+            self._cond.notify()
+
+    def _receive_loop(self):
+        # subscriptions, and noticing the client went away
+        try:
+            while True:
+                magic, channels, every = struct.unpack(_subscribeFormat,
+                                                       recv_all(self._sock, struct.calcsize(_subscribeFormat)))
+                if magic != SUBSCRIBE:
+                    raise ValueError("bad subscription from %s:%d" % self.address[:2])
+                self.channels = channels & channel_mask(None, self.server.ring.numChannels)
+                self.every = max(every, 1)
+                logger.debug("%s:%d subscribed to channels %s every %d frames" %
+                             (self.address[:2] +
+                              (mask_channels(self.channels, self.server.ring.numChannels),
+                               self.every)))
+        except (OSError, ValueError) as e:
+            if not self._closed:
+                logger.debug("Stream client %s:%d: %s" % (self.address[:2] + (str(e),)))
+        self.close()
+
+    def _send_loop(self):
+        ring = self.server.ring
+        try:
+            while True:
+                with self._cond:
+                    self._cond.wait_for(lambda: self._pending >= 0 or self._closed)
+                    if self._closed:
+                        break
+                    seq = self._pending
+                    self._pending = -1
+                timestamp = ring.timestamp(seq)
+                frame = ring.get(seq)
+                if frame is None or timestamp is None:
+                    self.framesDropped += 1
+                    continue
+                channels = self.channels
+                rows = [ frame[ch] for ch in mask_channels(channels, ring.numChannels) ]
+                header = struct.pack(_frameFormat, FRAME, seq, timestamp,
+                                     channels, self.framesDropped)
+                send_all(self._sock, [header] + rows)
+                # it's in the socket now: if it's still valid, what
+                # we sent wasn't overwritten while we were sending it
+                if ring.valid(seq):
+                    self.framesSent += 1
+                else:
+                    self.framesTorn += 1
+                    seq = -1
+                send_all(self._sock, [struct.pack(_trailerFormat, seq)])
+        except OSError as e:
+            if not self._closed:
+                logger.debug("Stream client %s:%d: %s" % (self.address[:2] + (str(e),)))
+        self.close()
+        self._sock.close()
+        self.server._remove(self)
+
+# Publishes frames from the DAQ's ring over TCP (see the protocol
+# above). Like the Recorder it's a DAQ consumer: push(seq) gets
+# called on the acquisition thread for every new frame, and it
+# never blocks.
+class StreamServer:
+    """ Serves captures from a ring to any number of network clients.
+
+    Attributes
+    ----------
+
+    ring : ringbuffer.RingBuffer
+       Ring the frames come from.
+    host : str
+       Address to listen on ('' = all of them).
+    port : int
+       Port to listen on.
+    sampleRate : float
+       Sample rate sent to clients.
+    overlay : str
+       Overlay name sent to clients.
+    clients : list
+       The connected clients (StreamClientHandlers).
+
+    """
+    def __init__(self,
+                 ring,
+                 port = DEFAULT_PORT,
+                 host = '',
+                 sampleRate = 3.E9,
+                 overlay = ''):
+        self.ring = ring
+        self.host = host
+        self.port = port
+        self.sampleRate = sampleRate
+        self.overlay = overlay
+        self.clients = []
+        self._lock = threading.Lock()
+        self._sock = None
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._sock = socket.create_server((self.host, self.port))
+        # port 0 picks one
+        self.port = self._sock.getsockname()[1]
+        self._thread = threading.Thread(target=self._accept_loop,
+                                        name="rfsoc-stream-accept",
+                                        daemon=True)
+        self._thread.start()
+        logger.debug("Streaming on port %d" % self.port)
+
+    def stop(self):
+        """Stop listening and disconnect everybody."""
+        if self._thread is None:
+            return
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+        self._thread.join()
+        self._thread = None
+        for client in self.clients:
+            client.close()
+            client.join()
+
+    def push(self, seq):
+        """Offer frame seq to every client. Called from the acquisition thread."""
+        for client in self.clients:
+            client.push(seq)
+
+    # clients gets replaced rather than modified, same as the
+    # DAQ's consumers, so push() never sees it change under it
+    def _remove(self, client):
+        with self._lock:
+            self.clients = [ c for c in self.clients if c is not client ]
+        logger.info("Stream client %s:%d disconnected: %d frames sent, %d dropped" %
+                    (client.address[:2] + (client.framesSent, client.framesDropped)))
+
+    def _accept_loop(self):
+        while True:
+            try:
+                sock, address = self._sock.accept()
+            except OSError:
+                break
+            hello = struct.pack(_helloFormat, MAGIC, VERSION,
+                                self.ring.numChannels, self.ring.numSamples,
+                                self.sampleRate,
+                                self.ring.frames.dtype.str.encode(),
+                                self.overlay.encode()[:256])
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            try:
+                sock.sendall(hello)
+            except OSError:
+                sock.close()
+                continue
+            client = StreamClientHandler(self, sock, address)
+            with self._lock:
+                self.clients = self.clients + [client]
+            client.start()
+            logger.info("Stream client connected from %s:%d" % address[:2])
@@ -0,0 +1,264 @@
+import numpy as np
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# The processing every triggered capture goes through, on the
+# acquisition thread, after the trigger and before the consumers.
+#
+# A stage is fn(data, out, seq). data is a read-only view: of the
+# frame in the ring if the stage's input is None, or of the output
+# of the stage named by input. out is the stage's own output buffer,
+# allocated once when it's added (None if it wasn't given a shape).
+# fn fills in out, or returns some other array it keeps itself (the
+# spectrum stage returns the spectrum engine's result), and that's
+# what later stages with this one as their input get: nothing gets
+# copied on the way from one stage to the next.
+#
+#   def calibrate(data, out, seq):
+#       np.multiply(data, gains[:, None], out=out)
+#   daq.pipeline.add('calibrate', calibrate, shape=daq.ring.frames.shape[1:],
+#                    before='spectrum')
+#   daq.pipeline['spectrum'].input = 'calibrate'
+#
+# Stages run in order. With workers set, stages that don't depend
+# on each other run at the same time. The stages are split into
+# waves, a new one starting at each stage whose input is in the
+# current wave; a wave's stages go to a thread pool (the acquisition
+# thread runs the first one itself) and are all waited for before
+# the next wave. numpy lets go of the GIL in the FFTs and the
+# whole-frame arithmetic, which is where the time goes, so they
+# really do run side by side. So a stage can only count on the ones
+# before it having run if it takes its input from them.
+#
+# Each stage times itself under its own name in daq.instrument. A
+# stage that raises, or returns something that isn't an array, is
+# switched off (and logged) rather than stopping acquisition. stages
+# gets replaced rather than modified, like DaqCore.consumers, so
+# stages can be added, removed and reordered while acquisition's
+# running.
+class Stage:
+    """ One step of the processing pipeline.
+
+    Attributes
+    ----------
+
+    name : str
+       Name of the stage (and of its timing in the instrumentation).
+    fn : callable
+       fn(data, out, seq), returning its output (None = out).
+    input : str
+       Name of the stage whose output this stage gets, or None
+       for the captured frame.
+    out : numpy.ndarray
+       Output buffer (None if the stage has none).
+    enabled : bool
+       Whether the stage runs. For the built in stages this is
+       their engine's enabled flag (e.g. daq.spectrum.enabled).
+
+    """
+    def __init__(self, name, fn, shape=None, dtype=np.float64,
+                 input=None, enabled=True, owner=None):
+        self.name = name
+        self.fn = fn
+        self.input = input
+        self.out = None if shape is None else np.zeros(shape, dtype)
+        # owner() is the object whose enabled flag is ours
+        self.owner = owner
+        self._enabled = enabled
+
+    @property
+    def enabled(self):
+        if self.owner is not None:
+            return self.owner().enabled
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, on):
+        if self.owner is not None:
+            self.owner().enabled = on
+        else:
+            self._enabled = on
+
+    def __repr__(self):
+        return "Stage(%s%s%s)" % (self.name,
+                                  "" if self.input is None else " <- %s" % self.input,
+                                  "" if self.enabled else ", disabled")
+
+
+class Pipeline:
+    """ Ordered list of processing stages.
+
+    Attributes
+    ----------
+
+    stages : list
+       Stages, in the order they run.
+    order : list
+       Stage names in the order they should run. Stages that
+       aren't in it run after the ones that are, in the order they
+       were added. Set it (or use move()) to reorder.
+    outputs : dict
+       Output of each stage that ran on the newest frame.
+    workers : int
+       Threads running independent stages at the same time
+       (0 runs every stage on the acquisition thread, in turn).
+    first : int
+       Sequence number of the first frame of the newest capture
+       (earlier than seq when the trigger kept pre-trigger frames).
+
+    """
+    def __init__(self, instrument=None, workers=0):
+        self.instrument = instrument
+        self.stages = []
+        self._order = []
+        self.outputs = {}
+        self.first = -1
+        self._workers = 0
+        self._pool = None
+        self.workers = workers
+
+    @property
+    def workers(self):
+        return self._workers
+
+    @workers.setter
+    def workers(self, n):
+        if n == self._workers:
+            return
+        pool = self._pool
+        # the acquisition thread runs a wave's first stage itself
+        self._pool = (ThreadPoolExecutor(n, thread_name_prefix="rfsoc-pipeline")
+                      if n > 0 else None)
+        self._workers = n
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    @property
+    def order(self):
+        return [stage.name for stage in self.stages]
+
+    @order.setter
+    def order(self, names):
+        self._order = list(names)
+        self._sort(self.stages)
+
+    def _sort(self, stages):
+        rank = { name : i for i, name in enumerate(self._order) }
+        self.stages = sorted(stages, key=lambda stage: rank.get(stage.name, len(rank)))
+
+    def add(self, name, fn, shape=None, dtype=np.float64, input=None,
+            enabled=True, before=None, owner=None):
+        """Add a stage (see Stage), at the end or before stage before.
+
+        Returns the Stage. Replaces any stage with the same name.
+        """
+        stage = Stage(name, fn, shape, dtype, input, enabled, owner)
+        if before is not None:
+            self._order = [n for n in self._order if n != name]
+            self._order.insert(self._order.index(before) if before in self._order
+                               else len(self._order), name)
+        self._sort([s for s in self.stages if s.name != name] + [stage])
+        return stage
+
+    def remove(self, name):
+        self.stages = [s for s in self.stages if s.name != name]
+
+    def move(self, name, before=None):
+        """Run stage name before stage before (at the end if None)."""
+        order = [n for n in self.order if n != name]
+        order.insert(order.index(before) if before in order else len(order), name)
+        self.order = order
+
+    def __getitem__(self, name):
+        for stage in self.stages:
+            if stage.name == name:
+                return stage
+        raise KeyError(name)
+
+    def __contains__(self, name):
+        return any(stage.name == name for stage in self.stages)
+
+    def _waves(self):
+        """Enabled stages split into lists that don't depend on each other."""
+        waves = []
+        wave = []
+        names = set()
+        for stage in self.stages:
+            if not stage.enabled:
+                continue
+            if stage.input in names:
+                waves.append(wave)
+                wave = []
+                names = set()
+            wave.append(stage)
+            names.add(stage.name)
+        if wave:
+            waves.append(wave)
+        return waves
+
+    def _call(self, stage, data, seq):
+        """Run one stage, timed. Returns its output (a read-only view) or None."""
+        inst = self.instrument
+        t = inst.start() if inst is not None else 0.
+        try:
+            result = stage.fn(data, stage.out, seq)
+            if result is None:
+                result = stage.out
+            if result is not None:
+                if not isinstance(result, np.ndarray):
+                    raise TypeError("returned a %s, not an array" % type(result).__name__)
+                result = result.view()
+                result.flags.writeable = False
+        except Exception as e:
+            logger.error("pipeline stage '%s' failed, disabling it: %s" % (stage.name, str(e)))
+            stage.enabled = False
+            result = None
+        # (a failed stage is timed too, it took the time)
+        if inst is not None:
+            inst.lap(stage.name, t)
+        return result
+
+    def run(self, frame, first, seq):
+        """Run the enabled stages on frame."""
+        self.first = first
+        outputs = self.outputs
+        outputs.clear()
+        frame = frame.view()
+        frame.flags.writeable = False
+        pool = self._pool
+        # without a pool it's all one wave, run in order
+        for wave in (self._waves() if pool is not None else (self.stages,)):
+            jobs = []
+            for stage in wave:
+                if not stage.enabled:
+                    continue
+                if stage.input is None:
+                    data = frame
+                else:
+                    # None if its input didn't run (yet)
+                    data = outputs.get(stage.input)
+                    if data is None:
+                        continue
+                if pool is None:
+                    result = self._call(stage, data, seq)
+                    if result is not None:
+                        outputs[stage.name] = result
+                else:
+                    jobs.append((stage, data))
+            if not jobs:
+                continue
+            futures = [ pool.submit(self._call, stage, data, seq) for stage, data in jobs[1:] ]
+            results = [ self._call(jobs[0][0], jobs[0][1], seq) ] + [ f.result() for f in futures ]
+            for (stage, data), result in zip(jobs, results):
+                if result is not None:
+                    outputs[stage.name] = result
+
+    def shutdown(self):
+        self.workers = 0
+
+    def __repr__(self):
+        if not self.stages:
+            return "Pipeline(no stages)"
+        return "Pipeline: " + ", ".join(repr(stage) for stage in self.stages)
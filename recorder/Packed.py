@@ -0,0 +1,549 @@
+import numpy as np
+import collections
+import concurrent.futures
+import logging
+import lzma
+import math
+import os
+import struct
+import time
+import zlib
+
+from recorder.Recorder import Recorder, HEADER_SIZE
+from recorder.Recorder import record_dtype, open_recording
+
+logger = logging.getLogger(__name__)
+
+# Packed capture file format
+#
+# The RFSoC's ADCs only have 12 or 14 bits, so a .daq file's int16
+# samples waste a quarter or an eighth of the disk bandwidth. A
+# .daqz file packs the samples down to their real width, optionally
+# delta-encodes them (mod 2**bits along each channel, so the deltas
+# fit in the same width) and compresses them, in chunks of up to
+# chunkFrames frames. Everything is little endian. The header
+# (HEADER_SIZE bytes) is:
+#
+#   magic        8s   b'RFSDAQZ\0'
+#   version      I
+#   headerSize   I
+#   numChannels  I
+#   numSamples   I
+#   sampleRate   d
+#   dtype        8s   numpy dtype string of the samples ('<i2')
+#   startTime    d    time.time() when the file was opened
+#   overlay      256s name of the overlay (utf-8, zero padded)
+#   delta        I    1 if the samples are delta encoded
+#   compression  8s   'none', 'zlib' or 'lzma'
+#   chunkFrames  I    most frames in a chunk
+#
+# followed by chunks:
+#
+#   magic        4s   b'RFSC'
+#   frames       I    frames in the chunk
+#   bits         I    bits per packed sample
+#   shift        I    low bits dropped from each sample
+#   payloadBytes Q    size of the payload
+#   seq          q[frames]
+#   timestamp    d[frames]
+#   payload      the (frames, numChannels, numSamples) samples,
+#                packed, then compressed
+#
+# A chunk whose samples don't fit in the file's bits (or have
+# nonzero low bits) is stored at 16 bits, so it's always lossless.
+# When the file's closed an index goes after the last chunk:
+#
+#   magic        4s   b'RFSI'
+#   chunks       I
+#   offset, first frame, frames (q, q, I) of each chunk
+#   seq          q[frames in the file]
+#   timestamp    d[frames in the file]
+#
+# and the last 16 bytes of the file point to it:
+#
+#   magic        8s   b'RFSIDX\0\0'
+#   indexOffset  q
+#
+# so frame N is one seek and one chunk away (see PackedFile). A
+# file without an index (the recorder didn't get to close it) is
+# read by walking the chunk headers instead.
+MAGIC = b'RFSDAQZ\0'
+VERSION = 1
+EXTENSION = '.daqz'
+_headerFormat = '<8sIIIId8sd256sI8sI'
+_chunkFormat = '<4sIIIQ'
+_indexFormat = '<4sI'
+_trailerFormat = '<8sq'
+CHUNK_MAGIC = b'RFSC'
+INDEX_MAGIC = b'RFSI'
+TRAILER_MAGIC = b'RFSIDX\0\0'
+
+index_dtype = np.dtype([ ('offset', '<i8'),
+                         ('first', '<i8'),
+                         ('frames', '<u4') ])
+
+# level 1 zlib and preset 0 lzma: we have to keep up with the DAQ
+_compressors = { 'none' : (None, None),
+                 'zlib' : (lambda b: zlib.compress(b, 1), zlib.decompress),
+                 'lzma' : (lambda b: lzma.compress(b, preset=0), lzma.decompress) }
+
+def _group(bits):
+    """(samples, bytes) in the smallest whole-byte group of bits-wide samples."""
+    if bits < 2 or bits > 16:
+        raise ValueError("can't pack %d bit samples" % bits)
+    g = 8//math.gcd(bits, 8)
+    if g*bits > 64:
+        raise ValueError("can't pack %d bit samples (use an even number of bits)" % bits)
+    return (g, g*bits//8)
+
+def packed_size(count, bits):
+    """Bytes taken by count packed bits-wide samples."""
+    g, nbytes = _group(bits)
+    return -(-count//g)*nbytes
+
+def fits(samples, bits, shift=0):
+    """True if samples pack into bits (after dropping shift zero bits) losslessly."""
+    lo = -(1 << (bits-1+shift))
+    hi = (1 << (bits-1+shift)) - 1
+    if samples.size == 0:
+        return True
+    if samples.min() < lo or samples.max() > hi:
+        return False
+    return not (shift and np.bitwise_and(samples, (1 << shift) - 1).any())
+
+def _word(g, bits):
+    # smallest unsigned word a group fits in
+    return np.dtype('<u4') if g*bits <= 32 else np.dtype('<u8')
+
+def pack(samples, bits, shift=0, delta=False):
+    """Pack integer samples into a uint8 array of bits-wide fields.
+
+    The samples are shifted right by shift, delta encoded along the
+    last axis if delta is set, masked to bits and packed, least
+    significant first, g samples to a whole number of bytes. Check
+    fits() first: bits that don't fit are just lost.
+    """
+    g, nbytes = _group(bits)
+    word = _word(g, bits)
+    # differences of 16 bit samples fit in 32 bits, and anything
+    # that wraps around is the same mod 2**bits anyway
+    v = samples.astype(np.int32 if samples.itemsize <= 2 else np.int64)
+    if shift:
+        v >>= shift
+    if delta:
+        v[..., 1:] -= samples[..., :-1] >> shift
+    v = v.ravel().view('<u%d' % v.itemsize)
+    v &= (1 << bits) - 1
+    if len(v) % g:
+        v = np.concatenate((v, np.zeros(g - len(v) % g, v.dtype)))
+    v = v.reshape(-1, g)
+    w = v[:, 0].astype(word)
+    for i in range(1, g):
+        w |= v[:, i].astype(word) << word.type(i*bits)
+    w = w.view(np.uint8).reshape(-1, word.itemsize)
+    return np.ascontiguousarray(w[:, :nbytes]).ravel()
+
+def unpack(packed, shape, bits, shift=0, delta=False, dtype=np.int16):
+    """Inverse of pack: a shape array of dtype from packed bytes."""
+    g, nbytes = _group(bits)
+    word = _word(g, bits)
+    mask = word.type((1 << bits) - 1)
+    count = int(np.prod(shape))
+    groups = -(-count//g)
+    b = np.frombuffer(packed, np.uint8, groups*nbytes).reshape(groups, nbytes)
+    w = np.zeros((groups, word.itemsize), np.uint8)
+    w[:, :nbytes] = b
+    w = w.view(word).ravel()
+    v = np.empty((groups, g), np.int32 if np.dtype(dtype).itemsize <= 2 else np.int64)
+    for i in range(g):
+        v[:, i] = (w >> word.type(i*bits)) & mask
+    v = v.ravel()[:count].reshape(shape)
+    if delta:
+        # wraps around the same way pack's differences did
+        v = np.cumsum(v, axis=-1, dtype=v.dtype)
+        v &= (1 << bits) - 1
+    # sign extend
+    sign = 1 << (bits-1)
+    v ^= sign
+    v -= sign
+    if shift:
+        v <<= shift
+    return v.astype(dtype)
+
+def write_header(f, numChannels, numSamples, sampleRate, overlay='',
+                 dtype='<i2', delta=False, compression='none',
+                 chunkFrames=16, startTime=None):
+    if startTime is None:
+        startTime = time.time()
+    hdr = struct.pack(_headerFormat,
+                      MAGIC, VERSION, HEADER_SIZE,
+                      numChannels, numSamples, sampleRate,
+                      dtype.encode(), startTime,
+                      overlay.encode()[:256],
+                      1 if delta else 0,
+                      compression.encode(),
+                      chunkFrames)
+    f.write(hdr.ljust(HEADER_SIZE, b'\0'))
+
+def read_header(path):
+    """Returns the header of a packed capture file as a dict."""
+    with open(path, 'rb') as f:
+        raw = f.read(struct.calcsize(_headerFormat))
+    if len(raw) < struct.calcsize(_headerFormat):
+        raise ValueError("%s is too short to be a packed capture file" % path)
+    (magic, version, headerSize, numChannels, numSamples, sampleRate,
+     dtype, startTime, overlay, delta, compression, chunkFrames) = struct.unpack(_headerFormat, raw)
+    if magic != MAGIC:
+        raise ValueError("%s is not a packed capture file" % path)
+    if version != VERSION:
+        raise ValueError("%s is packed capture file version %d, not %d" % (path, version, VERSION))
+    return { 'version' : version,
+             'headerSize' : headerSize,
+             'numChannels' : numChannels,
+             'numSamples' : numSamples,
+             'sampleRate' : sampleRate,
+             'dtype' : dtype.rstrip(b'\0').decode(),
+             'startTime' : startTime,
+             'overlay' : overlay.rstrip(b'\0').decode(),
+             'delta' : bool(delta),
+             'compression' : compression.rstrip(b'\0').decode(),
+             'chunkFrames' : chunkFrames }
+
+def encode_chunk(records, bits, shift=0, delta=False, compression='none'):
+    """Encode a chunk of frame records. Returns the bytes to write."""
+    data = records['data']
+    # (16 bits with a shift can lose bits too)
+    if (bits < 16 or shift) and not fits(data, bits, shift):
+        bits = 16
+        shift = 0
+    payload = pack(data, bits, shift, delta)
+    compress = _compressors[compression][0]
+    if compress is not None:
+        payload = compress(payload)
+    return b''.join(( struct.pack(_chunkFormat, CHUNK_MAGIC, len(records),
+                                  bits, shift, len(payload)),
+                      records['seq'].astype('<i8').tobytes(),
+                      records['timestamp'].astype('<f8').tobytes(),
+                      payload ))
+
+def decode_chunk(encoded, dtype, delta=False, compression='none'):
+    """Inverse of encode_chunk: the frame records (of record dtype) in a chunk."""
+    size = struct.calcsize(_chunkFormat)
+    magic, frames, bits, shift, payloadBytes = struct.unpack(_chunkFormat, encoded[:size])
+    if magic != CHUNK_MAGIC:
+        raise ValueError("not a packed chunk")
+    records = np.zeros(frames, dtype)
+    records['seq'] = np.frombuffer(encoded, '<i8', frames, size)
+    records['timestamp'] = np.frombuffer(encoded, '<f8', frames, size + 8*frames)
+    payload = encoded[size + 16*frames:size + 16*frames + payloadBytes]
+    decompress = _compressors[compression][1]
+    if decompress is not None:
+        payload = decompress(payload)
+    records['data'] = unpack(payload, records['data'].shape, bits, shift,
+                             delta, records.dtype['data'].base)
+    return records
+
+def open_capture(path):
+    """Open a .daq or .daqz capture file as (header, records).
+
+    records is a numpy.memmap (see recorder.Recorder.open_recording)
+    for .daq files and a PackedFile for .daqz files: either way
+    len(records) is the number of frames and records[n]['data'],
+    records[n]['seq'] and records[n]['timestamp'] are frame n's.
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(len(MAGIC))
+    if magic == MAGIC:
+        records = PackedFile(path)
+        return (records.header, records)
+    return open_recording(path)
+
+# Reads a packed capture file. Frames are decoded a chunk at a time
+# and the last chunk's kept, so reading frames in order only decodes
+# each chunk once.
+class PackedFile:
+    """ Random access to the frames in a packed capture file.
+
+    records[n] is frame n as a record (like a .daq file's memmap):
+    records[n]['data'], records[n]['seq'], records[n]['timestamp'].
+
+    Attributes
+    ----------
+
+    path : str
+       File name.
+    header : dict
+       Its header (see read_header).
+    index : numpy.ndarray
+       offset, first (frame) and frames of each chunk.
+    seq : numpy.ndarray
+       Sequence number of every frame.
+    timestamp : numpy.ndarray
+       Capture time of every frame.
+
+    """
+    def __init__(self, path):
+        self.path = path
+        self.header = read_header(path)
+        self._dtype = record_dtype(self.header['numChannels'],
+                                   self.header['numSamples'],
+                                   self.header['dtype'])
+        self._file = open(path, 'rb')
+        if not self._read_index():
+            self._scan()
+        self._chunk = -1
+        self._records = None
+
+    def __len__(self):
+        return len(self.seq)
+
+    def __getitem__(self, n):
+        if n < 0:
+            n += len(self)
+        if n < 0 or n >= len(self):
+            raise IndexError("no frame %d in %s" % (n, self.path))
+        c = np.searchsorted(self.index['first'], n, side='right') - 1
+        return self.chunk(c)[n - self.index['first'][c]]
+
+    def close(self):
+        self._file.close()
+
+    def _read_index(self):
+        size = os.fstat(self._file.fileno()).st_size
+        tsize = struct.calcsize(_trailerFormat)
+        if size < self.header['headerSize'] + tsize:
+            return False
+        self._file.seek(size - tsize)
+        magic, indexOffset = struct.unpack(_trailerFormat, self._file.read(tsize))
+        if magic != TRAILER_MAGIC:
+            return False
+        self._file.seek(indexOffset)
+        magic, chunks = struct.unpack(_indexFormat,
+                                      self._file.read(struct.calcsize(_indexFormat)))
+        if magic != INDEX_MAGIC:
+            return False
+        self.index = np.frombuffer(self._file.read(chunks*index_dtype.itemsize), index_dtype)
+        frames = int(self.index['frames'].sum())
+        self.seq = np.frombuffer(self._file.read(8*frames), '<i8')
+        self.timestamp = np.frombuffer(self._file.read(8*frames), '<f8')
+        return True
+
+    def _scan(self):
+        # no index: walk the chunks, stopping at a truncated one
+        size = os.fstat(self._file.fileno()).st_size
+        csize = struct.calcsize(_chunkFormat)
+        offset = self.header['headerSize']
+        index = []
+        seqs = []
+        timestamps = []
+        first = 0
+        while offset + csize <= size:
+            self._file.seek(offset)
+            magic, frames, bits, shift, payloadBytes = struct.unpack(_chunkFormat,
+                                                                     self._file.read(csize))
+            end = offset + csize + 16*frames + payloadBytes
+            if magic != CHUNK_MAGIC or end > size:
+                break
+            index.append((offset, first, frames))
+            seqs.append(np.frombuffer(self._file.read(8*frames), '<i8'))
+            timestamps.append(np.frombuffer(self._file.read(8*frames), '<f8'))
+            first += frames
+            offset = end
+        self.index = np.array(index, index_dtype)
+        self.seq = np.concatenate(seqs) if seqs else np.zeros(0, '<i8')
+        self.timestamp = np.concatenate(timestamps) if timestamps else np.zeros(0, '<f8')
+
+    def chunk(self, c):
+        """Frame records of chunk c, decoded."""
+        if c == self._chunk:
+            return self._records
+        offset, first, frames = self.index[c]
+        self._file.seek(offset)
+        size = struct.calcsize(_chunkFormat)
+        encoded = self._file.read(size)
+        magic, frames, bits, shift, payloadBytes = struct.unpack(_chunkFormat, encoded)
+        encoded += self._file.read(16*frames + payloadBytes)
+        records = decode_chunk(encoded, self._dtype, self.header['delta'],
+                               self.header['compression'])
+        self._chunk = c
+        self._records = records
+        return records
+
+# Records like Recorder, but to packed (.daqz) files. The writer
+# thread still copies each frame out of the ring, but into a chunk
+# buffer: full chunks are packed and compressed on a pool of worker
+# threads (numpy, zlib and lzma all let go of the GIL) and written
+# in order as they come back. There are 2 chunk buffers per worker:
+# if they're all busy encoding, the writer waits for the oldest,
+# and the ring laps it, so frames get dropped from the recording
+# rather than slowing the acquisition down. Files rotate at chunk
+# boundaries.
+class PackedRecorder(Recorder):
+    """ Streams captures to disk in the packed capture file format.
+
+    See recorder.Recorder for the rest of the attributes.
+
+    Attributes
+    ----------
+
+    bits : int
+       Bits per sample (even, at most 16).
+    shift : int
+       Low bits of each sample that are always zero (e.g. 4 for 12 bit
+       samples in the top of the int16).
+    delta : bool
+       Delta encode the samples.
+    compression : str
+       'none', 'zlib' or 'lzma'.
+    chunkFrames : int
+       Frames per chunk.
+    workers : int
+       Encoding threads.
+    bytesRaw : int
+       Bytes of samples that have gone into the files (the .daq size,
+       for the compression ratio).
+
+    """
+    def __init__(self,
+                 ring,
+                 path,
+                 sampleRate = 3.E9,
+                 overlay = '',
+                 maxBytes = 0,
+                 maxSeconds = 0,
+                 bits = 12,
+                 shift = 0,
+                 delta = False,
+                 compression = 'none',
+                 chunkFrames = 16,
+                 workers = 2,
+                 summary = None,
+                 bufferBytes = 64<<20):
+        if compression not in _compressors:
+            raise ValueError("unknown compression %s" % compression)
+        _group(bits)
+        super().__init__(ring, path, sampleRate, overlay, maxBytes, maxSeconds, summary,
+                         bufferBytes)
+        if not os.path.splitext(path)[1]:
+            self._ext = EXTENSION
+            self.path = self._base + self._ext
+        self.bits = bits
+        self.shift = shift
+        self.delta = delta
+        self.compression = compression
+        self.chunkFrames = max(1, chunkFrames)
+        self.workers = max(1, workers)
+        self.bytesRaw = 0
+        self._chunks = []
+        self._seqs = []
+        self._timestamps = []
+        self._frames = 0
+
+    @property
+    def ratio(self):
+        """Packed file size as a fraction of the .daq size."""
+        return self.bytesWritten/self.bytesRaw if self.bytesRaw else 0.
+
+    def stop(self):
+        running = self._thread is not None
+        super().stop()
+        if running and self.bytesRaw:
+            logger.info("Packed to %.1f%% of the raw size" % (100.*self.ratio))
+
+    def _open(self):
+        super()._open()
+        self._chunks = []
+        self._seqs = []
+        self._timestamps = []
+        self._frames = 0
+
+    def _write_header(self):
+        write_header(self._file,
+                     self.ring.numChannels, self.ring.numSamples,
+                     self.sampleRate, self.overlay,
+                     self._dtype['data'].base.str,
+                     self.delta, self.compression, self.chunkFrames)
+
+    def _close(self):
+        if self._file is None:
+            return
+        index = np.array(self._chunks, index_dtype)
+        seqs = np.concatenate(self._seqs) if self._seqs else np.zeros(0, '<i8')
+        timestamps = np.concatenate(self._timestamps) if self._timestamps else np.zeros(0, '<f8')
+        indexOffset = self._fileBytes
+        tail = b''.join(( struct.pack(_indexFormat, INDEX_MAGIC, len(index)),
+                          index.tobytes(),
+                          seqs.astype('<i8').tobytes(),
+                          timestamps.astype('<f8').tobytes(),
+                          struct.pack(_trailerFormat, TRAILER_MAGIC, indexOffset) ))
+        self._file.write(tail)
+        self.bytesWritten += len(tail)
+        self._file.close()
+        self._file = None
+
+    def _write_chunk(self, records, encoded):
+        if self._rotating() and self._chunks:
+            if ((self.maxBytes > 0 and self._fileBytes + len(encoded) > self.maxBytes) or
+                (self.maxSeconds > 0 and time.time() - self._fileStart > self.maxSeconds)):
+                self._close()
+                self._open()
+        self._chunks.append((self._fileBytes, self._frames, len(records)))
+        self._seqs.append(records['seq'].copy())
+        self._timestamps.append(records['timestamp'].copy())
+        self._file.write(encoded)
+        if self.summary is not None:
+            self.summary.add(records, len(self.files)-1, self._frames)
+        self._fileBytes += len(encoded)
+        self._frames += len(records)
+        self.bytesWritten += len(encoded)
+        self.bytesRaw += records['data'].nbytes
+        self.framesWritten += len(records)
+
+    def _encode(self, records):
+        return encode_chunk(records, self.bits, self.shift,
+                            self.delta, self.compression)
+
+    def _write_loop(self):
+        pool = concurrent.futures.ThreadPoolExecutor(self.workers,
+                                                     thread_name_prefix="rfsoc-encoder")
+        free = [ np.zeros(self.chunkFrames, self._dtype) for i in range(2*self.workers) ]
+        pending = collections.deque()
+        chunk = free.pop()
+        n = 0
+
+        def submit(records):
+            pending.append((records, pool.submit(self._encode, records)))
+
+        def finish(wait):
+            # write whatever's done (or everything, if wait) in order
+            while pending and (wait or pending[0][1].done()):
+                records, future = pending.popleft()
+                self._write_chunk(records, future.result())
+                free.append(records)
+
+        try:
+            self._open()
+            while True:
+                i = self._queue.get()
+                if i is None:
+                    break
+                chunk[n] = self._records[i]
+                self._free.put(i)
+                n += 1
+                if n == self.chunkFrames:
+                    submit(chunk)
+                    n = 0
+                    finish(False)
+                    if not free:
+                        records, future = pending.popleft()
+                        self._write_chunk(records, future.result())
+                        free.append(records)
+                    chunk = free.pop()
+            if n:
+                submit(chunk[:n])
+            finish(True)
+        except Exception as e:
+            logger.error("Recorder stopped: %s" % str(e))
+        finally:
+            pool.shutdown()
+            self._close()
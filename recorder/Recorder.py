@@ -0,0 +1,266 @@
+import numpy as np
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Capture file format
+#
+# Everything is little endian. There's a fixed HEADER_SIZE byte
+# header:
+#
+#   magic        8s   b'RFSDAQ\0\0'
+#   version      I
+#   headerSize   I
+#   numChannels  I
+#   numSamples   I
+#   sampleRate   d
+#   dtype        8s   numpy dtype string of the samples ('<i2')
+#   startTime    d    time.time() when the file was opened
+#   overlay      256s name of the overlay (utf-8, zero padded)
+#
+# followed by fixed-size frame records, appended one at a time:
+#
+#   seq          q    sequence number in the DAQ's ring
+#   timestamp    d    time.time() when the frame was captured
+#   data         (numChannels, numSamples) samples
+#
+# so a file opens as a numpy.memmap of records (see open_recording)
+# and rec['data'] is a (frames, numChannels, numSamples) view of it
+# without copying anything.
+MAGIC = b'RFSDAQ\0\0'
+VERSION = 1
+HEADER_SIZE = 4096
+EXTENSION = '.daq'
+_headerFormat = '<8sIIIId8sd256s'
+
+def record_dtype(numChannels, numSamples, dtype='<i2'):
+    """numpy dtype of one frame record."""
+    return np.dtype([ ('seq', '<i8'),
+                      ('timestamp', '<f8'),
+                      ('data', dtype, (numChannels, numSamples)) ])
+
+def write_header(f, numChannels, numSamples, sampleRate,
+                 overlay='', dtype='<i2', startTime=None):
+    if startTime is None:
+        startTime = time.time()
+    hdr = struct.pack(_headerFormat,
+                      MAGIC, VERSION, HEADER_SIZE,
+                      numChannels, numSamples, sampleRate,
+                      dtype.encode(), startTime,
+                      overlay.encode()[:256])
+    f.write(hdr.ljust(HEADER_SIZE, b'\0'))
+
+def read_header(path):
+    """Returns the header of a capture file as a dict."""
+    with open(path, 'rb') as f:
+        raw = f.read(struct.calcsize(_headerFormat))
+    if len(raw) < struct.calcsize(_headerFormat):
+        raise ValueError("%s is too short to be a capture file" % path)
+    (magic, version, headerSize, numChannels, numSamples, sampleRate,
+     dtype, startTime, overlay) = struct.unpack(_headerFormat, raw)
+    if magic != MAGIC:
+        raise ValueError("%s is not a capture file" % path)
+    if version != VERSION:
+        raise ValueError("%s is capture file version %d, not %d" % (path, version, VERSION))
+    return { 'version' : version,
+             'headerSize' : headerSize,
+             'numChannels' : numChannels,
+             'numSamples' : numSamples,
+             'sampleRate' : sampleRate,
+             'dtype' : dtype.rstrip(b'\0').decode(),
+             'startTime' : startTime,
+             'overlay' : overlay.rstrip(b'\0').decode() }
+
+def open_recording(path, mode='r'):
+    """Open a capture file as (header, records).
+
+    records is a numpy.memmap of frame records: records['data'] is
+    (frames, numChannels, numSamples), records['seq'] and
+    records['timestamp'] are (frames,). A partly-written last frame
+    (from a file that's still being recorded) is left off.
+    """
+    hdr = read_header(path)
+    dt = record_dtype(hdr['numChannels'], hdr['numSamples'], hdr['dtype'])
+    frames = (os.path.getsize(path) - hdr['headerSize'])//dt.itemsize
+    if frames <= 0:
+        return (hdr, np.zeros(0, dt))
+    records = np.memmap(path, dtype=dt, mode=mode,
+                        offset=hdr['headerSize'], shape=(frames,))
+    return (hdr, records)
+
+# Streams frames from the DAQ's ring to disk.
+#
+# The DAQ's ring is only a few frames deep, far too shallow to ride
+# out the writer falling behind for a moment (a slow write, the
+# scheduler), so the recorder has a buffer of its own: bufferBytes
+# worth of preallocated frame records. push(), on the acquisition
+# thread, copies each new frame into a free record (the frame's
+# just been captured, so it can't be overwritten meanwhile) and
+# queues it, which never blocks. A writer thread writes the queued
+# records and hands them back. Only if the disk can't keep up for
+# long enough to fill the whole buffer do frames get dropped, and
+# they're counted in framesDropped.
+class Recorder:
+    """ Streams captures to disk in the append-only capture file format.
+
+    Attributes
+    ----------
+
+    path : str
+       File name to record to. If the recording rotates, files are
+       named <base>_0000.daq, <base>_0001.daq etc.
+    maxBytes : int
+       Rotate to a new file once a file reaches this size (0 = never).
+    maxSeconds : float
+       Rotate to a new file after this long (0 = never).
+    files : list
+       Files written so far.
+    framesWritten : int
+       Frames written to disk.
+    framesDropped : int
+       Frames dropped because the buffer was full (or they'd
+       already gone from the ring).
+    bufferFrames : int
+       Frames the buffer holds.
+    bytesWritten : int
+       Bytes written to disk, including headers.
+    summary : recorder.Summary.Summary
+       Gets every frame written, for the summary index (None for
+       no summary).
+
+    """
+    def __init__(self,
+                 ring,
+                 path,
+                 sampleRate = 3.E9,
+                 overlay = '',
+                 maxBytes = 0,
+                 maxSeconds = 0,
+                 summary = None,
+                 bufferBytes = 64<<20):
+        self.ring = ring
+        base, ext = os.path.splitext(path)
+        self._base = base
+        self._ext = ext if ext else EXTENSION
+        self.path = base + self._ext
+        self.sampleRate = sampleRate
+        self.overlay = overlay
+        self.maxBytes = maxBytes
+        self.maxSeconds = maxSeconds
+        self.files = []
+        self.framesWritten = 0
+        self.framesDropped = 0
+        self.bytesWritten = 0
+        self.summary = summary
+        self._dtype = record_dtype(ring.numChannels, ring.numSamples,
+                                   ring.frames.dtype.str)
+        self.bufferFrames = max(ring.depth, bufferBytes//self._dtype.itemsize)
+        self._records = np.zeros(self.bufferFrames, self._dtype)
+        # indices of the records that are free / waiting to be written
+        self._free = queue.SimpleQueue()
+        for i in range(self.bufferFrames):
+            self._free.put(i)
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._file = None
+        self._fileBytes = 0
+        self._fileStart = 0.
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._thread = threading.Thread(target=self._write_loop,
+                                        name="rfsoc-recorder",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Write out whatever's queued, then close the file."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        if self.summary is not None:
+            self.summary.close()
+        logger.info("Recorded %d frames (%d dropped) to %s" %
+                    (self.framesWritten, self.framesDropped,
+                     ", ".join(self.files)))
+
+    def push(self, seq):
+        """Queue frame seq to be written. Called from the acquisition thread."""
+        frame = self.ring.get(seq)
+        try:
+            i = self._free.get(block=False)
+        except queue.Empty:
+            frame = None
+        if frame is None:
+            self.framesDropped += 1
+            return
+        rec = self._records[i]
+        rec['data'][...] = frame
+        rec['timestamp'] = self.ring.timestamp(seq)
+        rec['seq'] = seq
+        self._queue.put(i)
+
+    def _rotating(self):
+        return self.maxBytes > 0 or self.maxSeconds > 0
+
+    def _open(self):
+        if self._rotating():
+            path = "%s_%4.4d%s" % (self._base, len(self.files), self._ext)
+        else:
+            path = self.path
+        self._file = open(path, 'wb', buffering=1<<20)
+        self._write_header()
+        self.files.append(path)
+        self._fileBytes = HEADER_SIZE
+        self._fileStart = time.time()
+        self.bytesWritten += HEADER_SIZE
+        logger.debug("Recording to %s" % path)
+
+    def _write_header(self):
+        write_header(self._file,
+                     self.ring.numChannels, self.ring.numSamples,
+                     self.sampleRate, self.overlay,
+                     self._dtype['data'].base.str)
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write_loop(self):
+        try:
+            self._open()
+            while True:
+                i = self._queue.get()
+                if i is None:
+                    break
+                record = self._records[i:i+1]
+                if self._rotating() and self._fileBytes > HEADER_SIZE:
+                    if ((self.maxBytes > 0 and self._fileBytes + self._dtype.itemsize > self.maxBytes) or
+                        (self.maxSeconds > 0 and time.time() - self._fileStart > self.maxSeconds)):
+                        self._close()
+                        self._open()
+                self._file.write(record.data)
+                if self.summary is not None:
+                    self.summary.add(record, len(self.files)-1,
+                                     (self._fileBytes - HEADER_SIZE)//self._dtype.itemsize)
+                self._free.put(i)
+                self._fileBytes += self._dtype.itemsize
+                self.bytesWritten += self._dtype.itemsize
+                self.framesWritten += 1
+        except Exception as e:
+            logger.error("Recorder stopped: %s" % str(e))
+        finally:
+            self._close()
@@ -0,0 +1,130 @@
+import numpy as np
+import logging
+import time
+
+from recorder.Packed import open_capture
+
+logger = logging.getLogger(__name__)
+
+# Plays back a capture file (see Recorder, or Packed for .daqz
+# files) through the same internal_capture( buffer, numChannels )
+# interface an overlay has, so everything downstream (display,
+# spectrum, recording, user callbacks) can be run against real
+# data without a board. Each capture is just a copy out of the
+# memmapped file (or the decoded chunk, for packed files).
+class Replay:
+    """ Replays a capture file as if it were an overlay.
+
+    Attributes
+    ----------
+
+    path : str
+       Capture file being replayed.
+    header : dict
+       Its header (see recorder.Recorder.read_header).
+    records : numpy.memmap or recorder.Packed.PackedFile
+       Its frame records.
+    sampleRate : float
+       Sample rate from the header.
+    frames : int
+       Number of frames in the file.
+    position : int
+       Frame the next capture returns.
+    mode : str
+       'realtime' paces captures by the recorded timestamps (divided
+       by speed), 'max' returns them as fast as possible, 'step'
+       keeps returning the same frame until step() or seek().
+    speed : float
+       Playback speed multiplier in 'realtime' mode.
+    loop : bool
+       Go back to the start at the end of the file instead of
+       raising EOFError.
+    selection : numpy.ndarray
+       Frames of the file being played (see select()), or None
+       for all of them. position and frames count these.
+
+    """
+    modes = ( 'realtime', 'max', 'step' )
+
+    def __init__(self, path, mode = 'realtime', speed = 1., loop = True):
+        if mode not in self.modes:
+            raise ValueError("unknown replay mode %s" % mode)
+        self.mode = mode
+        self.speed = speed
+        self.loop = loop
+        self.open(path)
+
+    def open(self, path):
+        self.header, self.records = open_capture(path)
+        self.path = path
+        self.sampleRate = self.header['sampleRate']
+        self.frames = len(self.records)
+        if self.frames == 0:
+            raise ValueError("%s has no frames in it" % path)
+        self.position = 0
+        self.selection = None
+        self._sync = None
+        logger.debug("Replaying %d frames of %s from %s" %
+                     (self.frames, self.header['overlay'], path))
+
+    def select(self, frames = None):
+        """Only play these frames of the file (None = all of them)."""
+        if frames is None:
+            self.selection = None
+            self.frames = len(self.records)
+        else:
+            self.selection = np.asarray(frames, np.int64)
+            if len(self.selection) == 0:
+                raise ValueError("no frames selected")
+            self.frames = len(self.selection)
+        self.position = 0
+        self._sync = None
+
+    def seek(self, position):
+        """Move to frame position (negative counts from the end)."""
+        if position < 0:
+            position += self.frames
+        self.position = min(max(position, 0), self.frames-1)
+        self._sync = None
+
+    def step(self, n = 1):
+        """Move n frames forward (or back), wrapping around if looping."""
+        if self.loop:
+            self.seek((self.position + n) % self.frames)
+        else:
+            self.seek(self.position + n)
+
+    def _wait(self, timestamp):
+        now = time.perf_counter()
+        # resync at the start, after seeking, and if we've fallen way behind
+        if self._sync is None or now - self._due(timestamp) > 1.:
+            self._sync = (now, timestamp)
+            return
+        due = self._due(timestamp)
+        if due > now:
+            time.sleep(due - now)
+
+    def _due(self, timestamp):
+        wall, recorded = self._sync
+        return wall + (timestamp - recorded)/self.speed
+
+    def internal_capture(self, buf, numChan):
+        if self.position >= self.frames:
+            if not self.loop:
+                raise EOFError("end of %s" % self.path)
+            self.position = 0
+            self._sync = None
+        if self.selection is None:
+            rec = self.records[self.position]
+        else:
+            rec = self.records[self.selection[self.position]]
+        data = rec['data']
+        if data.shape[-1] != buf.shape[-1]:
+            raise ValueError("%s has %d samples per capture, buffer has %d" %
+                             (self.path, data.shape[-1], buf.shape[-1]))
+        if self.mode == 'realtime':
+            self._wait(rec['timestamp'])
+        n = min(numChan, data.shape[0])
+        np.copyto(buf[:n], data[:n])
+        if self.mode != 'step':
+            self.position += 1
@@ -0,0 +1,296 @@
+import numpy as np
+import logging
+import os
+import struct
+import time
+
+from recorder.Recorder import HEADER_SIZE
+from recorder.Packed import open_capture
+from recorder.Replay import Replay
+from spectrum.Spectrum import Spectrum
+
+logger = logging.getLogger(__name__)
+
+# Summary index file format
+#
+# A recording gets a .sum file next to it with a few numbers per
+# frame, so finding the interesting frames in an overnight run is
+# a search over a small memmapped table instead of a pass over
+# every sample. Everything is little endian. The header
+# (HEADER_SIZE bytes) is:
+#
+#   magic        8s   b'RFSSUM\0\0'
+#   version      I
+#   headerSize   I
+#   numChannels  I
+#   numSamples   I
+#   sampleRate   d
+#   fullScale    d    ADC code of full scale (for dBFS and saturation)
+#   startTime    d    time.time() when the file was opened
+#   recording    256s name of the recording (utf-8, zero padded,
+#                     relative to the .sum file's directory): the
+#                     file itself, or <base><ext> if it rotated
+#   rotating     I    1 if the recording is <base>_NNNN<ext> files
+#   bands        I    number of frequency bands
+#   edges        d[2*bands] low/high edge of each band (Hz)
+#
+# followed by fixed-size records (see summary_dtype), one per
+# frame written to the recording, in the order they were written:
+#
+#   seq          q    sequence number in the DAQ's ring
+#   timestamp    d    capture time
+#   file         I    which file of a rotated recording it's in
+#   frame        I    frame number in that file
+#   rms          f[numChannels]  RMS (ADC counts)
+#   peak         f[numChannels]  largest |sample| (ADC counts)
+#   peakPos      i[numChannels]  sample number of the peak
+#   saturated    i[numChannels]  samples at or beyond full scale
+#   band         f[numChannels, bands]  power in each band (dBFS)
+MAGIC = b'RFSSUM\0\0'
+VERSION = 1
+EXTENSION = '.sum'
+_headerFormat = '<8sIIIIddd256sII'
+
+def summary_dtype(numChannels, bands = 0):
+    """numpy dtype of one summary record."""
+    return np.dtype([ ('seq', '<i8'),
+                      ('timestamp', '<f8'),
+                      ('file', '<u4'),
+                      ('frame', '<u4'),
+                      ('rms', '<f4', (numChannels,)),
+                      ('peak', '<f4', (numChannels,)),
+                      ('peakPos', '<i4', (numChannels,)),
+                      ('saturated', '<i4', (numChannels,)),
+                      ('band', '<f4', (numChannels, bands)) ])
+
+def summary_path(path):
+    """The .sum file for a recording (or its base name)."""
+    base, ext = os.path.splitext(path)
+    return base + EXTENSION
+
+def read_header(path):
+    """Returns the header of a summary file as a dict."""
+    size = struct.calcsize(_headerFormat)
+    with open(path, 'rb') as f:
+        raw = f.read(HEADER_SIZE)
+    if len(raw) < size:
+        raise ValueError("%s is too short to be a summary file" % path)
+    (magic, version, headerSize, numChannels, numSamples, sampleRate,
+     fullScale, startTime, recording, rotating, bands) = struct.unpack(_headerFormat, raw[:size])
+    if magic != MAGIC:
+        raise ValueError("%s is not a summary file" % path)
+    if version != VERSION:
+        raise ValueError("%s is summary file version %d, not %d" % (path, version, VERSION))
+    edges = np.frombuffer(raw, '<f8', 2*bands, size).reshape(bands, 2)
+    return { 'version' : version,
+             'headerSize' : headerSize,
+             'numChannels' : numChannels,
+             'numSamples' : numSamples,
+             'sampleRate' : sampleRate,
+             'fullScale' : fullScale,
+             'startTime' : startTime,
+             'recording' : recording.rstrip(b'\0').decode(),
+             'rotating' : bool(rotating),
+             'bands' : [ (float(lo), float(hi)) for lo, hi in edges ] }
+
+# Writes the summary of every frame a Recorder writes. It's called
+# on the recorder's writer thread with the records it just wrote
+# (one frame, or a chunk of them), so the acquisition never sees it.
+# All the features are computed on the whole batch at once, and the
+# band powers come from a private spectrum.Spectrum (no averaging),
+# only if there are any bands.
+class Summary:
+    """ Per-frame summary writer.
+
+    Attributes
+    ----------
+
+    path : str
+       Summary file name.
+    bands : list
+       (low, high) edges in Hz of the bands whose power is kept.
+    framesWritten : int
+       Summary records written.
+
+    """
+    def __init__(self,
+                 path,
+                 recording,
+                 numChannels,
+                 numSamples,
+                 sampleRate = 3.E9,
+                 fullScale = 2**15,
+                 bands = (),
+                 window = 'hann',
+                 rotating = False):
+        self.path = path
+        self.bands = [ (float(lo), float(hi)) for lo, hi in bands ]
+        self.framesWritten = 0
+        self.fullScale = fullScale
+        self._dtype = summary_dtype(numChannels, len(self.bands))
+        self._spectrum = None
+        if self.bands:
+            self._spectrum = Spectrum(sampleRate, window, fullScale)
+            freqs = self._spectrum.frequencies(numSamples)
+            self._masks = np.array([ (freqs >= lo) & (freqs < hi)
+                                     for lo, hi in self.bands ], np.float64).T
+        self._work = None
+        self._file = open(path, 'wb', buffering=1<<16)
+        relative = os.path.relpath(os.path.abspath(recording),
+                                   os.path.dirname(os.path.abspath(path)))
+        hdr = struct.pack(_headerFormat,
+                          MAGIC, VERSION, HEADER_SIZE,
+                          numChannels, numSamples, sampleRate,
+                          fullScale, time.time(),
+                          relative.encode()[:256],
+                          1 if rotating else 0,
+                          len(self.bands))
+        hdr += np.array(self.bands, '<f8').tobytes()
+        self._file.write(hdr.ljust(HEADER_SIZE, b'\0'))
+
+    def add(self, records, file, first):
+        """Summarize frame records, which went into file at frame first on."""
+        data = records['data']
+        n = len(records)
+        if self._work is None or self._work.shape[0] < n:
+            self._work = np.empty(data.shape, np.float32)
+            self._abs = np.empty(data.shape, np.float32)
+            self._out = np.zeros(n, self._dtype)
+        work = self._work[:n]
+        absval = self._abs[:n]
+        out = self._out[:n]
+        out['seq'] = records['seq']
+        out['timestamp'] = records['timestamp']
+        out['file'] = file
+        out['frame'] = np.arange(first, first + n)
+        np.copyto(work, data)
+        np.abs(work, out=absval)
+        out['peakPos'] = np.argmax(absval, axis=-1)
+        out['peak'] = np.take_along_axis(absval, out['peakPos'][..., None], -1)[..., 0]
+        out['saturated'] = np.count_nonzero(absval >= self.fullScale - 1, axis=-1)
+        np.square(work, out=work)
+        out['rms'] = np.sqrt(work.mean(axis=-1))
+        if self._spectrum is not None:
+            power = 10.**(self._spectrum.compute(data)/10.)
+            out['band'] = 10.*np.log10(np.maximum(power @ self._masks, 1.E-20))
+        self._file.write(out.data)
+        self.framesWritten += n
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+# Reads a summary file and answers questions from it alone: the
+# records are a memmap, so columns are just arrays and a query is
+# a numpy expression over them. The frames it picks out can then
+# be read straight out of the recording (frame()), found in it
+# (locate(), offset()) or replayed (replay()).
+class SummaryIndex:
+    """ Query a recording's summary index.
+
+    idx.records[<field>] is a column (see summary_dtype): e.g.
+    idx.records['peak'][:, 2] is channel 2's peak for every frame.
+
+    Attributes
+    ----------
+
+    path : str
+       Summary file name.
+    header : dict
+       Its header (see read_header).
+    records : numpy.memmap
+       The summary records.
+
+    """
+    def __init__(self, path):
+        if not path.endswith(EXTENSION):
+            path = summary_path(path)
+        self.path = path
+        self.header = read_header(path)
+        self._dtype = summary_dtype(self.header['numChannels'],
+                                    len(self.header['bands']))
+        frames = (os.path.getsize(path) - self.header['headerSize'])//self._dtype.itemsize
+        if frames <= 0:
+            self.records = np.zeros(0, self._dtype)
+        else:
+            self.records = np.memmap(path, dtype=self._dtype, mode='r',
+                                     offset=self.header['headerSize'],
+                                     shape=(frames,))
+        self._captures = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    # lets a query say peak[2] for channel 2's peak column
+    class Column:
+        def __init__(self, values):
+            self.values = values
+
+        def __getitem__(self, channel):
+            return self.values[:, channel]
+
+    def query(self, expression):
+        """Rows (numpy array) of the frames matching expression.
+
+        expression is evaluated with each field as a column by
+        channel (rms[ch], peak[ch], peakPos[ch], saturated[ch],
+        band[ch] is (rows, bands)) plus seq, timestamp, file and
+        frame, and np: combine conditions with & and |, e.g.
+        "(peak[2] > 1000) & (saturated[0] == 0)".
+        """
+        names = { 'np' : np }
+        for field in self._dtype.names:
+            column = self.records[field]
+            names[field] = self.Column(column) if column.ndim > 1 else column
+        mask = eval(expression, { '__builtins__' : {} }, names)
+        return np.flatnonzero(mask)
+
+    def recording(self, row):
+        """Path of the recording file frame row is in."""
+        name = os.path.join(os.path.dirname(os.path.abspath(self.path)),
+                            self.header['recording'])
+        if not self.header['rotating']:
+            return name
+        base, ext = os.path.splitext(name)
+        return "%s_%4.4d%s" % (base, self.records['file'][row], ext)
+
+    def locate(self, row):
+        """(recording file, frame number in it) of frame row."""
+        return (self.recording(row), int(self.records['frame'][row]))
+
+    def _capture(self, path):
+        if path not in self._captures:
+            self._captures[path] = open_capture(path)
+        return self._captures[path]
+
+    def offset(self, row):
+        """Byte offset of frame row's record in a .daq recording
+        (None for .daqz files, which aren't fixed-size records)."""
+        path, frame = self.locate(row)
+        hdr, records = self._capture(path)
+        if not isinstance(records, np.memmap):
+            return None
+        return hdr['headerSize'] + frame*records.dtype.itemsize
+
+    def frame(self, row):
+        """Frame row's (numChannels, numSamples) data, from the recording.
+
+        For .daq recordings it's a view of the memmap, not a copy.
+        """
+        path, frame = self.locate(row)
+        hdr, records = self._capture(path)
+        return records[frame]['data']
+
+    def replay(self, rows, mode = 'step', loop = True):
+        """A recorder.Replay overlay that plays just these frames.
+
+        They all have to be in the same file of the recording.
+        """
+        rows = np.asarray(rows)
+        files = set(self.recording(row) for row in rows)
+        if len(files) != 1:
+            raise ValueError("frames to replay are in %d files, not 1" % len(files))
+        replay = Replay(files.pop(), mode, loop=loop)
+        replay.select(self.records['frame'][rows])
+        return replay
@@ -0,0 +1,26 @@
+import os
+
+from recorder.Replay import Replay
+
+# Load this like any other overlay to replay a capture file
+# instead of talking to a board. The file comes from the
+# RFSOC_PYDAQ_REPLAY environment variable if it's set, otherwise
+# you get asked for it. Change how it plays from the console:
+# daq.dev.mode, daq.dev.speed, daq.dev.seek(), daq.dev.step()...
+class FakeOverlay:
+    def __init__(self):
+        return
+
+
+class ReplayRFSoC(FakeOverlay, Replay):
+    def __init__(self, path=None):
+        if path is None:
+            path = os.environ.get('RFSOC_PYDAQ_REPLAY')
+        if path is None:
+            from tkinter import filedialog
+            path = filedialog.askopenfilename(title="Select a capture file to replay",
+                                              filetypes=[("Capture files","*.daq *.daqz"),
+                                                         ("All files", "*.*")])
+        if not path:
+            raise ValueError("No capture file to replay")
+        Replay.__init__(self, os.path.abspath(path))
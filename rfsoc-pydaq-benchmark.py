@@ -0,0 +1,90 @@
+import argparse
+import logging
+import sys
+
+from benchmark import Benchmark
+
+logger = logging.getLogger(__name__)
+
+# Benchmarks the acquisition-to-display pipeline against
+# FakeRFSoC (or a replayed capture file), no display needed.
+# Results go to a JSON file; point --baseline at an earlier
+# one to flag anything that got slower.
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="rfsoc-pydaq benchmarks")
+    parser.add_argument('-c', '--channels', default="1,4,8",
+                        help="numChannels settings to run (default 1,4,8)")
+    parser.add_argument('-n', '--samples', default="2048,16384,65536",
+                        help="numSamples settings to run (default 2048,16384,65536)")
+    parser.add_argument('-r', '--replay', metavar='FILE',
+                        help="capture from this capture file instead of FakeRFSoC")
+    parser.add_argument('-t', '--seconds', type=float, default=1.,
+                        help="how long each end-to-end run takes (default 1)")
+    parser.add_argument('-o', '--output', default="benchmark.json",
+                        help="results file (default benchmark.json)")
+    parser.add_argument('-b', '--baseline', metavar='FILE',
+                        help="flag regressions against this results file")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="how much worse counts as a regression (default 0.2 = 20%%)")
+    parser.add_argument('--skip', default="",
+                        help="benchmarks to skip (capture,fft,correlate,pack,plot,log,pipeline)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    skip = set(s for s in args.skip.split(',') if s)
+
+    if args.replay:
+        from recorder.Replay import Replay
+        def device():
+            return Replay(args.replay, mode='max')
+        dev = device()
+        configs = [ (dev.header['numChannels'], dev.header['numSamples']) ]
+    else:
+        device = Benchmark.fake_device
+        configs = [ (int(c), int(n))
+                    for c in args.channels.split(',')
+                    for n in args.samples.split(',') ]
+
+    results = {}
+    def add(suffix, r):
+        for name in r:
+            results["%s/%s" % (name, suffix)] = r[name]
+            logger.info("%-32s %12.4g %s" % ("%s/%s" % (name, suffix),
+                                              r[name]['value'], r[name]['unit']))
+
+    for numChannels, numSamples in configs:
+        config = "%dx%d" % (numChannels, numSamples)
+        if 'capture' not in skip:
+            add(config, Benchmark.bench_capture(device(), numChannels, numSamples))
+        if 'fft' not in skip:
+            add(config, Benchmark.bench_fft(numChannels, numSamples))
+        if 'correlate' not in skip:
+            add(config, Benchmark.bench_correlate(numChannels, numSamples))
+        if 'pack' not in skip:
+            add(config, Benchmark.bench_pack(numChannels, numSamples))
+        if 'pipeline' not in skip:
+            add(config, Benchmark.bench_pipeline(device(), numChannels, numSamples,
+                                                 args.seconds))
+    if 'plot' not in skip:
+        for numSamples in sorted(set(n for c, n in configs)):
+            add("%d" % numSamples, Benchmark.bench_plot(numSamples))
+    if 'log' not in skip:
+        add("1000", Benchmark.bench_log(1000))
+
+    Benchmark.save(args.output, results)
+    logger.info("Results in %s" % args.output)
+
+    if args.baseline:
+        info, baseline = Benchmark.load(args.baseline)
+        regressions = Benchmark.compare(results, baseline, args.tolerance)
+        logger.info("Compared with %s (%s on %s)" % (args.baseline, info['time'], info['host']))
+        for name, old, new, change in regressions:
+            logger.warning("REGRESSION %-32s %12.4g -> %12.4g %s (%+.0f%%)" %
+                           (name, old, new, results[name]['unit'], 100*change))
+        if regressions:
+            return 1
+        logger.info("No regressions")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
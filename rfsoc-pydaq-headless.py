@@ -0,0 +1,117 @@
+# made before the rest of the imports, so they get timed too
+from instrument.StartupTimer import StartupTimer
+startup = StartupTimer()
+
+import argparse
+import logging
+import sys, time
+
+from daqcore.DaqCore import DaqCore, read_config
+from daqcore.DaqCore import default_numChannels, default_numSamples
+from daqcore.DaqCore import default_sampleRate, default_ringDepth
+
+logger = logging.getLogger(__name__)
+startup.mark('imports')
+
+# Headless rfsoc-pydaq: same acquisition (daqcore.DaqCore) as
+# the GUI, but no Tk, no matplotlib and no display polling, so
+# everything goes into the capture (and the recorder). Useful
+# over ssh or for long unattended runs. The spectrum is off
+# unless asked for, since nothing's looking at it.
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Headless rfsoc-pydaq acquisition")
+    parser.add_argument('overlay', nargs='?',
+                        help="Python overlay module to load (e.g. zcumts.py, default the most recent one)")
+    parser.add_argument('-o', '--output',
+                        help="record captures to this file")
+    parser.add_argument('-n', '--frames', type=int, default=0,
+                        help="stop after this many triggered frames (0 = never)")
+    parser.add_argument('-t', '--seconds', type=float, default=0,
+                        help="stop after this many seconds (0 = never)")
+    parser.add_argument('-c', '--config', default="rfsoc-pydaq.ini",
+                        help="ini file (default rfsoc-pydaq.ini)")
+    parser.add_argument('--max-bytes', type=int, default=None,
+                        help="start a new capture file after this many bytes")
+    parser.add_argument('--max-seconds', type=float, default=None,
+                        help="start a new capture file after this many seconds")
+    parser.add_argument('--bits', type=int, default=None,
+                        help="pack samples to this many bits (.daqz, default recordBits in the ini)")
+    parser.add_argument('--compression', choices=('none', 'zlib', 'lzma'), default=None,
+                        help="compress the recording (.daqz, default recordCompression in the ini)")
+    parser.add_argument('--serve', type=int, default=None, metavar='PORT',
+                        help="stream captures on this port (default streamPort in the ini, 0 = don't)")
+    parser.add_argument('--publish', default=None, metavar='NAME',
+                        help="publish captures on a shared memory frame bus (default busName in the ini)")
+    parser.add_argument('--spectrum', action='store_true',
+                        help="compute the spectrum of each capture")
+    parser.add_argument('-s', '--status', type=float, default=5.,
+                        help="seconds between status lines (0 = none)")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="debug logging")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s: %(message)s')
+
+    pydaq_cfg = read_config(args.config)
+    daq = DaqCore(pydaq_cfg.getint('numChannels',
+                                   fallback=default_numChannels),
+                  pydaq_cfg.getint('numSamples',
+                                   fallback=default_numSamples),
+                  pydaq_cfg.getfloat('sampleRate',
+                                     fallback=default_sampleRate),
+                  pydaq_cfg.getint('ringDepth',
+                                   fallback=default_ringDepth))
+    daq.configure(pydaq_cfg)
+    daq.overlays.read(args.config)
+    daq.spectrum.enabled = args.spectrum
+    startup.mark('config')
+
+    if not daq.load(args.overlay):
+        return 1
+    startup.mark('overlay')
+    startup.add('  import', daq.overlays.timing['import'])
+    startup.add('  create/program', daq.overlays.timing['overlay'])
+    if args.bits is not None:
+        daq.recordCodec['bits'] = args.bits
+    if args.compression is not None:
+        daq.recordCodec['compression'] = args.compression
+    if args.output:
+        daq.record(args.output, args.max_bytes, args.max_seconds)
+    if args.serve is not None:
+        daq.streamPort = args.serve
+    if daq.streamPort:
+        daq.serve()
+    if args.publish is not None:
+        daq.busName = args.publish
+    if daq.busName:
+        daq.publish()
+    startup.mark('recording/streaming')
+    logger.info(startup.report())
+    daq.start(args.frames)
+    start = time.monotonic()
+    lastStatus = start
+    try:
+        while daq.running:
+            time.sleep(0.1)
+            now = time.monotonic()
+            if args.seconds and now - start >= args.seconds:
+                break
+            if args.status and now - lastStatus >= args.status:
+                logger.info(daq.status())
+                lastStatus = now
+    except KeyboardInterrupt:
+        logger.info("Interrupted")
+    finally:
+        daq.stop()
+        daq.stop_recording()
+        daq.stop_serving()
+        daq.stop_publishing()
+    logger.info(daq.status())
+    logger.info("%d frames acquired, %d triggered in %.1f s" %
+                (daq.framesAcquired, daq.trigger.triggers,
+                 time.monotonic() - start))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,20 +1,46 @@
+# made before the rest of the imports, so they get timed too
+from instrument.StartupTimer import StartupTimer
+startup = StartupTimer()
+
 import numpy as np
 import tkinter as tk
 from tkinter import filedialog
 
 import logging
-import os, sys, inspect, importlib, configparser
+import sys
 
 from textconsole.TextConsole import TextConsole
 from scrolledlog.ScrolledLog import ScrolledLog
-from waveframe.Waveframe import Waveframe
+from waveframe.Waveframe import Waveframe, import_matplotlib
+from waveframe.ChannelGrid import ChannelGrid
+from waveframe.SharedFrame import SharedFrame
+from userpool.UserPool import UserPool
+from daqcore.DaqCore import DaqCore, read_config
+from daqcore.DaqCore import default_numChannels, default_numSamples
+from daqcore.DaqCore import default_sampleRate, default_ringDepth
 
 logger = logging.getLogger(__name__)
+startup.mark('imports')
 
 # these values are *default* if no ini is present!
-default_numChannels = 4
-default_numSamples = 2048
-default_sampleRate = 3.E9
+# (the acquisition ones are in daqcore.DaqCore)
+# display refresh interval in continuous mode, in milliseconds
+default_refreshInterval = 50
+# user analysis workers (threads, processes: 0 = one per CPU)
+default_userThreads = 2
+default_userProcesses = 0
+# status bar update interval (ms)
+default_statusInterval = 500
+# run console commands on a worker thread (see textconsole.TextConsole)
+default_consoleThreaded = True
+# log window: lines kept and lowest level shown
+default_logLines = 1000
+default_logLevel = 'DEBUG'
+# channel displays: 'grid' (a Waveframe per channel, paged)
+# or 'shared' (all channels in one figure), and how many across/down
+default_displayLayout = 'grid'
+default_displayColumns = 4
+default_displayRows = 1
 
 theDaq = None
 
@@ -22,137 +48,225 @@ theDaq = None
 # It gets passed to the internal Python console,
 # so it has stuff stored in it.
 # It internally holds the top displays.
-class RFSoC_Daq:
+#
+# All of the acquisition is in daqcore.DaqCore, which doesn't
+# know about Tk: this just adds the displays and polls the
+# ring for the newest frame to display. With lots of channels
+# the displays are paged (see waveframe.ChannelGrid) or share
+# one figure (waveframe.SharedFrame), so only what's on screen
+# costs anything.
+class RFSoC_Daq(DaqCore):
     """ Class holding all of the data for the current program.
 
     The RFSoC_Daq class holds all of the user-accessible
     data for the current program instance involving accessing
-    the RFSoC.
+    the RFSoC. See daqcore.DaqCore for the acquisition part
+    (dev, ring, adcBuffer, spectrum, trigger, instrument,
+    recorder, consumers...).
     
     Attributes
     ----------
 
-    numChannels : int
-       Number of channels accessible (usually 4).
-    numSamples : int
-       Number of samples in an acquisition.
-    adcBuffer : numpy.ndarray
-       Buffer containing the last acquired data
-    dev : pynq.Overlay
-       Class representing the current programmed RFSoC    
     frame : tkinter.Frame 
-       Tk frame holding the Waveframes
-    wf : :obj:`list` of :obj:`waveframe.Waveframe`
-       numChannels list of the Waveframes in the DAQ
+       Tk frame holding the displays
+    wf : :obj:`waveframe.ChannelGrid` or :obj:`waveframe.SharedFrame`
+       The channel displays: wf[ch] is channel ch's Waveframe
+       in the grid layout.
+    userPool : userpool.UserPool
+       Workers for user analysis (see Waveframe.set_user_analysis).
+    refreshInterval : int
+       Display refresh interval (ms) in continuous mode.
+    display : str
+       'live' to show the newest frame, 'average' to show the
+       accumulator's mean (see average()).
+    framesDisplayed : int
+       Number of frames actually plotted since the last start().
+    framesDropped : int
+       Number of triggered frames never plotted because the
+       display could not keep up.
 
     """
     def __init__(self,
                  frame,
                  numChannels = 4,
                  numSamples = 2048,
-                 sampleRate = 3.E9
+                 sampleRate = 3.E9,
+                 refreshInterval = 50,
+                 ringDepth = 8,
+                 userThreads = 2,
+                 userProcesses = None,
+                 layout = 'grid',
+                 columns = 4,
+                 rows = 1
                  ):
-        self.numChannels = numChannels
-        self.numSamples = numSamples
+        super().__init__(numChannels, numSamples, sampleRate, ringDepth)
         self.frame = frame
-        self.adcBuffer = np.zeros( (numChannels, numSamples), np.int16 )
-        self.dev = None
-        self.wf = []
-        for i in range(numChannels):
-            thisWf = Waveframe(self.frame, sampleRate)
-            self.wf.append(thisWf)
-            thisWf.pack(side = tk.LEFT )
+        self.userPool = UserPool(self.frame, userThreads, userProcesses)
+        if layout == 'shared':
+            self.wf = SharedFrame(self.frame, numChannels, sampleRate, columns)
+        else:
+            if layout != 'grid':
+                logger.warning("unknown display layout %s, using grid" % layout)
+            self.wf = ChannelGrid(self.frame, numChannels,
+                                  lambda parent, ch: Waveframe(parent, sampleRate,
+                                                               pool=self.userPool),
+                                  columns, rows)
+        self.wf.pack(side = tk.LEFT )
+
+        self._lastDisplayed = -1
+        self._lastDisplayedTriggers = 0
+        self.refreshInterval = refreshInterval
+        self.display = 'live'
+        self.framesDisplayed = 0
+        self.framesDropped = 0
+
+    def average(self, on = True):
+        """Start (over) averaging, showing the averages, or go back to live."""
+        super().average(on)
+        self.display = 'average' if on else 'live'
+        self.plot()
+
+    def acquire(self):
+        """Single capture into the ring, then plot it."""
+        seq = super().acquire()
+        if seq < 0:
+            return
+        self._lastDisplayed = seq
+        self.plot()
+
+    def start(self):
+        """Start continuous acquisition."""
+        if self.running:
+            return
+        self._lastDisplayed = self.lastAccepted
+        self._lastDisplayedTriggers = 0
+        self.framesDisplayed = 0
+        self.framesDropped = 0
+        super().start()
+        if self.running:
+            self.frame.after(self.refreshInterval, self.poll)
+
+    def stop(self):
+        """Stop continuous acquisition, waiting for the last capture."""
+        if self._thread is None:
+            return
+        super().stop()
+        logger.debug("%d frames displayed, %d dropped" %
+                     (self.framesDisplayed,
+                      self.framesDropped))
+
+    def poll(self):
+        """Display the newest frame, if any. Runs on the Tk thread."""
+        seq = self.lastAccepted
+        if seq > self._lastDisplayed:
+            triggers = self.trigger.triggers
+            self.framesDropped += triggers - self._lastDisplayedTriggers - 1
+            self._lastDisplayedTriggers = triggers
+            self._lastDisplayed = seq
+            frame = self.ring.get(seq)
+            if frame is not None:
+                self.plot(frame)
+                self.framesDisplayed += 1
+        # keep polling until the thread's gone and
+        # we've picked up the last frame it made
+        if self.running or self.lastAccepted > self._lastDisplayed:
+            self.frame.after(self.refreshInterval, self.poll)
+
+    def plot(self, frame = None):
+        """Plot a frame (default the newest triggered one, or the average) in the displays."""
+        if frame is None:
+            frame = self.ring.get(self.lastAccepted)
+        if frame is None:
+            frame = self.adcBuffer
+        if self.display == 'average' and self.accumulator.count:
+            frame = self.accumulator.mean
+        t = self.instrument.start()
+        seq, freqs, db = self.spectrum.result
+        self.wf.plot(frame, freqs, db, self.waterfall.view())
+        self.instrument.lap('plot', t)
+
+    def status(self):
+        """One-line status: rates, per-stage p50/p99 and dropped frames."""
+        return super().status() + " | dropped %d" % self.framesDropped
 
 def defaultUserCommand():
     return
 
 
 def rfsocLoad():
-    """Load an overlay file describing an RFSoC instance.
-    The overlay needs to support being created bare (just "overlayName()")
-    and must support the "internal_capture( buffer, numChannels )"
-    function.
-    """    
+    """Ask for an overlay file and load it (see daqcore.DaqCore.load_overlay)."""
     file_path = filedialog.askopenfilename(title="Select an overlay module",
                                            filetypes=[("Python files","*.py"),
                                                       ("All files", "*.*")])
-    logger.debug("Asked to load overlay at %s" % file_path)
-    newdir = os.path.dirname(os.path.abspath(file_path))    
-
-    curpath = sys.path
-    logger.debug("Adding directory %s to module search path" % newdir)
-    sys.path.insert(1, newdir)    
-    curdir = os.path.abspath(os.curdir)
-    logger.debug("Changing directory to %s" % newdir)
-    os.chdir(newdir)
-    base, extension = os.path.splitext(os.path.basename(file_path))
-    logger.debug("Going to try to import %s", base)
-    # create a custom exception
-    class LocalException(Exception):
-        pass
-    
-    try:
-        module = importlib.import_module(base, package=None)
-        # First try to find an Overlay or module.FakeOverlay module.
-        # FakeOverlays need to be defined in the same file.
-        overlayClass = None
-        for name, obj in inspect.getmembers(module):
-            if inspect.isclass(obj):
-                if obj.__name__ == 'Overlay' and obj.__module__ == 'pynq.overlay':
-                    overlayClass = obj
-                if obj.__name__ == 'FakeOverlay' and obj.__module__ == module.__name__:
-                    overlayClass = obj
-        if overlayClass is None:
-            del sys.modules[module.__name__]
-            raise LocalException("Unable to find Overlay class in module %s" % module.__name__)
-        logger.debug("Found Overlay class %s from module %s" % (overlayClass.__name__ , overlayClass.__module__ ))
-        # Now find the module to call
-        theClass = None
-        for name, obj in inspect.getmembers(module):
-            if inspect.isclass(obj):
-                if issubclass(obj, overlayClass) and obj != overlayClass:
-                    theClass = obj
-        if theClass is None:
-            del sys.modules[module.__name__]            
-            raise LocalException("Unable to find a subclassed Overlay in module %s" % module.__name__)
-        captureFn = getattr(theClass, "internal_capture", None)
-        if not callable(captureFn):
-            del sys.modules[module.__name__]
-            raise LocalException("The Overlay %s in module %s has no callable internal_capture method" % (theClass.__name__ , module.__name__ ))
-        logger.debug("Found RFSoC overlay %s" % theClass.__name__)
-        theDaq.dev = theClass()
-        logger.debug("Created RFSoC device")
-    except LocalException as e:
-        logger.error(str(e))
-    except Exception as e:
-        logger.error("Unable to load module %s" % base)
-        logger.error(str(e))
-        
-    logger.debug("Restoring original module search path")
-    sys.path = curpath
-    logger.debug("Going back to original directory %s" % curdir)
-    os.chdir(curdir)
-    return
+    if not file_path:
+        return
+    theDaq.load(file_path)
+    buttons['Run'].configure(text = "Run")
+
+def rfsocLoadRecent(file_path):
+    """Load a recent overlay, no dialog."""
+    theDaq.load(file_path)
+    buttons['Run'].configure(text = "Run")
+
+def rfsocReload():
+    """Reload the current overlay's Python (see daqcore.DaqCore.reload)."""
+    theDaq.reload()
+    buttons['Run'].configure(text = "Run")
+
+def rfsocRecentMenu():
+    """Fill in the Recent menu (done every time it's opened)."""
+    menu = buttons['Recent']['menu']
+    menu.delete(0, tk.END)
+    for file_path in theDaq.overlays.recent:
+        menu.add_command(label = file_path,
+                         command = lambda file_path=file_path: rfsocLoadRecent(file_path))
+    if theDaq.overlays.recent:
+        menu.add_separator()
+    menu.add_command(label = "Reload Python",
+                     command = rfsocReload,
+                     state = tk.NORMAL if theDaq.overlays.current else tk.DISABLED)
 
 def rfsocAcquire():
-    if theDaq.dev is None:
-        logger.error("No RFSoC device is loaded!")
-    theDaq.dev.internal_capture(theDaq.adcBuffer,
-                                theDaq.numChannels)
-    for i in range(theDaq.numChannels):
-        theDaq.wf[i].plot(theDaq.adcBuffer[i])
+    theDaq.acquire()
+
+def rfsocRecord():
+    """Toggle recording captures to disk."""
+    if theDaq.recorder is not None:
+        theDaq.stop_recording()
+    else:
+        file_path = filedialog.asksaveasfilename(title="Record captures to",
+                                                 defaultextension=".daq",
+                                                 filetypes=[("Capture files","*.daq *.daqz"),
+                                                            ("All files", "*.*")])
+        if file_path:
+            theDaq.record(file_path)
+    if theDaq.recorder is not None:
+        buttons['Record'].configure(text = "Stop Recording")
+    else:
+        buttons['Record'].configure(text = "Record")
+
+def rfsocRun():
+    """Toggle continuous acquisition."""
+    if theDaq.running:
+        theDaq.stop()
+    else:
+        theDaq.start()
+    if theDaq.running:
+        buttons['Run'].configure(text = "Stop")
+    else:
+        buttons['Run'].configure(text = "Run")
 
 if __name__ == '__main__':
-    config = configparser.ConfigParser()
-    config.read("rfsoc-pydaq.ini")
-    # just create a blank guy, fallbacks handle it
-    if 'rfsoc_pydaq' not in config:
-        config['rfsoc_pydaq'] = {}
-
-    pydaq_cfg = config['rfsoc_pydaq']
-        
+    pydaq_ini = "rfsoc-pydaq.ini"
+    pydaq_cfg = read_config(pydaq_ini)
+    startup.mark('config')
+
     root = tk.Tk()
+    startup.mark('Tk')
     logging.basicConfig(level=logging.DEBUG)
+    # matplotlib and PIL are chatty at DEBUG
+    logging.getLogger('matplotlib').setLevel(logging.INFO)
+    logging.getLogger('PIL').setLevel(logging.INFO)
     # We have 4 overall frames, just arranged
     # in a single column, so we can just use
     # the straight pack geometry manager.
@@ -175,28 +289,83 @@ if __name__ == '__main__':
                      pydaq_cfg.getint('numSamples',
                                       fallback=default_numSamples),
                      pydaq_cfg.getfloat('sampleRate',
-                                        fallback=default_sampleRate))
+                                        fallback=default_sampleRate),
+                     pydaq_cfg.getint('refreshInterval',
+                                      fallback=default_refreshInterval),
+                     pydaq_cfg.getint('ringDepth',
+                                      fallback=default_ringDepth),
+                     pydaq_cfg.getint('userThreads',
+                                      fallback=default_userThreads),
+                     pydaq_cfg.getint('userProcesses',
+                                      fallback=default_userProcesses) or None,
+                     pydaq_cfg.get('displayLayout',
+                                   fallback=default_displayLayout),
+                     pydaq_cfg.getint('displayColumns',
+                                      fallback=default_displayColumns),
+                     pydaq_cfg.getint('displayRows',
+                                      fallback=default_displayRows))
+    startup.mark('DAQ and displays')
     theDaq = daq
+    daq.configure(pydaq_cfg)
+    daq.overlays.read(pydaq_ini)
+    if daq.streamPort:
+        daq.serve()
+    if daq.busName:
+        daq.publish()
+    startup.mark('settings')
     displayFrame.pack( side = tk.TOP )
 
     buttons = {}
     buttons['Load'] = tk.Button(buttonFrame,
                                 text = "Load",
                                 command = rfsocLoad)
+    buttons['Recent'] = tk.Menubutton(buttonFrame,
+                                      text = "Recent",
+                                      relief = tk.RAISED)
+    buttons['Recent']['menu'] = tk.Menu(buttons['Recent'],
+                                        tearoff = 0,
+                                        postcommand = rfsocRecentMenu)
     buttons['Acquire'] = tk.Button(buttonFrame,
                                    text = "Acquire",
                                    command = rfsocAcquire)
+    buttons['Run'] = tk.Button(buttonFrame,
+                               text = "Run",
+                               command = rfsocRun)
+    buttons['Record'] = tk.Button(buttonFrame,
+                                  text = "Record",
+                                  command = rfsocRecord)
     buttons['User'] = tk.Button(buttonFrame,
                                 text = "User",
                                 command = defaultUserCommand)
     buttons['Load'].pack( side = tk.LEFT )
+    buttons['Recent'].pack( side = tk.LEFT )
     buttons['Acquire'].pack( side = tk.LEFT )
+    buttons['Run'].pack( side = tk.LEFT )
+    buttons['Record'].pack( side = tk.LEFT )
     buttons['User'].pack( side = tk.LEFT )
 
+    status = tk.Label(buttonFrame, anchor = tk.W, font = 'TkFixedFont')
+    status.pack( side = tk.LEFT, padx = 10 )
+    statusInterval = pydaq_cfg.getint('statusInterval',
+                                      fallback=default_statusInterval)
+    def updateStatus():
+        status.configure(text = daq.status())
+        root.after(statusInterval, updateStatus)
+    root.after(statusInterval, updateStatus)
+
     buttonFrame.pack( side = tk.TOP )
 
+    # root logger, so the log shows daqcore, recorder etc. as well
+    log = ScrolledLog( logFrame, logging.getLogger(),
+                       maxLines = pydaq_cfg.getint('logLines',
+                                                   fallback=default_logLines),
+                       level = pydaq_cfg.get('logLevel',
+                                             fallback=default_logLevel).upper() )
+    log.pack(fill='x', expand=True)
+
     locals = { 'daq' : daq,
-               'buttons' : buttons }
+               'buttons' : buttons,
+               'log' : log }
     banner =  "rfsoc-pydaq Python %s\n" % sys.version
     banner += "Locals:"
     for local in locals:
@@ -205,13 +374,32 @@ if __name__ == '__main__':
 
     console = TextConsole( consoleFrame,
                            banner=banner,
-                           locals=locals )
+                           locals=locals,
+                           threaded=pydaq_cfg.getboolean('consoleThreaded',
+                                                         fallback=default_consoleThreaded) )
+    # so commands can use console.tk_call (and set console.threaded)
+    locals['console'] = console
     console.pack(fill='both', expand=True)
     consoleFrame.pack( fill='both', expand=True, side = tk.TOP )
 
-
-    log = ScrolledLog( logFrame, logger )
-    log.pack(fill='x', expand=True)
     logFrame.pack( fill='x', side = tk.TOP )
+    startup.mark('widgets')
+
+    # Put the window up before there's a single figure in it:
+    # importing matplotlib and building and drawing the figures
+    # on screen is most of the startup. Tabs and pages that
+    # aren't showing get their figures when they're first shown.
+    root.update()
+    startup.mark('window shown')
+    import_matplotlib()
+    startup.mark('matplotlib import')
+    daq.wf.build()
+    startup.mark('figures')
+    logger.info(startup.report())
 
     root.mainloop()
+    daq.stop()
+    daq.stop_recording()
+    daq.stop_serving()
+    daq.stop_publishing()
+    daq.userPool.shutdown()
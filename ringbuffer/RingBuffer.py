@@ -0,0 +1,124 @@
+import numpy as np
+import threading
+import time
+
+# Ring of preallocated capture frames.
+#
+# There's one writer (the acquisition thread) and any number of readers
+# (the display, the console, recorders...). Nobody ever waits on anybody:
+# the writer just keeps going around the ring, and a reader who holds onto
+# a frame for too long finds out by checking its sequence number, seqlock
+# style. Before the writer touches a slot it marks it invalid (seq -1),
+# and it only puts the new sequence number in once the frame's done.
+class RingBuffer:
+    """ Preallocated ring of capture frames.
+
+    Attributes
+    ----------
+
+    depth : int
+       Number of frames in the ring.
+    frames : numpy.ndarray
+       (depth, numChannels, numSamples) storage for the frames.
+    seqs : numpy.ndarray
+       Sequence number of the frame in each slot (-1 if invalid).
+    timestamps : numpy.ndarray
+       time.time() at which each slot's frame was committed.
+    seq : int
+       Sequence number of the newest committed frame (-1 if none).
+
+    """
+    def __init__(self,
+                 depth,
+                 numChannels,
+                 numSamples,
+                 dtype = np.int16):
+        self.depth = depth
+        self.numChannels = numChannels
+        self.numSamples = numSamples
+        self.frames = np.zeros( (depth, numChannels, numSamples), dtype )
+        self.seqs = np.full( depth, -1, np.int64 )
+        self.timestamps = np.zeros( depth, np.float64 )
+        self.seq = -1
+        self._cond = threading.Condition()
+
+    def slot(self, seq):
+        """Index of the slot that holds (or will hold) seq."""
+        return seq % self.depth
+
+    def begin_write(self):
+        """Invalidate the next slot and return it to be captured into."""
+        slot = self.slot(self.seq + 1)
+        self.seqs[slot] = -1
+        return self.frames[slot]
+
+    def commit(self, timestamp = None):
+        """Mark the frame from begin_write() as done, returning its seq."""
+        seq = self.seq + 1
+        slot = self.slot(seq)
+        self.timestamps[slot] = time.time() if timestamp is None else timestamp
+        self.seqs[slot] = seq
+        with self._cond:
+            self.seq = seq
+            self._cond.notify_all()
+        return seq
+
+    def valid(self, seq):
+        """True if seq is still sitting in the ring, un-overwritten."""
+        return seq >= 0 and self.seqs[self.slot(seq)] == seq
+
+    def get(self, seq):
+        """View of frame seq, or None if it's not (or no longer) there."""
+        if not self.valid(seq):
+            return None
+        return self.frames[self.slot(seq)]
+
+    def timestamp(self, seq):
+        """Timestamp of frame seq, or None if it's not there."""
+        if not self.valid(seq):
+            return None
+        return self.timestamps[self.slot(seq)]
+
+    def latest(self):
+        """Returns (frame, seq, timestamp) for the newest frame.
+
+        frame is a view into the ring (None if nothing's been captured).
+        """
+        seq = self.seq
+        if seq < 0:
+            return (None, -1, 0.)
+        slot = self.slot(seq)
+        return (self.frames[slot], seq, self.timestamps[slot])
+
+    def last(self, k):
+        """Views of the last k frames, oldest first.
+
+        Returns (segments, seqs). Since the ring wraps, the frames come back
+        as a tuple of one or two (n, numChannels, numSamples) views whose
+        lengths add up to k: nothing's copied. seqs is the matching
+        sequence numbers, to check with valid() once you're done.
+        """
+        seq = self.seq
+        k = min(k, self.depth, seq + 1)
+        if k <= 0:
+            return ((), np.zeros(0, np.int64))
+        first = seq - k + 1
+        start = self.slot(first)
+        end = self.slot(seq) + 1
+        if start < end:
+            segments = (self.frames[start:end],)
+        else:
+            segments = (self.frames[start:], self.frames[:end])
+        return (segments, np.arange(first, seq + 1, dtype=np.int64))
+
+    def wait(self, seq, timeout = None):
+        """Wait for a frame newer than seq. Returns the newest seq."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.seq > seq, timeout)
+            return self.seq
+
+    def reset(self):
+        """Forget every frame (only when nobody's writing)."""
+        with self._cond:
+            self.seqs[:] = -1
+            self.seq = -1
@@ -0,0 +1,8 @@
+#!/bin/bash
+
+# same deal as run-rfsoc-pydaq.sh (Pynq needs root and a login
+# shell) but no X, and we go back to the current directory so
+# the overlay/output paths on the command line still work.
+
+CURDIR=`pwd`
+sudo -i bash -c "cd $CURDIR && python3 $CURDIR/rfsoc-pydaq-headless.py $*"
@@ -8,6 +8,14 @@ from tkinter import ttk, VERTICAL, HORIZONTAL, N, S, E, W, END
 # See https://stackoverflow.com/questions/43909849/tkinter-python-crashes-on-new-thread-trying-to-log-on-main-thread
 
 # This was reorganized to make it a widget.
+#
+# Records are only queued when they're logged: every poll
+# formats everything that came in since the last one and puts
+# it in the widget with one insert and one scroll, so a burst of
+# DEBUG messages costs one update instead of one per message.
+# If more than maxBatch came in, only the newest are shown.
+# Repeats of the same message are collapsed into a "repeated N
+# times" line, and only the last maxLines lines are kept.
 class ScrolledLog(ScrolledText):
     
     class QueueHandler(logging.Handler):
@@ -18,9 +26,15 @@ class ScrolledLog(ScrolledText):
         def emit(self, record):
             self.log_queue.put(record)
 
-    def __init__(self, frame, logger, height=5):
+    def __init__(self, frame, logger, height=5,
+                 maxLines=1000, maxBatch=200, level=logging.NOTSET,
+                 coalesce=True, interval=100):
         self.frame = frame
         self.logger = logger
+        self.maxLines = maxLines
+        self.maxBatch = maxBatch
+        self.coalesce = coalesce
+        self.interval = interval
         super().__init__(frame, state='disabled', height=height)        
         self.grid(row=0, column=0, sticky=(N, S, W, E))
         self.configure(font='TkFixedFont')
@@ -30,26 +44,90 @@ class ScrolledLog(ScrolledText):
         self.tag_config('ERROR', foreground='red')
         self.tag_config('CRITICAL', foreground='red', underline=1)
 
-        self.log_queue = queue.Queue()
+        self.log_queue = queue.SimpleQueue()
         self.queue_handler = self.QueueHandler(self.log_queue)
+        self.queue_handler.setLevel(level)
         formatter = logging.Formatter('%(asctime)s: %(message)s')
         self.queue_handler.setFormatter(formatter)
         self.logger.addHandler(self.queue_handler)
-        self.frame.after(100, self.poll_log_queue)
+        # repeat coalescing
+        self._lastKey = None
+        self._lastLevel = 'INFO'
+        self._repeats = 0
+        self._noteShown = False
+        self.frame.after(self.interval, self.poll_log_queue)
+
+    def setLevel(self, level):
+        """Only show messages at level (e.g. logging.INFO) or above."""
+        self.queue_handler.setLevel(level)
+
+    def clear(self):
+        self.configure(state='normal')
+        self.delete('1.0', END)
+        self.configure(state='disabled')
+        self._lastKey = None
+        self._repeats = 0
+        self._noteShown = False
 
     def display(self, record):
-        msg = self.queue_handler.format(record)
+        self.display_batch([record])
+
+    def _repeat_note(self):
+        return ("    (last message repeated %d more time%s)\n" %
+                (self._repeats, '' if self._repeats == 1 else 's'))
+
+    def display_batch(self, records, skipped=0):
+        """Put a list of records in the widget in one go."""
+        chunks = []
+        if skipped:
+            if self._repeats:
+                chunks += [ self._repeat_note(), self._lastLevel ]
+                self._repeats = 0
+            chunks += [ "    (%d messages not shown)\n" % skipped, 'WARNING' ]
+            self._lastKey = None
+        for record in records:
+            if self.coalesce:
+                key = (record.levelno, record.name, record.getMessage())
+                if key == self._lastKey:
+                    self._repeats += 1
+                    continue
+                if self._repeats:
+                    chunks += [ self._repeat_note(), self._lastLevel ]
+                    self._repeats = 0
+                self._lastKey = key
+                self._lastLevel = record.levelname
+            chunks += [ self.queue_handler.format(record)+'\n', record.levelname ]
+        if not chunks and not self._repeats:
+            return
+        # only follow the end if we were already there
+        follow = self.yview()[1] >= 1.
         self.configure(state='normal')
-        self.insert(END, msg+'\n', record.levelname)
+        if self._noteShown:
+            # the note for a message that's still repeating gets rewritten
+            self.delete('repeat', 'end-1c')
+            self._noteShown = False
+        if chunks:
+            self.insert(END, *chunks)
+        if self._repeats:
+            self.mark_set('repeat', 'end-1c')
+            self.mark_gravity('repeat', 'left')
+            self.insert(END, self._repeat_note(), self._lastLevel)
+            self._noteShown = True
+        lines = int(self.index('end-1c').split('.')[0]) - 1
+        if lines > self.maxLines:
+            self.delete('1.0', '%d.0' % (lines - self.maxLines + 1))
         self.configure(state='disabled')
-        self.yview(END)
+        if follow:
+            self.yview(END)
 
     def poll_log_queue(self):
+        records = []
         while True:
             try:
-                record = self.log_queue.get(block=False)
+                records.append(self.log_queue.get(block=False))
             except queue.Empty:
                 break
-            else:
-                self.display(record)
-        self.frame.after(100, self.poll_log_queue)
+        skipped = max(0, len(records) - self.maxBatch)
+        if records:
+            self.display_batch(records[skipped:], skipped)
+        self.frame.after(self.interval, self.poll_log_queue)
@@ -0,0 +1,254 @@
+import numpy as np
+import threading
+
+from spectrum.Spectrum import Spectrum, cosine_window
+
+# Cross-correlation/time delay engine.
+#
+# Every pair of channels is correlated at once in the frequency
+# domain: one rfft of the whole (numChannels, numSamples) frame,
+# zero padded to twice the length so the correlation doesn't wrap
+# around, then X_i * conj(X_j) for every pair i < j. That's all
+# that happens per capture (add(), on the acquisition thread):
+# the cross spectra are averaged across captures, and only when
+# somebody asks for the delays (compute()) do they get turned back
+# into correlations, with one batched irfft, and the peaks found.
+# Peaks are interpolated to a fraction of a sample by fitting a
+# parabola through the peak and its neighbours.
+#
+# The window and the work buffers are built once per numSamples
+# and kept (numpy's FFT caches its own plans).
+class Correlator:
+    """ Multi-channel cross-correlation and delay engine.
+
+    Attributes
+    ----------
+
+    sampleRate : float
+       Sample rate in Hz.
+    window : str
+       Name of the window (one of spectrum.Spectrum.windows).
+    average : str or None
+       None to use just the newest capture, 'exp' for exponential
+       averaging, 'mean' for the mean of every capture since the
+       last reset().
+    alpha : float
+       Weight of a new capture in exponential averaging.
+    weighting : str or None
+       None for plain cross-correlation, 'phat' for GCC-PHAT (only
+       the phase of the cross spectrum: sharper peaks, less
+       sensitive to the signal's spectrum).
+    maxLag : int
+       Only look for peaks within this many samples (None = all).
+    enabled : bool
+       Whether the DAQ feeds every capture to it.
+    count : int
+       Number of captures in the average.
+    pairs : list
+       (i, j) channel pairs, in the order of the correlations.
+    result : tuple
+       (seq, delays, coefficients) from the last compute():
+       delays[i, j] is how much later (s) channel i sees the signal
+       than channel j, coefficients[i, j] the normalized height of
+       the correlation peak.
+
+    """
+    averages = ( None, 'exp', 'mean' )
+    weightings = ( None, 'phat' )
+
+    def __init__(self,
+                 sampleRate = 3.E9,
+                 window = 'rect',
+                 average = 'mean',
+                 alpha = 0.1,
+                 weighting = None,
+                 maxLag = None):
+        if window not in Spectrum.windows:
+            raise ValueError("unknown window %s" % window)
+        if average not in self.averages:
+            raise ValueError("unknown average %s" % average)
+        if weighting not in self.weightings:
+            raise ValueError("unknown weighting %s" % weighting)
+        self.sampleRate = sampleRate
+        self.window = window
+        self.average = average
+        self.alpha = alpha
+        self.weighting = weighting
+        self.maxLag = maxLag
+        self.enabled = False
+        self.count = 0
+        self.pairs = []
+        self.result = (-1, None, None)
+        # lags (samples) and correlations (pairs, lags) from the last compute()
+        self.lags = None
+        self.correlation = None
+        self._windows = {}
+        self._work = None
+        self._seq = -1
+        self._stale = False
+        self._lock = threading.Lock()
+
+    def get_window(self, numSamples):
+        """The window for numSamples, cached."""
+        key = (self.window, numSamples)
+        if key not in self._windows:
+            w = cosine_window(Spectrum.windows[self.window], numSamples)
+            self._windows[key] = w.astype(np.float32)
+        return self._windows[key]
+
+    def reset(self):
+        """Restart averaging."""
+        with self._lock:
+            self.count = 0
+
+    def pair(self, i, j):
+        """Index of channel pair (i, j) in the correlations (i < j)."""
+        return self.pairs.index((i, j))
+
+    def _allocate(self, numChannels, numSamples):
+        nbins = numSamples + 1
+        self.pairs = [ (i, j) for i in range(numChannels)
+                       for j in range(i+1, numChannels) ]
+        # Single precision: half the memory traffic of doubles, which
+        # is most of the cost of add(), and plenty for ADC samples.
+        # Zero padded: the second half of each row stays zero.
+        self._work = np.zeros((numChannels, 2*numSamples), np.float32)
+        self._conj = np.empty((numChannels, nbins), np.complex64)
+        self._cross = np.empty((max(numChannels-1, 1), nbins), np.complex64)
+        self._avg = np.empty((len(self.pairs), nbins), np.complex64)
+        self._avgPower = np.empty((numChannels, nbins), np.float32)
+        self.count = 0
+
+    def add(self, data, seq = -1):
+        """Add a (numChannels, numSamples) frame's cross spectra to the average."""
+        with self._lock:
+            numChannels, numSamples = data.shape
+            if self._work is None or self._work.shape != (numChannels, 2*numSamples):
+                self._allocate(numChannels, numSamples)
+            # every kind of average is avg = (1-w)*avg + w*new
+            if self.average is None or self.count == 0:
+                w = 1.
+            elif self.average == 'exp':
+                w = self.alpha
+            else:
+                w = 1./(self.count + 1)
+            np.multiply(data, self.get_window(numSamples), out=self._work[:, :numSamples])
+            spec = np.fft.rfft(self._work, axis=-1)
+            # scaling the spectra by sqrt(w) puts w in every product for free
+            if w != 1.:
+                spec *= np.float32(np.sqrt(w))
+            np.conjugate(spec, out=self._conj)
+            # One channel's pairs at a time, so the new cross spectra
+            # are still in cache when they're added to the average.
+            k = 0
+            for i in range(numChannels-1):
+                m = numChannels-1-i
+                avg = self._avg[k:k+m]
+                if w == 1.:
+                    np.multiply(spec[i], self._conj[i+1:], out=avg)
+                else:
+                    new = self._cross[:m]
+                    np.multiply(spec[i], self._conj[i+1:], out=new)
+                    avg *= np.float32(1. - w)
+                    avg += new
+                k += m
+            # power spectra too, for normalizing the peaks
+            power = (spec*self._conj).real
+            if w == 1.:
+                self._avgPower[...] = power
+            else:
+                self._avgPower *= np.float32(1. - w)
+                self._avgPower += power
+            self.count += 1
+            self._seq = seq
+            self._stale = True
+
+    def compute(self):
+        """Find the delays from the averaged cross spectra.
+
+        Returns (and puts in result) (seq, delays, coefficients). Only
+        redone if there's been a capture since the last time.
+        """
+        with self._lock:
+            if not self._stale:
+                return self.result
+            cross = self._avg.astype(np.complex128)
+            power = self._avgPower.astype(np.float64)
+            seq = self._seq
+            self._stale = False
+        numChannels, nbins = power.shape
+        n = 2*(nbins - 1)
+        if self.weighting == 'phat':
+            cross /= np.maximum(np.abs(cross), 1.E-30)
+        c = np.fft.irfft(cross, n, axis=-1)
+        # lags -L..L: negative lags are at the end
+        L = nbins - 2 if self.maxLag is None else min(self.maxLag, nbins - 2)
+        c = np.concatenate((c[:, n-L:], c[:, :L+1]), axis=1)
+        rows = np.arange(len(c))
+        p = np.argmax(c, axis=1)
+        peak = c[rows, p]
+        lag = (p - L).astype(np.float64)
+        if L > 0:
+            # a peak at +-L has no neighbour on one side: no interpolation
+            q = np.clip(p, 1, 2*L - 1)
+            y0 = c[rows, q-1]
+            y2 = c[rows, q+1]
+            denom = y0 - 2.*peak + y2
+            ok = (denom < 0) & (p == q)
+            frac = np.zeros(len(c))
+            frac[ok] = 0.5*(y0[ok] - y2[ok])/denom[ok]
+            peak = peak - 0.25*(y0 - y2)*frac
+            lag += frac
+        if self.weighting == 'phat':
+            coefficient = peak
+        else:
+            # zero lag of each channel's autocorrelation is its energy
+            energy = np.fft.irfft(power, n, axis=-1)[:, 0]
+            i = np.array([ pair[0] for pair in self.pairs ], int)
+            j = np.array([ pair[1] for pair in self.pairs ], int)
+            coefficient = peak/np.sqrt(np.maximum(energy[i]*energy[j], 1.E-30))
+        delays = np.zeros((numChannels, numChannels))
+        coefficients = np.eye(numChannels)
+        for k, (i, j) in enumerate(self.pairs):
+            delays[i, j] = lag[k]/self.sampleRate
+            delays[j, i] = -lag[k]/self.sampleRate
+            coefficients[i, j] = coefficients[j, i] = coefficient[k]
+        self.lags = np.arange(-L, L+1)
+        self.correlation = c
+        self.result = (seq, delays, coefficients)
+        return self.result
+
+    @property
+    def delays(self):
+        """(numChannels, numChannels) delay matrix (s), see result."""
+        return self.compute()[1]
+
+    def render(self, fig, channel = None):
+        """Plot the correlations (of the pairs with channel in them) on a figure.
+
+        Works as the body of a Waveframe user callback:
+        wf.set_user_callback(lambda data, fig, canvas: daq.correlator.render(fig, 0))
+        """
+        seq, delays, coefficients = self.compute()
+        fig.clear()
+        if delays is None:
+            return
+        ax = fig.add_subplot(111)
+        t = self.lags*1.E9/self.sampleRate
+        for k, (i, j) in enumerate(self.pairs):
+            if channel is None or channel in (i, j):
+                ax.plot(t, self.correlation[k],
+                        label="%d-%d %.3f ns" % (i, j, delays[i, j]*1.E9))
+        ax.set_xlabel('ns')
+        ax.legend(fontsize='x-small')
+
+    def __repr__(self):
+        seq, delays, coefficients = self.compute()
+        if delays is None:
+            return "Correlator(%s, no captures)" % ("enabled" if self.enabled else "disabled")
+        lines = [ "Correlator(%s, %d captures): delay i-j (ns), coefficient" %
+                  ("enabled" if self.enabled else "disabled", self.count) ]
+        for i, j in self.pairs:
+            lines.append("  %2d-%-2d %12.4f %8.3f" % (i, j, delays[i, j]*1.E9,
+                                                      coefficients[i, j]))
+        return "\n".join(lines)
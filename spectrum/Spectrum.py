@@ -0,0 +1,147 @@
+import numpy as np
+import threading
+
+def cosine_window(coefficients, numSamples):
+    """Cosine-sum window of numSamples (see Spectrum.windows)."""
+    n = np.arange(numSamples)*2*np.pi/numSamples
+    w = np.zeros(numSamples)
+    for k, a in enumerate(coefficients):
+        w += ((-1)**k)*a*np.cos(k*n)
+    return w
+
+# Batched spectrum engine.
+#
+# One rfft over the whole (numChannels, numSamples) frame instead
+# of one per channel. The window, its normalization and the
+# frequency axis are built once per numSamples/sampleRate and
+# cached. compute() doesn't touch any Tk/matplotlib stuff, so it
+# can run on the acquisition thread: the display just picks up
+# the newest result.
+class Spectrum:
+    """ Multi-channel spectrum engine.
+
+    Attributes
+    ----------
+
+    sampleRate : float
+       Sample rate in Hz.
+    window : str
+       Name of the window (one of Spectrum.windows).
+    fullScale : float
+       ADC code corresponding to full scale (0 dBFS).
+    average : str or None
+       None for no averaging, 'exp' for exponential averaging,
+       'peak' for peak hold, 'mean' for the plain mean of every
+       capture since the last reset().
+    alpha : float
+       Weight of a new capture in exponential averaging.
+    enabled : bool
+       Whether the DAQ computes the spectrum for each capture.
+    result : tuple
+       (seq, freqs, dBFS) for the newest computed spectrum. dBFS
+       is (numChannels, numSamples//2+1) and never modified after
+       it's published, so it's safe to grab from another thread.
+    count : int
+       Number of captures in the average.
+
+    """
+    # cosine-sum window coefficients
+    windows = { 'rect' : (1.,),
+                'hann' : (0.5, 0.5),
+                'hamming' : (0.54, 0.46),
+                'blackman' : (0.42, 0.5, 0.08),
+                'blackmanharris' : (0.35875, 0.48829, 0.14128, 0.01168),
+                'flattop' : (0.21557895, 0.41663158, 0.277263158,
+                             0.083578947, 0.006947368) }
+
+    averages = ( None, 'exp', 'peak', 'mean' )
+
+    def __init__(self,
+                 sampleRate = 3.E9,
+                 window = 'hann',
+                 fullScale = 2**15,
+                 average = None,
+                 alpha = 0.1):
+        if window not in self.windows:
+            raise ValueError("unknown window %s" % window)
+        if average not in self.averages:
+            raise ValueError("unknown average %s" % average)
+        self.sampleRate = sampleRate
+        self.window = window
+        self.fullScale = fullScale
+        self.average = average
+        self.alpha = alpha
+        self.enabled = True
+        self.result = (-1, None, None)
+        self.count = 0
+        self._windows = {}
+        self._freqs = {}
+        self._work = None
+        self._power = None
+        self._avg = None
+        self._lock = threading.Lock()
+
+    def get_window(self, numSamples):
+        """Returns (window, scale) for numSamples, cached.
+
+        scale makes a full-scale sine on a bin center come out as 1.
+        """
+        key = (self.window, numSamples, self.fullScale)
+        if key not in self._windows:
+            w = cosine_window(self.windows[self.window], numSamples)
+            scale = 2./(np.sum(w)*self.fullScale)
+            self._windows[key] = (w, scale)
+        return self._windows[key]
+
+    def frequencies(self, numSamples):
+        """Frequency axis (Hz) for numSamples, cached."""
+        key = (numSamples, self.sampleRate)
+        if key not in self._freqs:
+            self._freqs[key] = np.fft.rfftfreq(numSamples, 1./self.sampleRate)
+        return self._freqs[key]
+
+    def reset(self):
+        """Restart averaging."""
+        with self._lock:
+            self.count = 0
+
+    def compute(self, data, seq = -1):
+        """Compute (and publish) the spectrum of a (numChannels, numSamples) frame.
+
+        Returns the dBFS array, which is also put in result.
+        """
+        with self._lock:
+            shape = data.shape
+            w, scale = self.get_window(shape[-1])
+            nbins = shape[-1]//2 + 1
+            if self._work is None or self._work.shape != shape:
+                self._work = np.empty(shape, np.float64)
+                self._power = np.empty(shape[:-1] + (nbins,), np.float64)
+                self._avg = np.empty_like(self._power)
+                self.count = 0
+            np.multiply(data, w, out=self._work)
+            spec = np.fft.rfft(self._work, axis=-1)
+            # power, normalized to full scale
+            np.abs(spec, out=self._power)
+            self._power *= scale
+            np.square(self._power, out=self._power)
+            if self.average is None or self.count == 0:
+                self._avg[...] = self._power
+            elif self.average == 'exp':
+                self._avg *= (1. - self.alpha)
+                self._power *= self.alpha
+                self._avg += self._power
+            elif self.average == 'mean':
+                # running mean: avg += (power - avg)/n
+                self._power -= self._avg
+                self._power /= self.count + 1
+                self._avg += self._power
+            else:
+                np.maximum(self._avg, self._power, out=self._avg)
+            self.count += 1
+            # new array for every result, since the display might still be using the last one
+            db = np.maximum(self._avg, 1.E-20)
+            np.log10(db, out=db)
+            db *= 10.
+            self.result = (seq, self.frequencies(shape[-1]), db)
+            return db
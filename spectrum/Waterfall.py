@@ -0,0 +1,119 @@
+import numpy as np
+import math
+import threading
+
+# Rolling history of spectra, for a waterfall display.
+#
+# The history is kept twice, one copy after the other, in a
+# (numChannels, 2*depth, bins) array: each new row goes in at
+# pos and pos+depth, so rows pos+1 .. pos+depth are always the
+# last depth spectra, oldest first, as one contiguous view. The
+# display can hand that straight to imshow without rolling or
+# copying anything. Spectra are cut down to about bins columns
+# by taking the max of each group of neighbouring frequency bins,
+# so narrow lines don't disappear.
+class Waterfall:
+    """ Rolling buffer of recent spectra.
+
+    Attributes
+    ----------
+
+    depth : int
+       Number of spectra kept.
+    bins : int
+       Most frequency columns to keep (neighbouring bins are
+       max'd together to get down to this).
+    every : int
+       Only keep every Nth spectrum.
+    enabled : bool
+       Whether the DAQ adds each spectrum.
+    binning : int
+       Frequency bins per column.
+    count : int
+       Number of spectra added since the last reset().
+    floor : float
+       Value (dBFS) of rows nothing's been added to yet.
+
+    """
+    def __init__(self, depth = 256, bins = 512, every = 1, floor = -160.):
+        self.depth = depth
+        self.bins = bins
+        self.every = every
+        self.floor = floor
+        self.enabled = True
+        self.binning = 1
+        self.count = 0
+        self.pos = 0
+        self._n = 0
+        self._shape = None
+        self._buf = None
+        self._lock = threading.Lock()
+
+    def _prepare(self, shape):
+        numChannels, nfreq = shape
+        self.binning = max(1, int(math.ceil(nfreq/self.bins)))
+        ncols = int(math.ceil(nfreq/self.binning))
+        self._buf = np.full( (numChannels, 2*self.depth, ncols), self.floor, np.float32 )
+        # spectrum padded out to a whole number of columns
+        self._padded = np.full( (numChannels, ncols*self.binning), self.floor, np.float32 )
+        self._row = np.zeros( (numChannels, ncols), np.float32 )
+        self._shape = shape
+        self.pos = 0
+        self.count = 0
+
+    def configure(self, depth = None, bins = None, every = None):
+        """Change the depth/binning/decimation (starts over)."""
+        with self._lock:
+            if depth is not None:
+                self.depth = depth
+            if bins is not None:
+                self.bins = bins
+            if every is not None:
+                self.every = every
+            # reallocate now, so the buffer always matches depth
+            if self._shape is not None:
+                self._prepare(self._shape)
+
+    def reset(self):
+        with self._lock:
+            if self._shape is not None:
+                self._prepare(self._shape)
+
+    def add(self, spectrum):
+        """Add a (numChannels, nfreq) spectrum (dBFS) as the newest row."""
+        self._n += 1
+        if self._n % self.every:
+            return
+        with self._lock:
+            if self._shape != spectrum.shape:
+                self._prepare(spectrum.shape)
+            nfreq = spectrum.shape[-1]
+            if self.binning == 1:
+                row = spectrum
+            else:
+                self._padded[:, :nfreq] = spectrum
+                # max over each group, a strided slice at a time
+                row = self._row
+                row[...] = self._padded[:, 0::self.binning]
+                for b in range(1, self.binning):
+                    np.maximum(row, self._padded[:, b::self.binning], out=row)
+            self._buf[:, self.pos] = row
+            self._buf[:, self.pos + self.depth] = row
+            self.pos = (self.pos + 1) % self.depth
+            self.count += 1
+
+    def view(self, channel = None):
+        """(depth, columns) view of the history for channel, oldest first.
+
+        With no channel, it's (numChannels, depth, columns). None if
+        nothing's been added yet.
+        """
+        with self._lock:
+            buf, pos, count = self._buf, self.pos, self.count
+        if buf is None or count == 0:
+            return None
+        # the buffer's own depth, whatever depth's been changed to since
+        depth = buf.shape[1]//2
+        if channel is None:
+            return buf[:, pos:pos + depth]
+        return buf[channel, pos:pos + depth]
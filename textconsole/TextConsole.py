@@ -1,9 +1,10 @@
 import tkinter as tk
 import sys
 import re
+import ctypes
+import queue
+import threading
 from code import InteractiveConsole
-from io import StringIO
-from contextlib import redirect_stderr, redirect_stdout
 
 # this is ripped from a stackexchange discussion
 # on creating an IDLE-like shell. It's not
@@ -11,9 +12,42 @@ from contextlib import redirect_stderr, redirect_stdout
 # Minor changes on my part, like embedding the history
 # class and fixing a history typo as well as
 # accepting locals for the console.
+#
+# Each command runs on a worker thread (unless threaded=False), so
+# a long one doesn't freeze everything else: its output is streamed
+# into the widget as it comes out, Ctrl-C (with nothing selected)
+# raises KeyboardInterrupt in it, and the prompt comes back when
+# it's done. Neither Tk nor matplotlib is safe to use from that
+# thread, though, so a command that plots or touches a widget has
+# to go through tk_call(), e.g. console.tk_call(daq.plot).
 
 
 class TextConsole(tk.Text):    
+    # sys.stdout/sys.stderr stand-in: writes from the command
+    # thread go to the console, anybody else's go where they
+    # always did.
+    class Output:
+        def __init__(self, console, stream, tag):
+            self.console = console
+            self.stream = stream
+            self.tag = tag
+
+        def write(self, s):
+            if threading.get_ident() == self.console._ident:
+                self.console._output.put((self.tag, s))
+                return len(s)
+            return self.stream.write(s)
+
+        def flush(self):
+            if threading.get_ident() != self.console._ident:
+                self.stream.flush()
+
+        def isatty(self):
+            return False
+
+        def __getattr__(self, name):
+            return getattr(self.stream, name)
+
     # the history is just a list but we
     # don't want to die going backwards
     class History(list):
@@ -31,6 +65,7 @@ class TextConsole(tk.Text):
         kw.setdefault('wrap', 'word')
         kw.setdefault('prompt1', '>>> ')
         kw.setdefault('prompt2', '...')
+        threaded = kw.pop('threaded', True)
         banner = kw.pop('banner', 'Python %s\n' % sys.version)
         self._prompt1 = kw.pop('prompt1')
         self._prompt2 = kw.pop('prompt2')
@@ -40,6 +75,19 @@ class TextConsole(tk.Text):
         self._hist_item = 0
         self._hist_match = ''
 
+        # --- command execution
+        self.threaded = threaded
+        self.interval = 50
+        self._thread = None
+        self._ident = None
+        self._running = False
+        self._output = queue.SimpleQueue()
+        self._pending = None
+        self._errors = False
+        self._res = False
+        sys.stdout = self.Output(self, sys.stdout, 'output')
+        sys.stderr = self.Output(self, sys.stderr, 'error')
+
         # -- initialization
         self._console = InteractiveConsole(locals)
         self.insert('end', banner, 'banner')
@@ -59,11 +107,70 @@ class TextConsole(tk.Text):
         self.bind('<BackSpace>', self.on_backspace)
         self.bind('<Control-c>', self.on_ctrl_c)
         self.bind('<<Paste>>', self.on_paste)
+        # while a command's running, keys stop here (except Ctrl-C)
+        busy = 'TextConsoleBusy%d' % id(self)
+        self.bind_class(busy, '<KeyPress>', self.on_busy_key)
+        self.bind_class(busy, '<<Paste>>', self.on_busy_key)
+        self.bindtags((busy,) + self.bindtags())
+
+    @property
+    def running(self):
+        """True while a command is running."""
+        return self._running
+
+    def tk_call(self, fn, *args, **kwargs):
+        """Call fn on the Tk thread, wait for it and return what it returns.
+
+        For threaded commands that need Tk or matplotlib. On the Tk
+        thread itself it just calls fn.
+        """
+        if threading.get_ident() != self._ident or not self.threaded:
+            return fn(*args, **kwargs)
+        done = queue.SimpleQueue()
+        def call():
+            try:
+                done.put((True, fn(*args, **kwargs)))
+            except BaseException as e:
+                done.put((False, e))
+        self.after(0, call)
+        ok, res = done.get()
+        if not ok:
+            raise res
+        return res
+
+    def interrupt(self):
+        """Raise KeyboardInterrupt in the running command.
+
+        It only lands when the command gets back to running Python,
+        so something stuck inside a C call won't see it until that returns.
+        """
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(thread.ident),
+                                                   ctypes.py_object(KeyboardInterrupt))
+
+    def on_busy_key(self, event):
+        """Swallow input while a command is running"""
+        if not self._running:
+            return
+        if event.type == tk.EventType.KeyPress and event.state & 0x4 and event.keysym in ('c', 'C'):
+            return
+        return 'break'
 
     def on_ctrl_c(self, event):
-        """Copy selected code, removing prompts first"""
+        """Copy selected code, removing prompts first, or interrupt"""
         sel = self.tag_ranges('sel')
-        if sel:
+        if not sel:
+            if self._running:
+                self.interrupt()
+            else:
+                # throw away what's been typed, like a terminal
+                self.insert('end', '\nKeyboardInterrupt\n', 'error')
+                self._console.resetbuffer()
+                self.prompt()
+                self.see('end')
+        else:
             txt = self.get('sel.first', 'sel.last').splitlines()
             lines = []
             for i, line in enumerate(txt):
@@ -247,44 +354,84 @@ class TextConsole(tk.Text):
                     lines[i] = 'help(%s)' % l[:-1]
             cmds = '\n'.join(lines)
             self.insert('insert', '\n')
-            out = StringIO()  # command output
-            err = StringIO()  # command error traceback
-            with redirect_stderr(err):     # redirect error traceback to err
-                with redirect_stdout(out): # redirect command output
-                    # execute commands in interactive console
-                    res = self._console.push(cmds)
-                    # if res is True, this is a partial command, e.g. 'def test():' and we need to wait for the rest of the code
-            errors = err.getvalue()
-            if errors:  # there were errors during the execution
-                self.insert('end', errors)  # display the traceback
-                self.mark_set('input', 'end')
-                self.see('end')
-                self.prompt() # insert new prompt
+            self._pending = (lines, index, auto_indent)
+            self._errors = False
+            self._res = False
+            self._running = True
+            if self.threaded:
+                self._thread = threading.Thread(target=self._run,
+                                                args=(cmds,),
+                                                name="console",
+                                                daemon=True)
+                self._thread.start()
+                self.after(self.interval, self.poll_output)
             else:
-                output = out.getvalue()  # get output
-                if output:
-                    self.insert('end', output, 'output')
-                self.mark_set('input', 'end')
-                self.see('end')
-                if not res and self.compare('insert linestart', '>', 'insert'):
-                    self.insert('insert', '\n')
-                self.prompt(res)
-                if auto_indent and lines:
-                    # insert indentation similar to previous lines
-                    indent = re.search(r'^( )*', lines[-1]).group()
-                    line = lines[-1].strip()
-                    if line and line[-1] == ':':
-                        indent = indent + '    '
-                    self.insert('insert', indent)
-                self.see('end')
-                if res:
-                    self.mark_set('input', index)
-                    self._console.resetbuffer()  # clear buffer since the whole command will be retrieved from the text widget
-                elif lines:
-                    self.history.extend(lines)  # add commands to history
-                    self._hist_item = len(self.history)
-            out.close()
-            err.close()
+                self._run(cmds)
+                self.poll_output()
         else:
             self.insert('insert', '\n')
             self.prompt()
+
+    def _run(self, cmds):
+        """Execute commands, with output going to the console"""
+        self._ident = threading.get_ident()
+        try:
+            # if res is True, this is a partial command, e.g. 'def test():' and we need to wait for the rest of the code
+            self._res = self._console.push(cmds)
+        except KeyboardInterrupt:
+            # landed outside the command itself
+            self._console.resetbuffer()
+            self._output.put(('error', 'KeyboardInterrupt\n'))
+        finally:
+            self._ident = None
+
+    def write_output(self):
+        """Put whatever the command's written so far in the widget"""
+        chunks = []
+        while True:
+            try:
+                tag, s = self._output.get(block=False)
+            except queue.Empty:
+                break
+            if tag == 'error':
+                self._errors = True
+            chunks += [ s, tag ]
+        if chunks:
+            self.insert('end', *chunks)
+            self.see('end')
+
+    def poll_output(self):
+        """Stream output until the command's done, then prompt again"""
+        done = self._thread is None or not self._thread.is_alive()
+        self.write_output()
+        if not done:
+            self.after(self.interval, self.poll_output)
+            return
+        self._thread = None
+        self._running = False
+        lines, index, auto_indent = self._pending
+        res = self._res
+        if self._errors:  # there were errors during the execution
+            self.mark_set('input', 'end')
+            self.see('end')
+            self.prompt() # insert new prompt
+            return
+        self.mark_set('input', 'end')
+        self.see('end')
+        if not res and self.compare('insert linestart', '>', 'insert'):
+            self.insert('insert', '\n')
+        self.prompt(res)
+        if auto_indent and lines:
+            # insert indentation similar to previous lines
+            indent = re.search(r'^( )*', lines[-1]).group()
+            line = lines[-1].strip()
+            if line and line[-1] == ':':
+                indent = indent + '    '
+            self.insert('insert', indent)
+        self.see('end')
+        if res:
+            self.mark_set('input', index)
+            self._console.resetbuffer()  # clear buffer since the whole command will be retrieved from the text widget
+        elif lines:
+            self.history.extend(lines)  # add commands to history
+            self._hist_item = len(self.history)
@@ -0,0 +1,181 @@
+import numpy as np
+
+# Software trigger conditions.
+#
+# Each condition looks at a whole (numChannels, numSamples) frame
+# with array operations into scratch buffers (reallocated only
+# when numSamples changes): hits() marks every sample where it
+# fires, and fire() returns the first of them, or -1. preTrigger
+# samples at the start of the frame are never searched, so a
+# trigger always has at least that much of the waveform before it
+# in the frame.
+class Trigger:
+    """ Base trigger condition.
+
+    Attributes
+    ----------
+
+    preTrigger : int
+       Number of samples at the start of the frame that can't
+       trigger (i.e. guaranteed pre-trigger region).
+    position : int
+       Sample where the last evaluated frame fired, -1 if it didn't.
+
+    """
+    def __init__(self, preTrigger = 0):
+        self.preTrigger = preTrigger
+        self.position = -1
+        self._length = -1
+        self._hitLength = -1
+
+    def _scratch(self, n):
+        if n != self._length:
+            self._length = n
+            self._a = np.zeros(n, bool)
+            self._b = np.zeros(n, bool)
+        return (self._a, self._b)
+
+    def _hits(self, n):
+        # (numSamples,) output of hits()
+        if n != self._hitLength:
+            self._hitLength = n
+            self._hit = np.zeros(n, bool)
+        return self._hit
+
+    def hits(self, frame):
+        """(numSamples,) bool array, True at every sample the frame
+        triggers at. Subclasses do this. The array is reused by the
+        next call."""
+        raise NotImplementedError
+
+    def fire(self, frame):
+        """Sample index the frame triggers at, or -1."""
+        hit = self.hits(frame)
+        i = np.argmax(hit)
+        if not hit[i]:
+            return -1
+        return int(i)
+
+    def evaluate(self, frame):
+        """True if the frame triggers. The sample is in position."""
+        self.position = self.fire(frame)
+        return self.position >= 0
+
+    def __call__(self, frame):
+        return self.evaluate(frame)
+
+    def __repr__(self):
+        params = ", ".join("%s=%r" % (k, v) for k, v in vars(self).items()
+                           if not k.startswith('_') and k != 'position')
+        return "%s(%s)" % (type(self).__name__, params)
+
+
+class LevelTrigger(Trigger):
+    """ Fires when a channel crosses a level.
+
+    edge is 'rising', 'falling', 'either' or None: None fires on
+    any sample at or above the level (or below, if level is negative).
+    """
+    edges = ( 'rising', 'falling', 'either', None )
+
+    def __init__(self, channel, level, edge = 'rising', preTrigger = 0):
+        if edge not in self.edges:
+            raise ValueError("unknown edge %s" % edge)
+        super().__init__(preTrigger)
+        self.channel = channel
+        self.level = level
+        self.edge = edge
+
+    def hits(self, frame):
+        hit = self._hits(frame.shape[-1])
+        x = frame[self.channel, self.preTrigger:]
+        n = len(x)
+        if n < 2:
+            hit[:] = False
+            return hit
+        if self.edge is None:
+            hit[:self.preTrigger] = False
+            if self.level < 0:
+                np.less_equal(x, self.level, out=hit[self.preTrigger:])
+            else:
+                np.greater_equal(x, self.level, out=hit[self.preTrigger:])
+            return hit
+        above, tmp = self._scratch(n)
+        np.greater_equal(x, self.level, out=above)
+        # a crossing is marked on the sample after it
+        hit[:self.preTrigger+1] = False
+        edge = hit[self.preTrigger+1:]
+        if self.edge == 'rising':
+            np.greater(above[1:], above[:-1], out=edge)
+        elif self.edge == 'falling':
+            np.less(above[1:], above[:-1], out=edge)
+        else:
+            np.not_equal(above[1:], above[:-1], out=edge)
+        return hit
+
+
+class WindowTrigger(Trigger):
+    """ Fires when a channel leaves [low, high] (or enters it, if inside is True)."""
+    def __init__(self, channel, low, high, inside = False, preTrigger = 0):
+        super().__init__(preTrigger)
+        self.channel = channel
+        self.low = low
+        self.high = high
+        self.inside = inside
+
+    def hits(self, frame):
+        hit = self._hits(frame.shape[-1])
+        hit[:self.preTrigger] = False
+        x = frame[self.channel, self.preTrigger:]
+        n = len(x)
+        if n < 1:
+            return hit
+        out = hit[self.preTrigger:]
+        tmp, unused = self._scratch(n)
+        np.less(x, self.low, out=out)
+        np.greater(x, self.high, out=tmp)
+        np.logical_or(out, tmp, out=out)
+        if self.inside:
+            np.logical_not(out, out=out)
+        return hit
+
+
+class CoincidenceTrigger(Trigger):
+    """ Fires when at least n of several triggers fire within window samples.
+
+    Every hit of every trigger counts, not just the first: each
+    trigger's hits are stretched over the window samples after
+    them, and it fires at the first sample where n of those
+    overlap (i.e. where the n-th trigger comes in). With the
+    default n (None) all of them have to fire.
+    """
+    def __init__(self, triggers, n = None, window = 16):
+        super().__init__(0)
+        self.triggers = list(triggers)
+        self.n = len(self.triggers) if n is None else n
+        self.window = window
+
+    def _counts(self, numSamples):
+        if numSamples != self._length:
+            self._length = numSamples
+            # running count of hits, with a 0 in front
+            self._sum = np.zeros(numSamples + 1, np.int32)
+            self._inWindow = np.zeros(numSamples, np.int32)
+            self._active = np.zeros(numSamples, bool)
+            self._count = np.zeros(numSamples, np.int32)
+        return self._count
+
+    def hits(self, frame):
+        numSamples = frame.shape[-1]
+        count = self._counts(numSamples)
+        count[:] = 0
+        w = self.window
+        for t in self.triggers:
+            np.cumsum(t.hits(frame), out=self._sum[1:])
+            # hits in samples j-window .. j
+            self._inWindow[:] = self._sum[1:]
+            if w < numSamples:
+                self._inWindow[w:] -= self._sum[:numSamples-w]
+            np.greater(self._inWindow, 0, out=self._active)
+            count += self._active
+        return np.greater_equal(count, self.n, out=self._hits(numSamples))
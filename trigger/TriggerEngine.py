@@ -0,0 +1,137 @@
+import time
+
+from ringbuffer.RingBuffer import RingBuffer
+
+# Sits between the capture and everything else. Frames that
+# don't trigger stop here, before the spectrum, display or
+# recording ever see them, and they never touch the DAQ's ring
+# either, so the ring only ever holds frames that triggered and
+# a rare trigger doesn't get pushed out by junk.
+#
+# With a trigger condition, captures go into a small history ring
+# of our own (preTrigger + 1 frames), and when one triggers it gets
+# copied into the DAQ's ring along with the preTrigger frames
+# before it. So the copying only happens on triggers, and the DAQ's
+# ring never has a slot invalidated for a frame that's then thrown
+# away. With no condition, captures go straight into the DAQ's ring.
+class TriggerEngine:
+    """ Decides which captures get passed on.
+
+    Attributes
+    ----------
+
+    condition : trigger.Trigger
+       Trigger condition (None passes everything).
+    preTrigger : int
+       Number of frames before a triggered one to pass on too.
+    enabled : bool
+       If False, everything's passed on.
+    frames : int
+       Frames looked at.
+    triggers : int
+       Frames that triggered.
+    rejected : int
+       Frames that didn't trigger.
+    accepted : int
+       Frames passed on (triggers plus their pre-trigger history).
+    deadTime : float
+       Time (s) spent handling triggered frames, during which
+       nothing's being captured.
+
+    """
+    def __init__(self, condition = None, preTrigger = 0):
+        self.condition = condition
+        self.preTrigger = preTrigger
+        self.enabled = True
+        self.history = None
+        # begin_write() handed out the DAQ ring's slot, not the history's
+        self._direct = True
+        self.reset()
+
+    def reset(self):
+        """Zero the counters."""
+        self.frames = 0
+        self.triggers = 0
+        self.rejected = 0
+        self.accepted = 0
+        self.deadTime = 0.
+        self._lastPassed = -1
+        self._start = time.perf_counter()
+
+    @property
+    def active(self):
+        return self.enabled and self.condition is not None
+
+    def begin_write(self, ring):
+        """Buffer for the next capture: ring's next slot, or our history ring's."""
+        self._direct = not self.active
+        if self._direct:
+            return ring.begin_write()
+        if (self.history is None or
+            self.history.depth != max(self.preTrigger, 0) + 1 or
+            self.history.frames.shape[1:] != ring.frames.shape[1:]):
+            self.history = RingBuffer(max(self.preTrigger, 0) + 1,
+                                      ring.numChannels,
+                                      ring.numSamples,
+                                      ring.frames.dtype)
+            self._lastPassed = -1
+        return self.history.begin_write()
+
+    def commit(self, ring, frame):
+        """Decide about the frame from begin_write().
+
+        Returns (first, last): the frames now committed to ring that
+        should be passed on. first is -1 if it didn't trigger.
+        """
+        self.frames += 1
+        # (where the frame went was settled in begin_write(), even if
+        # the condition's been changed from the console since)
+        if self._direct:
+            seq = ring.commit()
+            self.triggers += 1
+            self.accepted += 1
+            return (seq, seq)
+        # everything goes in the history, triggered or not
+        hseq = self.history.commit()
+        condition = self.condition
+        if self.enabled and condition is not None and not condition.evaluate(frame):
+            self.rejected += 1
+            return (-1, -1)
+        self.triggers += 1
+        first = -1
+        for h in range(max(hseq - max(self.preTrigger, 0), self._lastPassed + 1), hseq + 1):
+            src = self.history.get(h)
+            if src is None:
+                continue
+            ring.begin_write()[...] = src
+            seq = ring.commit(self.history.timestamp(h))
+            if first < 0:
+                first = seq
+            self.accepted += 1
+        self._lastPassed = hseq
+        return (first, seq)
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self._start
+
+    @property
+    def rate(self):
+        """Triggers per second since reset()."""
+        elapsed = self.elapsed
+        return self.triggers/elapsed if elapsed > 0 else 0.
+
+    @property
+    def rejectedFraction(self):
+        return self.rejected/self.frames if self.frames else 0.
+
+    @property
+    def deadFraction(self):
+        elapsed = self.elapsed
+        return self.deadTime/elapsed if elapsed > 0 else 0.
+
+    def __repr__(self):
+        return ("TriggerEngine(%s): %d frames, %d triggers (%.1f Hz), "
+                "%.1f%% rejected, %.1f%% dead" %
+                (self.condition, self.frames, self.triggers, self.rate,
+                 100*self.rejectedFraction, 100*self.deadFraction))
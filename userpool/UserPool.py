@@ -0,0 +1,237 @@
+import numpy as np
+import logging
+import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+logger = logging.getLogger(__name__)
+
+# Runs user analysis off the Tk thread.
+#
+# An analysis is split into two parts: analyze(data) -> result, which
+# runs on a worker (thread or process) and must not touch Tk or
+# matplotlib, and render(result, fig, canvas), which runs back on the
+# Tk thread when the result comes in (results are picked up by polling
+# with after(), the same way ScrolledLog does its queue).
+#
+# Each job only ever has one submission in flight: if it's still busy
+# when the next frame comes along, that frame's skipped. So each job
+# only needs one input buffer, which gets reused: for thread jobs it's
+# a plain array, for process jobs it's a block of shared memory the
+# worker process maps, so the data never gets pickled.
+
+# worker-process side: the shared memory block we're attached to for
+# each job (a job gets a new block when its data changes shape)
+_attached = {}
+
+def _attach(key, name):
+    shm = _attached.get(key)
+    if shm is not None and shm.name != name:
+        try:
+            shm.close()
+        except BufferError:
+            # the analysis kept a view of it: unmapped once that goes
+            pass
+        shm = None
+    if shm is None:
+        shm = _open(name)
+        _attached[key] = shm
+    return shm
+
+def _open(name):
+    """Attach to a job's block without owning it (the job unlinks it)."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    # Before Python 3.13 attaching registers the block with the
+    # resource tracker. Pool workers normally share the tracker of the
+    # process that made the pool, where the job's already registered
+    # it, and mustn't unregister it there. A worker that starts a
+    # tracker of its own would have that one remove the block when the
+    # worker exits, so it's unregistered from that one, the way
+    # FrameBusReader's attach() does.
+    from multiprocessing import resource_tracker
+    own = os.name == 'posix' and resource_tracker._resource_tracker._fd is None
+    shm = shared_memory.SharedMemory(name=name)
+    if own:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+def _run_shared(fn, key, name, shape, dtype):
+    shm = _attach(key, name)
+    data = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    return fn(data)
+
+
+class UserJob:
+    """ One user analysis and its counters.
+
+    Attributes
+    ----------
+
+    name : str
+       Name for logging.
+    analyze : callable
+       analyze(data) -> result, run on a worker.
+    render : callable
+       render(result) run on the Tk thread (None to do nothing).
+    budget : float
+       Latency budget (s) from submission to result. It's advisory:
+       nothing is dropped or cancelled for going over it, results
+       over budget are still rendered, just counted in overruns
+       (and the first one logged).
+    process : bool
+       Run in a separate process (analyze must be picklable, i.e.
+       a module-level function).
+    busy : bool
+       A submission's in flight.
+    submitted, completed, skipped, overruns, errors : int
+       Counters.
+    latency : float
+       Latency (s) of the last completed submission, from submit()
+       to the worker finishing (so not counting the wait for poll()).
+
+    """
+    def __init__(self, analyze, render=None, budget=None, process=False, name=None):
+        self.analyze = analyze
+        self.render = render
+        self.budget = budget
+        self.process = process
+        self.name = name if name is not None else getattr(analyze, '__name__', 'analysis')
+        self.busy = False
+        self.submitted = 0
+        self.completed = 0
+        self.skipped = 0
+        self.overruns = 0
+        self.errors = 0
+        self.latency = 0.
+        self._buffer = None
+        self._shm = None
+        self._warned = False
+
+    def _stage(self, data):
+        # copy data into our (reused) input buffer
+        if self.process:
+            if self._shm is None or self._shm.size < data.nbytes or self._buffer.shape != data.shape:
+                self.close()
+                self._shm = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+                self._buffer = np.ndarray(data.shape, dtype=data.dtype, buffer=self._shm.buf)
+        elif self._buffer is None or self._buffer.shape != data.shape or self._buffer.dtype != data.dtype:
+            self._buffer = np.empty_like(data)
+        np.copyto(self._buffer, data)
+
+    def close(self):
+        self._buffer = None
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def __repr__(self):
+        return ("UserJob(%s): %d submitted, %d completed, %d skipped, %d over budget, "
+                "%d errors, last latency %.1f ms" %
+                (self.name, self.submitted, self.completed, self.skipped,
+                 self.overruns, self.errors, 1.E3*self.latency))
+
+
+class UserPool:
+    """ Thread (and process) pool for user analysis.
+
+    Attributes
+    ----------
+
+    workers : int
+       Number of worker threads.
+    processes : int
+       Number of worker processes (started the first time a
+       process job is submitted).
+    interval : int
+       Result polling interval (ms).
+
+    """
+    def __init__(self, widget, workers=2, processes=None, interval=50):
+        self.widget = widget
+        self.workers = workers
+        self.processes = processes
+        self.interval = interval
+        self._threads = ThreadPoolExecutor(workers, thread_name_prefix="rfsoc-user")
+        self._procs = None
+        self._results = queue.SimpleQueue()
+        self.jobs = []
+        self.widget.after(self.interval, self.poll)
+
+    def job(self, analyze, render=None, budget=None, process=False, name=None):
+        """Make a new UserJob (see UserJob for the arguments)."""
+        job = UserJob(analyze, render, budget, process, name)
+        self.jobs.append(job)
+        return job
+
+    def remove(self, job):
+        if job in self.jobs:
+            self.jobs.remove(job)
+        if not job.busy:
+            job.close()
+
+    def submit(self, job, data):
+        """Run job on data unless it's still busy. Returns False if skipped."""
+        if job.busy:
+            job.skipped += 1
+            return False
+        job._stage(data)
+        job.busy = True
+        job.submitted += 1
+        start = time.perf_counter()
+        if job.process:
+            if self._procs is None:
+                self._procs = ProcessPoolExecutor(self.processes)
+            future = self._procs.submit(_run_shared, job.analyze, id(job), job._shm.name,
+                                        job._buffer.shape, job._buffer.dtype.str)
+        else:
+            future = self._threads.submit(job.analyze, job._buffer)
+        # timed here, not in poll(), which would add up to an interval
+        future.add_done_callback(
+            lambda f: self._results.put((job, f, time.perf_counter() - start)))
+        return True
+
+    def poll(self):
+        """Hand finished results to their render functions. Runs on the Tk thread."""
+        while True:
+            try:
+                job, future, latency = self._results.get(block=False)
+            except queue.Empty:
+                break
+            job.busy = False
+            job.latency = latency
+            try:
+                result = future.result()
+            except Exception as e:
+                job.errors += 1
+                logger.error("user analysis '%s' failed: %s" % (job.name, str(e)))
+                continue
+            job.completed += 1
+            if job.budget is not None and job.latency > job.budget:
+                job.overruns += 1
+                if not job._warned:
+                    logger.warning("user analysis '%s' took %.1f ms, over its %.1f ms budget" %
+                                   (job.name, 1.E3*job.latency, 1.E3*job.budget))
+                    job._warned = True
+            if job not in self.jobs:
+                job.close()
+                continue
+            if job.render is not None:
+                try:
+                    job.render(result)
+                except Exception as e:
+                    job.errors += 1
+                    logger.error("user render for '%s' failed: %s" % (job.name, str(e)))
+        self.widget.after(self.interval, self.poll)
+
+    def shutdown(self):
+        self._threads.shutdown(wait=False, cancel_futures=True)
+        if self._procs is not None:
+            self._procs.shutdown(wait=False, cancel_futures=True)
+        for job in self.jobs:
+            job.close()
@@ -0,0 +1,146 @@
+import tkinter as tk
+from tkinter import ttk
+
+import math
+
+# Pages of per-channel displays.
+#
+# With lots of channels there's no point building (or drawing) a
+# Waveframe for every one of them when only a few fit on the
+# screen: this shows columns x rows of them at a time, with
+# buttons to page through the rest. A channel's display is only
+# created the first time it's shown (or asked for, as grid[ch]),
+# and only the ones on the current page get drawn, so startup
+# and the cost of each frame depend on the page size, not on
+# the number of channels. Displays that exist but are on other
+# pages still get every frame, without drawing it, so a user
+# callback or analysis set on grid[ch] keeps running whichever
+# page is showing.
+class ChannelGrid(ttk.Frame):
+    """ Paged grid of channel displays.
+
+    grid[ch] is channel ch's display (created if need be).
+
+    Attributes
+    ----------
+
+    numChannels : int
+       Number of channels.
+    factory : callable
+       factory(parent, channel) creates a channel's display.
+    columns : int
+       Displays across a page.
+    rows : int
+       Displays down a page.
+    page : int
+       Page being shown.
+
+    """
+    def __init__(self, parent, numChannels, factory, columns=4, rows=1):
+        super().__init__(parent)
+        self.numChannels = numChannels
+        self.factory = factory
+        self.columns = max(1, min(columns, numChannels))
+        self.rows = max(1, rows)
+        self.page = 0
+        # set by build(): from then on a new page's displays get built as they're shown
+        self._built = False
+        self._displays = [ None ]*numChannels
+        # last thing we were asked to plot, to catch up a new page
+        self._last = None
+        self._grid = ttk.Frame(self)
+        self._grid.pack(side=tk.TOP)
+        self._label = None
+        if self.pages > 1:
+            bar = ttk.Frame(self)
+            ttk.Button(bar, text='<', width=3,
+                       command=lambda: self.set_page(self.page-1)).pack(side=tk.LEFT)
+            self._label = ttk.Label(bar)
+            self._label.pack(side=tk.LEFT, padx=10)
+            ttk.Button(bar, text='>', width=3,
+                       command=lambda: self.set_page(self.page+1)).pack(side=tk.LEFT)
+            bar.pack(side=tk.BOTTOM)
+        self.set_page(0)
+
+    @property
+    def perPage(self):
+        return self.columns*self.rows
+
+    @property
+    def pages(self):
+        return int(math.ceil(self.numChannels/self.perPage))
+
+    def __len__(self):
+        return self.numChannels
+
+    def __getitem__(self, channel):
+        if channel < 0:
+            channel += self.numChannels
+        if channel < 0 or channel >= self.numChannels:
+            raise IndexError("no channel %d" % channel)
+        if self._displays[channel] is None:
+            self._displays[channel] = self.factory(self._grid, channel)
+        return self._displays[channel]
+
+    def __iter__(self):
+        for channel in range(self.numChannels):
+            yield self[channel]
+
+    def visible(self):
+        """Channels on the current page."""
+        start = self.page*self.perPage
+        return list(range(start, min(start + self.perPage, self.numChannels)))
+
+    def set_page(self, page):
+        """Show another page of channels."""
+        page = max(0, min(page, self.pages-1))
+        for channel in self.visible():
+            if self._displays[channel] is not None:
+                self._displays[channel].grid_remove()
+        self.page = page
+        for i, channel in enumerate(self.visible()):
+            self[channel].grid(row=i//self.columns, column=i%self.columns)
+            if self._built:
+                self[channel].build()
+        if self._label is not None:
+            channels = self.visible()
+            self._label.configure(text="channels %d-%d of %d" %
+                                  (channels[0], channels[-1], self.numChannels))
+        if self._last is not None:
+            for channel in self.visible():
+                self._plot(channel, True)
+
+    def build(self):
+        """Build the figures of the displays on the current page."""
+        self._built = True
+        for channel in self.visible():
+            self[channel].build()
+
+    def rescale(self):
+        for channel in self.visible():
+            self[channel].rescale()
+
+    def plot(self, frame, freqs=None, spectrum=None, waterfall=None):
+        """Plot a (numChannels, numSamples) frame on the current page.
+
+        spectrum is (numChannels, bins) dBFS and waterfall is the
+        (numChannels, depth, columns) history, if there are any.
+        Displays on other pages get it too (see Waveframe.plot's
+        shown), for their user callbacks and analyses.
+        """
+        self._last = (frame, freqs, spectrum, waterfall)
+        visible = set(self.visible())
+        for channel in range(self.numChannels):
+            # (a display that's never been shown or asked for has
+            # nothing set on it to feed)
+            if self._displays[channel] is not None:
+                self._plot(channel, channel in visible)
+
+    def _plot(self, channel, shown):
+        frame, freqs, spectrum, waterfall = self._last
+        if spectrum is None:
+            self[channel].plot(frame[channel], shown=shown)
+        else:
+            self[channel].plot(frame[channel], freqs, spectrum[channel],
+                               None if waterfall is None else waterfall[channel],
+                               shown=shown)
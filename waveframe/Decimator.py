@@ -0,0 +1,85 @@
+import numpy as np
+import math
+
+# Min/max display decimation.
+#
+# There's no point handing a million points to matplotlib for a
+# plot a few hundred pixels wide. Instead the visible part of the
+# trace is chopped into one chunk per pixel column, and each chunk
+# is replaced by its min and max (a vertical stroke), so a single
+# sample glitch still shows up. The chopping is a reshape and
+# a min/max along one axis into preallocated buffers, so it's
+# cheap enough to do every frame. When the view is narrow enough
+# that there's fewer than 2 samples per column, the raw samples
+# are used instead.
+class Decimator:
+    """ Min/max decimation of a trace for display.
+
+    Attributes
+    ----------
+
+    columns : int
+       Number of pixel columns to decimate to.
+    length : int
+       Length of the trace being decimated.
+    dx : float
+       x spacing of the trace samples.
+    full : bool
+       True if the view covers the whole trace.
+    x : numpy.ndarray
+       x values of the decimated (or raw) points in the view.
+
+    """
+    def __init__(self, columns=300):
+        self.columns = columns
+        self.length = 0
+        self.dx = 1.
+        self.full = True
+        self.x = np.zeros(0)
+        self._start = 0
+        self._stop = 0
+        self._chunk = 1
+        self._y = np.zeros(0)
+
+    def set_length(self, length, dx, columns=None):
+        """New trace length/spacing: go back to the full view."""
+        self.length = length
+        self.dx = dx
+        self.set_view(None, None, columns)
+
+    def set_view(self, lo, hi, columns=None):
+        """Decimate only the samples between x = lo and x = hi (None = edge)."""
+        if columns is not None and columns > 0:
+            self.columns = columns
+        start = 0 if lo is None else max(0, int(math.floor(lo/self.dx)))
+        stop = self.length if hi is None else min(self.length, int(math.ceil(hi/self.dx))+1)
+        stop = max(stop, start+1)
+        self._start = start
+        self._stop = stop
+        self.full = (start == 0 and stop == self.length)
+        n = stop - start
+        if n <= 2*self.columns:
+            self._chunk = 1
+            self.x = np.arange(start, stop)*self.dx
+            return
+        self._chunk = int(math.ceil(n/self.columns))
+        ncol = int(math.ceil(n/self._chunk))
+        # each column is drawn as (start, min), (start, max)
+        self.x = np.repeat(np.arange(start, stop, self._chunk)*self.dx, 2)
+        self._y = np.zeros(2*ncol)
+
+    def __call__(self, data):
+        """Returns the decimated y values of data for the current view."""
+        data = data[self._start:self._stop]
+        if self._chunk == 1:
+            return data
+        n = len(data)
+        whole = n//self._chunk
+        body = data[:whole*self._chunk].reshape(whole, self._chunk)
+        np.min(body, axis=1, out=self._y[0:2*whole:2])
+        np.max(body, axis=1, out=self._y[1:2*whole:2])
+        if whole*self._chunk < n:
+            tail = data[whole*self._chunk:]
+            self._y[-2] = tail.min()
+            self._y[-1] = tail.max()
+        return self._y
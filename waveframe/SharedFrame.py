@@ -0,0 +1,192 @@
+import tkinter as tk
+from tkinter import ttk
+import numpy as np
+
+import math
+
+from waveframe.Decimator import Decimator
+# matplotlib's imported when the first figure's built: Figure and
+# FigureCanvasTkAgg are looked up in waveframe.Waveframe then
+import waveframe.Waveframe
+from waveframe.Waveframe import _dpi, import_matplotlib
+
+# Every channel in one figure.
+#
+# The alternative to a grid of Waveframes for lots of channels:
+# one Time figure and one Freq figure, with a small subplot per
+# channel. A new frame swaps every line's data and blits them
+# all over one cached background with a single blit, so there's
+# one canvas update per frame however many channels there are.
+# The figures are only built the first time they're shown or
+# drawn on (or build() is called).
+# There's no toolbar (zooming) or User tab here: use the grid
+# layout for those.
+class SharedFrame(ttk.Notebook):
+    tabs = ( 'time', 'freq' )
+
+    def __init__(self,
+                 parent,
+                 numChannels,
+                 sampleRate=3.E9,
+                 columns=4,
+                 figsize=(3,2)):
+        self.numChannels = numChannels
+        self.sampleRate = sampleRate
+        self.columns = max(1, min(columns, numChannels))
+        self.rows = int(math.ceil(numChannels/self.columns))
+        self.figsize = (figsize[0]*self.columns, figsize[1]*self.rows)
+        super().__init__(parent)
+        # the size the figures will be, so nothing moves when they're built
+        self._tabFrames = { name : ttk.Frame(self,
+                                             width=int(self.figsize[0]*_dpi),
+                                             height=int(self.figsize[1]*_dpi))
+                            for name in self.tabs }
+        self.add(self._tabFrames['time'], text='Time')
+        self.add(self._tabFrames['freq'], text='Freq')
+        self.bind('<<NotebookTabChanged>>', self._on_tab_changed)
+        self.figs = {}
+        self.canvs = {}
+        self.axes = {}
+        self.lines = {}
+        self._decimators = {}
+        self._backgrounds = {}
+        # last thing we were asked to plot, to catch up hidden tabs
+        self._data = None
+        self._freqs = None
+        self._spectrum = None
+        self._stale = { name : False for name in self.tabs }
+
+    def build(self):
+        """Build the visible tab's figure now, if it isn't already."""
+        self._build(self.visible())
+
+    def _build(self, name):
+        if name in self.figs:
+            return
+        import_matplotlib()
+        fig = waveframe.Waveframe.Figure(figsize=self.figsize)
+        canvas = waveframe.Waveframe.FigureCanvasTkAgg(fig, master=self._tabFrames[name])
+        self.figs[name] = fig
+        self.canvs[name] = canvas
+        self.axes[name] = [ fig.add_subplot(self.rows, self.columns, ch+1)
+                            for ch in range(self.numChannels) ]
+        self.lines[name] = [ None ]*self.numChannels
+        self._decimators[name] = [ Decimator() for ch in range(self.numChannels) ]
+        self._backgrounds[name] = None
+        self._label(name)
+        canvas.mpl_connect('draw_event',
+                           lambda event, name=name: self._on_draw(name))
+        canvas.draw()
+        canvas.get_tk_widget().pack()
+
+    def _label(self, name):
+        for ch, ax in enumerate(self.axes[name]):
+            ax.set_title('ch%d' % ch, fontsize='small')
+            ax.tick_params(labelsize='x-small')
+        fig = self.figs[name]
+        fig.supxlabel('ns' if name == 'time' else 'MHz', fontsize='small')
+        if name == 'freq':
+            fig.supylabel('dBFS', fontsize='small')
+        fig.tight_layout()
+
+    def visible(self):
+        """Name of the currently selected tab."""
+        return self.tabs[self.index(self.select())]
+
+    def rescale(self):
+        """Forget the y limits: they'll be refit on the next plot."""
+        for name in self.figs:
+            for ax in self.axes[name]:
+                ax.clear()
+            self.lines[name] = [ None ]*self.numChannels
+            self._label(name)
+            self._stale[name] = True
+        self._redraw(self.visible())
+
+    def plot(self, frame, freqs=None, spectrum=None, waterfall=None):
+        """Plot a (numChannels, numSamples) frame (and its spectrum)."""
+        self._data = frame
+        self._freqs = freqs
+        self._spectrum = spectrum
+        for name in self.tabs:
+            self._stale[name] = True
+        self._redraw(self.visible())
+
+    def _redraw(self, name):
+        if not self._stale[name] or self._data is None:
+            return
+        if name == 'time':
+            y = self._data
+            # we want this in nanoseconds, so divide samplerate by 1E9
+            dx = 1.E9/self.sampleRate
+            margin = 0.
+        else:
+            if self._spectrum is None:
+                return
+            y = self._spectrum
+            dx = (self._freqs[1] - self._freqs[0])/1.E6
+            margin = 10.
+        self._build(name)
+        self._stale[name] = False
+        full = False
+        for ch in range(self.numChannels):
+            if self._update_line(name, ch, y[ch], dx, margin):
+                full = True
+        if full:
+            self.canvs[name].draw()
+        else:
+            self._blit(name)
+
+    def _update_line(self, name, ch, y, dx, margin):
+        # returns True if the axes changed, so it needs a full draw
+        ax = self.axes[name][ch]
+        line = self.lines[name][ch]
+        dec = self._decimators[name][ch]
+        if line is None or dec.length != len(y) or dec.dx != dx:
+            dec.set_length(len(y), dx, int(ax.bbox.width))
+            yd = dec(y)
+            if line is None:
+                line, = ax.plot(dec.x, yd, animated=True)
+                self.lines[name][ch] = line
+            else:
+                line.set_data(dec.x, yd)
+            ymin = np.min(yd)
+            ymax = np.max(yd)
+            ax.set_xlim(0, (len(y)-1)*dx)
+            pad = max(margin, 0.05*(ymax-ymin), 1.)
+            ax.set_ylim(ymin-pad, ymax+pad)
+            return True
+        yd = dec(y)
+        line.set_data(dec.x, yd)
+        ymin = np.min(yd)
+        ymax = np.max(yd)
+        lo, hi = ax.get_ylim()
+        if ymin < lo or ymax > hi:
+            pad = max(margin, 0.05*(ymax-ymin), 1.)
+            ax.set_ylim(min(lo, ymin-pad), max(hi, ymax+pad))
+            return True
+        return False
+
+    def _blit(self, name):
+        canvas = self.canvs[name]
+        if self._backgrounds[name] is None:
+            canvas.draw()
+            return
+        canvas.restore_region(self._backgrounds[name])
+        for ax, line in zip(self.axes[name], self.lines[name]):
+            if line is not None:
+                ax.draw_artist(line)
+        canvas.blit(self.figs[name].bbox)
+
+    def _on_draw(self, name):
+        # full draw happened, so grab the new background and put the lines back
+        canvas = self.canvs[name]
+        self._backgrounds[name] = canvas.copy_from_bbox(self.figs[name].bbox)
+        for ax, line in zip(self.axes[name], self.lines[name]):
+            if line is not None:
+                ax.draw_artist(line)
+
+    def _on_tab_changed(self, event):
+        if self.figs:
+            self._build(self.visible())
+        self._redraw(self.visible())
@@ -4,44 +4,155 @@ import numpy as np
 
 import logging
 
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from matplotlib.backends.backend_tkagg import NavigationToolbar2Tk
-from matplotlib.backend_bases import key_press_handler
-from matplotlib.figure import Figure
+from waveframe.Decimator import Decimator
 
+# matplotlib (with its Tk backend) takes longer to import than
+# everything else put together, so it isn't imported until the
+# first figure's built: the window can be up before then.
+Figure = None
+FigureCanvasTkAgg = None
+NavigationToolbar2Tk = None
+# matplotlib's default dpi, to size the tabs before there's a figure in them
+_dpi = 100
+
+def import_matplotlib():
+    """Import the parts of matplotlib the displays use (once)."""
+    global Figure, FigureCanvasTkAgg, NavigationToolbar2Tk
+    if Figure is None:
+        from matplotlib.figure import Figure
+    if FigureCanvasTkAgg is None:
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+    if NavigationToolbar2Tk is None:
+        from matplotlib.backends.backend_tkagg import NavigationToolbar2Tk
+
+# The Time and Freq plots are built once: the axes and lines
+# stick around, and a new frame just swaps the line data and
+# blits the lines over a cached copy of the background (axes,
+# ticks, labels), following matplotlib's blitting tutorial.
+# The background only gets redrawn when something other than
+# the lines changes (resize, rescale). Only the visible tab is
+# redrawn: switching tabs catches the new one up. A tab's figure
+# isn't even built until the first time it's shown or drawn on
+# (or build() is called), so lots of Waveframes start up quickly
+# and the window can be shown before any figure exists.
+#
+# Long traces are min/max decimated down to the width of the
+# plot in pixels (see Decimator). Zooming or panning with the
+# toolbar re-decimates just the visible range, so zooming in far
+# enough gets you the raw samples.
+#
+# The Waterfall tab shows the DAQ's spectrum.Waterfall history as
+# one image: new frames just swap the image's data and blit it,
+# the same way as the lines.
+#
+# The User tab can either have a plain user_callback, which runs
+# right here on the Tk thread, or a user analysis that runs on a
+# worker from the DAQ's userpool.UserPool and gets drawn when its
+# result comes back.
 class Waveframe(ttk.Notebook):
+    tabs = ( 'time', 'freq', 'waterfall', 'user' )
+
+    # dict that builds a tab when you ask for something in it
+    class Tabs(dict):
+        def __init__(self, build):
+            super().__init__()
+            self._build = build
+
+        def __missing__(self, name):
+            self._build(name)
+            return dict.__getitem__(self, name)
+
     def __init__(self,
                  parent,
                  sampleRate=3.E9,
-                 figsize=(3,2)):
+                 figsize=(3,2),
+                 pool=None):
         self.sampleRate = sampleRate
+        self.pool = pool
         super().__init__(parent)
-        self.td = ttk.Frame(self)
-        self.fd = ttk.Frame(self)
-        self.user = ttk.Frame(self)
-        # now add a matplotlib canvas in each one
-        self.figs = {}
-        self.figs['time'] = Figure(figsize=figsize)
-        self.figs['freq'] = Figure(figsize=figsize)
-        self.figs['user'] = Figure(figsize=figsize)
-        self.canvs = {}
-        self.canvs['time'] = FigureCanvasTkAgg(self.figs['time'],
-                                               master=self.td)
-        self.canvs['freq'] = FigureCanvasTkAgg(self.figs['freq'],
-                                               master=self.fd)
-        self.canvs['user'] = FigureCanvasTkAgg(self.figs['user'],
-                                               master=self.user)
-        self.canvs['time'].draw()
-        self.canvs['time'].get_tk_widget().pack()
-        self.canvs['freq'].draw()
-        self.canvs['freq'].get_tk_widget().pack()
-        self.canvs['user'].draw()
-        self.canvs['user'].get_tk_widget().pack()
+        self.figsize = figsize
+        # the size the figure will be, so nothing moves when it's built
+        size = { 'width' : int(figsize[0]*_dpi), 'height' : int(figsize[1]*_dpi) }
+        self.td = ttk.Frame(self, **size)
+        self.fd = ttk.Frame(self, **size)
+        self.wfall = ttk.Frame(self, **size)
+        self.user = ttk.Frame(self, **size)
+        self._tabFrames = { 'time' : self.td,
+                            'freq' : self.fd,
+                            'waterfall' : self.wfall,
+                            'user' : self.user }
+        # The matplotlib canvas in each tab only gets built when
+        # it's first needed (see _build), normally the first time
+        # the tab's selected. figs/canvs build it if you ask for it.
+        self.figs = self.Tabs(self._build)
+        self.canvs = self.Tabs(self._build)
+        self.axes = {}
+        self.toolbars = {}
+        self._backgrounds = {}
+        self._decimators = {}
+        self._settingLimits = False
+        # the waterfall image lives in lines too, so it blits the same way
+        self.lines = { 'time' : None, 'freq' : None, 'waterfall' : None }
+        # dBFS range of the waterfall colors
+        self.clim = (-120., 0.)
         self.add(self.td, text='Time')
         self.add(self.fd, text='Freq')
+        self.add(self.wfall, text='Waterfall')
         self.add(self.user, text='User')
+        self.bind('<<NotebookTabChanged>>', self._on_tab_changed)
+        # last thing we were asked to plot, to catch up hidden tabs
+        self._data = None
+        self._freqs = None
+        self._spectrum = None
+        self._waterfall = None
+        self._stale = { name : False for name in self.tabs }
         # Callback signature is data, figure, canvas
         self.user_callback = None
+        # see set_user_analysis
+        self.user_job = None
+        # (render, result) the User tab hasn't drawn yet
+        self._userResult = None
+
+    def build(self):
+        """Build the visible tab's figure now, if it isn't already."""
+        self._build(self.visible())
+
+    def _build(self, name):
+        """Build the figure/canvas (and axes, toolbar...) in a tab."""
+        if dict.__contains__(self.figs, name):
+            return
+        import_matplotlib()
+        fig = Figure(figsize=self.figsize)
+        canvas = FigureCanvasTkAgg(fig, master=self._tabFrames[name])
+        dict.__setitem__(self.figs, name, fig)
+        dict.__setitem__(self.canvs, name, canvas)
+        if name in ( 'time', 'freq', 'waterfall' ):
+            self.axes[name] = fig.add_subplot(111)
+            self._backgrounds[name] = None
+            canvas.mpl_connect('draw_event',
+                               lambda event, name=name: self._on_draw(name))
+        if name in ( 'time', 'freq' ):
+            self._decimators[name] = Decimator()
+            self.axes[name].callbacks.connect('xlim_changed',
+                                              lambda ax, name=name: self._on_xlim(name))
+            self.toolbars[name] = NavigationToolbar2Tk(canvas,
+                                                       canvas.get_tk_widget().master,
+                                                       pack_toolbar=False)
+        self._label(name)
+        canvas.draw()
+        if name in self.toolbars:
+            self.toolbars[name].pack(side=tk.BOTTOM, fill=tk.X)
+        canvas.get_tk_widget().pack()
+
+    def _label(self, name):
+        if name == 'time':
+            self.axes['time'].set_xlabel('ns')
+        elif name == 'freq':
+            self.axes['freq'].set_xlabel('MHz')
+            self.axes['freq'].set_ylabel('dBFS')
+        elif name == 'waterfall':
+            self.axes['waterfall'].set_xlabel('MHz')
+            self.axes['waterfall'].set_ylabel('spectra ago')
 
     def set_user_callback(self, fn):
         if fn is None:
@@ -51,26 +162,215 @@ class Waveframe(ttk.Notebook):
             logging.debug("adding user_callback %s" % fn.__name__)
             self.user_callback = fn
 
-    # Pass data to this, and it'll plot in
-    # time domain/freq domain/user pane
-    def plot(self, data):
-        self.figs['time'].clear()
-        self.figs['freq'].clear()
+    def set_user_analysis(self, analyze, render=None, budget=None, process=False):
+        """Run analyze(data) on a worker and draw the result in the User tab.
+
+        render(result, fig, canvas) draws it on the Tk thread: the
+        default just plots the result. budget is the latency budget in
+        seconds. With process=True, analyze runs in a separate process
+        (so it has to be a module-level function) and gets the data
+        through shared memory. Pass None to remove it.
+        """
+        if self.user_job is not None:
+            logging.debug("removing user analysis %s" % self.user_job.name)
+            self.pool.remove(self.user_job)
+            self.user_job = None
+            self._userResult = None
+        if analyze is None:
+            return
+        if self.pool is None:
+            logging.error("no worker pool for user analysis")
+            return
+        self.user_job = self.pool.job(analyze,
+                                      lambda result: self._render_user(render, result),
+                                      budget, process)
+        logging.debug("adding user analysis %s" % self.user_job.name)
+
+    def _render_user(self, render, result):
+        # results come in whatever tab's showing, but only get
+        # drawn once the User tab is (the newest one, that is)
+        self._userResult = (render, result)
+        if self.visible() == 'user':
+            self._draw_user()
+        else:
+            self._stale['user'] = True
+
+    def _draw_user(self):
+        render, result = self._userResult
+        self._userResult = None
         self.figs['user'].clear()
-        # we want this in nanoseconds, so divide samplerate by 1E9
-        samplePeriod = 1.E9/self.sampleRate
-        xaxis = np.arange(len(data))*samplePeriod
-        self.figs['time'].add_subplot(111).plot(xaxis, data)
-
-        self.canvs['time'].draw()
-        
-        # figure out FFT stuff here
-        
-
-        if callable(self.user_callback):
-            try:
-                self.user_callback(data,
-                                   self.figs['user'],
-                                   self.canvs['user'])
-            except TypeError:
-                logging.error("user_callback '%s' type error: check arguments (data, fig, canvas)" % self.user_callback.__name__)        
+        if render is None:
+            self.figs['user'].add_subplot(111).plot(result)
+        else:
+            render(result, self.figs['user'], self.canvs['user'])
+        self.canvs['user'].draw()
+
+    def set_clim(self, low, high):
+        """Set the dBFS range of the waterfall colors."""
+        self.clim = (low, high)
+        if self.lines['waterfall'] is not None:
+            self.lines['waterfall'].set_clim(low, high)
+            self.canvs['waterfall'].draw()
+
+    def visible(self):
+        """Name of the currently selected tab."""
+        return self.tabs[self.index(self.select())]
+
+    def rescale(self):
+        """Forget the y limits: they'll be refit on the next plot."""
+        for name in ( 'time', 'freq' ):
+            if name not in self.axes:
+                continue
+            self.lines[name] = None
+            self.axes[name].clear()
+            self._label(name)
+            self._stale[name] = True
+        self._redraw(self.visible())
+
+    # Pass data to this, and it'll plot in
+    # time domain/freq domain/user pane.
+    # The spectrum's computed elsewhere (see spectrum.Spectrum)
+    # for all channels at once, so pass in the frequency axis (Hz)
+    # and this channel's power (dBFS) if you've got them, and
+    # this channel's spectrum.Waterfall view for the Waterfall tab.
+    # Only the visible tab is actually drawn, but a user analysis
+    # (see set_user_analysis) gets every frame wherever you're looking.
+    # shown=False is for a display that isn't on screen at all (see
+    # ChannelGrid): nothing's drawn but the User tab, if that's the
+    # tab it's on, so user callbacks and analyses still see every frame.
+    def plot(self, data, freqs=None, spectrum=None, waterfall=None, shown=True):
+        self._data = data
+        self._freqs = freqs
+        self._spectrum = spectrum
+        self._waterfall = waterfall
+        for name in self.tabs:
+            self._stale[name] = True
+        if self.user_job is not None:
+            self.pool.submit(self.user_job, data)
+        if shown or self.visible() == 'user':
+            self._redraw(self.visible())
+
+    def _redraw(self, name):
+        if not self._stale[name] or self._data is None:
+            return
+        self._build(name)
+        self._stale[name] = False
+        if name == 'time':
+            # we want this in nanoseconds, so divide samplerate by 1E9
+            samplePeriod = 1.E9/self.sampleRate
+            self._update_line('time', self._data, samplePeriod, 0.)
+        elif name == 'freq':
+            if self._spectrum is None:
+                return
+            df = (self._freqs[1] - self._freqs[0])/1.E6
+            self._update_line('freq', self._spectrum, df, 10.)
+        elif name == 'waterfall':
+            if self._waterfall is None or self._freqs is None:
+                return
+            self._update_image('waterfall', self._waterfall, self._freqs[-1]/1.E6)
+        elif self.user_job is not None:
+            if self._userResult is not None:
+                self._draw_user()
+        else:
+            self.figs['user'].clear()
+            if callable(self.user_callback):
+                try:
+                    self.user_callback(self._data,
+                                       self.figs['user'],
+                                       self.canvs['user'])
+                except TypeError:
+                    logging.error("user_callback '%s' type error: check arguments (data, fig, canvas)" % self.user_callback.__name__)
+
+    def _update_line(self, name, y, dx, margin):
+        ax = self.axes[name]
+        line = self.lines[name]
+        dec = self._decimators[name]
+        lo, hi = ax.get_ylim()
+        if line is None or dec.length != len(y) or dec.dx != dx:
+            # new line (or new length): this is the only
+            # place the x axis gets built
+            dec.set_length(len(y), dx, int(ax.bbox.width))
+            yd = dec(y)
+            ymin = np.min(yd)
+            ymax = np.max(yd)
+            if line is None:
+                line, = ax.plot(dec.x, yd, animated=True)
+                self.lines[name] = line
+            else:
+                line.set_data(dec.x, yd)
+            self._settingLimits = True
+            ax.set_xlim(0, (len(y)-1)*dx)
+            self._settingLimits = False
+            pad = max(margin, 0.05*(ymax-ymin), 1.)
+            ax.set_ylim(ymin-pad, ymax+pad)
+            self.toolbars[name].update()
+            self.canvs[name].draw()
+            return
+        yd = dec(y)
+        line.set_data(dec.x, yd)
+        ymin = np.min(yd)
+        ymax = np.max(yd)
+        if dec.full and (ymin < lo or ymax > hi):
+            # off the plot: the axes need to grow, which
+            # means a full redraw (the ticks change). Don't
+            # fight the user if they've zoomed in, though.
+            pad = max(margin, 0.05*(ymax-ymin), 1.)
+            ax.set_ylim(min(lo, ymin-pad), max(hi, ymax+pad))
+            self.canvs[name].draw()
+        else:
+            self._blit(name)
+
+    def _update_image(self, name, z, xmax):
+        ax = self.axes[name]
+        image = self.lines[name]
+        if image is None or image.get_array().shape != z.shape:
+            # new image (or new depth/binning)
+            if image is not None:
+                image.remove()
+            image = ax.imshow(z, origin='lower', aspect='auto',
+                              interpolation='nearest',
+                              extent=(0, xmax, -len(z), 0),
+                              vmin=self.clim[0], vmax=self.clim[1],
+                              animated=True)
+            self.lines[name] = image
+            self.canvs[name].draw()
+            return
+        image.set_data(z)
+        self._blit(name)
+
+    def _on_xlim(self, name):
+        # zoom/pan/home from the toolbar: re-decimate for the new view.
+        # The toolbar does the redraw.
+        if self._settingLimits or self.lines[name] is None:
+            return
+        ax = self.axes[name]
+        lo, hi = ax.get_xlim()
+        dec = self._decimators[name]
+        dec.set_view(lo, hi, int(ax.bbox.width))
+        y = self._data if name == 'time' else self._spectrum
+        if y is not None and len(y) == dec.length:
+            self.lines[name].set_data(dec.x, dec(y))
+
+    def _blit(self, name):
+        canvas = self.canvs[name]
+        if self._backgrounds[name] is None:
+            canvas.draw()
+            return
+        canvas.restore_region(self._backgrounds[name])
+        self.axes[name].draw_artist(self.lines[name])
+        canvas.blit(self.figs[name].bbox)
+
+    def _on_draw(self, name):
+        # full draw happened (ours, a resize, the toolbar...)
+        # so grab the new background and put the line back
+        canvas = self.canvs[name]
+        self._backgrounds[name] = canvas.copy_from_bbox(self.figs[name].bbox)
+        if self.lines[name] is not None:
+            self.axes[name].draw_artist(self.lines[name])
+
+    def _on_tab_changed(self, event):
+        # (the first tab getting selected when it's added doesn't
+        # count: that waits for build() or the first plot)
+        if len(self.figs):
+            self._build(self.visible())
+        self._redraw(self.visible())